@@ -54,6 +54,15 @@ def common_save_mat(data, fname):
     sio.savemat(fname, {'data': data})
 
 
+def process_trials_batch(trials, func, **kwargs):
+    # Runs the function once on the data of all the given trials. It
+    # must return one result for each trial, and the results are used
+    # as they are in PupilTrial.process_trial.
+    results = func([trial.get_matrix() for trial in trials], **kwargs)
+    for trial, data in zip(trials, results):
+        trial.set_processed(data)
+
+
 class CommonPupilData:
     def __init__(self, all_data, name):
 
@@ -290,7 +299,17 @@ class PupilDatasets(CommonPupilData):
             if not dset: continue
             dset.reject_trials(trials, trigger, datastream_names=datastream_names)
 
-    def process_trials(self, func, **kwargs):
+    def get_trials(self):
+        trials = []
+        for _, dset in self.datasets.items():
+            if not dset: continue
+            trials.extend(dset.get_trials())
+        return trials
+
+    def process_trials(self, func, batch=False, **kwargs):
+        if batch:
+            process_trials_batch(self.get_trials(), func, **kwargs)
+            return
         for _, dset in self.datasets.items():
             if not dset: continue
             dset.process_trials(func, **kwargs)
@@ -385,7 +404,16 @@ class PupilDataset(CommonPupilData):
                 continue
             self.data_streams[data_name].reject_trials(trials, trigger)
 
-    def process_trials(self, func, **kwargs):
+    def get_trials(self):
+        trials = []
+        for _, datastream in self.data_streams.items():
+            trials.extend(datastream.get_trials())
+        return trials
+
+    def process_trials(self, func, batch=False, **kwargs):
+        if batch:
+            process_trials_batch(self.get_trials(), func, **kwargs)
+            return
         for _, datastream in self.data_streams.items():
             datastream.process_trials(func, **kwargs)
 
@@ -548,7 +576,16 @@ class PupilDatastream(CommonPupilData):
                 continue
             trig_data.reject_trials(trials)
 
-    def process_trials(self, func, **kwargs):
+    def get_trials(self):
+        trials = []
+        for _, trig_data in self.triggers.items():
+            trials.extend(trig_data.get_trials())
+        return trials
+
+    def process_trials(self, func, batch=False, **kwargs):
+        if batch:
+            process_trials_batch(self.get_trials(), func, **kwargs)
+            return
         for _, trig_data in self.triggers.items():
             trig_data.process_trials(func, **kwargs)
 
@@ -642,7 +679,13 @@ class PupilTrigger(CommonPupilData):
         for num in trial_nums:
             self.trials[num-1].reject = True
 
-    def process_trials(self, func, **kwargs):
+    def get_trials(self):
+        return list(self.trials)
+
+    def process_trials(self, func, batch=False, **kwargs):
+        if batch:
+            process_trials_batch(self.get_trials(), func, **kwargs)
+            return
         for trial in self.trials:
             trial.process_trial(func, **kwargs)
 
@@ -751,7 +794,9 @@ class PupilTrial(CommonPupilData):
         # rejected when this boolean is false. The proc
         # data is set when the current data is modified,
         # i.e. by an FFT or something similar.
-        data = func(self.get_matrix(), **kwargs)
+        self.set_processed(func(self.get_matrix(), **kwargs))
+
+    def set_processed(self, data):
         if type(data) in (bool,) and data == True:
             self.reject = True
         if type(data) not in (bool,):
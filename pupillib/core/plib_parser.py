@@ -19,13 +19,18 @@ Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
 import argparse
+import collections
 import copy
 import math
 import sys
+import threading
 import warnings
 import os
 
 import ruamel.yaml as yaml
+from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.utilities.config_store import with_values
+from pupillib.core.workers.scheduler import get_num_workers
 from pupillib.core.workers.processors.dataset_processor import DatasetDefaults
 from pupillib.core.workers.processors.eye_processor import EyeDefaults
 from pupillib.core.workers.processors.trial_processor import TrialDefaults
@@ -120,6 +125,19 @@ class PLibParser(object):
                                  'the eyes. There will be more...')
         parser.add_argument('--only-markers-in-streams', action='store_true', default=False,
                             help='This specifies if only the marker positions in the streams should be returned.')
+        parser.add_argument('--no-xdf-index-cache', action='store_true', default=False,
+                            help='By default, the chunk layout of each XDF file is stored in an index file next \n'
+                                 'to it (<name>.xdf.index.json) to speed up later loads. This flag disables it.')
+        parser.add_argument('--xdf-workers', type=int, action='store', nargs=1,
+                            help='Number of processes used to decode the streams of an XDF file in parallel. \n'
+                                 'Defaults to 1, decoding them in the loading thread.')
+        parser.add_argument('--loader', type=str, choices=['thread', 'process'], default='thread',
+                            help='How the datasets are loaded. `thread` (default) loads them in threads, \n'
+                                 '`process` parses them in a pool of up to --max-workers processes.')
+        parser.add_argument('--backend', type=str, choices=['thread', 'process', 'serial'], default='thread',
+                            help='How the workers are run. `thread` (default) runs them in nested threads, \n'
+                                 '`process` runs the data streams in a pool of up to --max-workers processes \n'
+                                 'and `serial` runs everything one after the other.')
         parser.add_argument('--save-mat', action='store_true', default=False,
                             help='If this flag is supplied, `.mat` files will be saved instead of `.csv` when running '
                                  'from CLI.')
@@ -165,6 +183,10 @@ class PLibParser(object):
         self.config['testing'] = args.test if args.test is not None else False
         self.config['testing_depth'] = args.testingdepth[0] if args.testingdepth is not None else 'low'
         self.config['only_markers_in_streams'] = args.only_markers_in_streams
+        self.config['cache_xdf_index'] = not args.no_xdf_index_cache
+        self.config['xdf_workers'] = args.xdf_workers[0] if args.xdf_workers is not None else 1
+        self.config['loader'] = args.loader
+        self.config['backend'] = args.backend
 
         # If this is set to anything else, there must be a loader for the combination of fields.
         # Request these or build them yourself in xdfloader_processor.py.
@@ -235,6 +257,10 @@ class PLibParser(object):
         self.config['testing'] = check_and_get(yaml_config, 'testing', None)
         self.config['testing_depth'] = check_and_get(yaml_config, 'testing_depth', 'low')
         self.config['only_markers_in_streams'] = check_and_get(yaml_config, 'only_markers_in_streams', False)
+        self.config['cache_xdf_index'] = check_and_get(yaml_config, 'cache_xdf_index', True)
+        self.config['xdf_workers'] = check_and_get(yaml_config, 'xdf_workers', 1)
+        self.config['loader'] = check_and_get(yaml_config, 'loader', 'thread')
+        self.config['backend'] = check_and_get(yaml_config, 'backend', 'thread')
 
         # Always set default processing functions unless given an empty list.
         # Pre-processing
@@ -638,19 +664,24 @@ class PLibParser(object):
         return self.config
 
 
-def update_worker_count_with_trials(config, num_trials):
+def update_worker_count_with_trials(config, num_trials, name=None):
     """
         After the number of trials is determined, update the worker count
-        to know how many processes can be used on the trials.
+        to know how many processes can be used on the trials. When the
+        trigger with the given name was planned by plan_worker_count,
+        it gets the planned number of workers. The config isn't changed,
+        a view of it with the new counts is returned.
     """
 
-    # Set this for the sake of convenience
-    config['num_trials'] = num_trials
+    if name is not None and 'worker_plan' in config and name in config['worker_plan']:
+        trial_workers = max(1, min(num_trials, config['worker_plan'][name]['workers']))
+        return with_values(config, num_trials=num_trials, trial_workers=trial_workers,
+                           trials_per_worker=int(math.ceil(num_trials / trial_workers)))
 
-    if not config['worker_count_complete']:
+    if 'worker_count_complete' not in config or not config['worker_count_complete']:
         # If we haven't already run out of workers, split them across the trigger processes.
         if config['max_workers'] is not None:
-            leftover = config['leftover_workers']
+            leftover = config['leftover_workers'] if 'leftover_workers' in config else 0
 
             if leftover != 0:
                 # If we have some workers left over, split them among the trigger workers.
@@ -659,13 +690,87 @@ def update_worker_count_with_trials(config, num_trials):
 
                 if leftover < total_trial_workers:
                     # We don't have enough to let each trial have a process.
-                    config['trial_workers'] = math.floor(leftover/total_trigger_workers) \
-                                                if math.floor(leftover / total_trigger_workers) > 0 \
-                                                else 1
-                    config['trials_per_worker'] = math.floor(num_trials/config['trial_workers'])
-
-                    return config
+                    trial_workers = math.floor(leftover/total_trigger_workers) \
+                                        if math.floor(leftover / total_trigger_workers) > 0 \
+                                        else 1
+                    return with_values(config, num_trials=num_trials, trial_workers=trial_workers,
+                                       trials_per_worker=math.floor(num_trials/trial_workers))
                 # Otherwise, we have enough to continue normally with the max number of processes.
-        config['trial_workers'] = num_trials
-        config['trials_per_worker'] = 1
+        return with_values(config, num_trials=num_trials, trial_workers=num_trials, trials_per_worker=1)
+
+    # Set this for the sake of convenience
+    return with_values(config, num_trials=num_trials)
+
+
+def plan_worker_count(config, datasets, dataset_names):
+    """
+        Once the datasets are loaded, estimate the cost of each dataset,
+        data stream and trigger, and split the workers across them in
+        proportion to it. The costs are counted in data points:
+
+            trigger - number of markers * data points in a trial window
+            stream  - number of samples + the cost of it's triggers
+            dataset - the cost of it's streams
+
+        The plan is stored in config['worker_plan'], keyed by the worker
+        names, and logged.
+    """
+    logger = MultiProcessingLog.get_logger()
+    num_workers = get_num_workers(config)
+    parsed_yaml = config['parsed_yaml'] if 'parsed_yaml' in config else {}
+    triggers = config['triggers'] if config['triggers'] else []
+
+    def get_trial_range(names):
+        # The most specific trial range that is given in the yaml config.
+        for name in names:
+            if name in parsed_yaml and 'trial_range' in parsed_yaml[name]:
+                return parsed_yaml[name]['trial_range']
+        return config['trial_range'] if config['trial_range'] else [0, 0]
+
+    plan = {}
+    for dataset, dataset_name in zip(datasets, dataset_names):
+        datanames = dataset['dataname_list'] if dataset['custom_data'] else ['eye0', 'eye1']
+        eventnames = dataset['markers']['eventnames'] if 'markers' in dataset else None
+        marker_counts = collections.Counter(eventnames if eventnames is not None else [])
+
+        dataset_cost = 0
+        for data_name in datanames:
+            if data_name not in dataset or 'data' not in dataset[data_name]:
+                continue
+            stream_name = dataset_name + ':' + data_name
+            samples = len(dataset[data_name]['data'])
+            timestamps = dataset[data_name]['timestamps']
+            duration = timestamps[-1] - timestamps[0] if samples > 1 else 0
+            srate = samples / duration if duration > 0 else 0
+
+            stream_cost = samples
+            for trigger in triggers:
+                trigger_name = stream_name + ':trigger' + trigger
+                baseline, trial_time = get_trial_range([trigger_name, stream_name, dataset_name])
+                window_points = srate * (abs(baseline or 0) + abs(trial_time or 0))
+                trigger_cost = marker_counts[trigger] * window_points
+                plan[trigger_name] = {'markers': marker_counts[trigger], 'cost': trigger_cost}
+                stream_cost += trigger_cost
+
+            plan[stream_name] = {'samples': samples, 'cost': stream_cost}
+            dataset_cost += stream_cost
+        plan[dataset_name] = {'cost': dataset_cost}
+
+    # Give each entry it's share of the workers.
+    total_cost = sum(plan[name]['cost'] for name in dataset_names if name in plan)
+    for name in plan:
+        if total_cost <= 0 or plan[name]['cost'] <= 0:
+            plan[name]['workers'] = 0
+            continue
+        plan[name]['workers'] = max(1, min(num_workers, int(round(num_workers * plan[name]['cost'] / total_cost))))
+
+    logger.send('INFO', 'Worker plan for ' + str(num_workers) + ' workers, total cost: ' + str(int(total_cost)),
+                os.getpid(), threading.get_ident())
+    for name in sorted(plan):
+        share = 100 * plan[name]['cost'] / total_cost if total_cost > 0 else 0
+        logger.send('INFO', '    ' + name + ': cost ' + str(int(plan[name]['cost'])) + ' (' +
+                    str(round(share, 1)) + '%), ' + str(plan[name]['workers']) + ' workers',
+                    os.getpid(), threading.get_ident())
+
+    config['worker_plan'] = plan
     return config
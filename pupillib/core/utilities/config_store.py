@@ -18,8 +18,19 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
+import weakref
+from collections.abc import Mapping
+
 from frozendict import frozendict
 
+# Don't replace these fields.
+BLACKLIST = {
+    'parsed_yaml': False,
+    'max_workers': False,
+    'logger': False,
+    'store': False
+}
+
 
 class ConfigStore:
 
@@ -43,4 +54,130 @@ class ConfigStore:
         if a_dict is None:
             a_dict = dict()
         if not ConfigStore.instance:
-            ConfigStore.instance = ConfigStore.innerConfigStore(a_dict)
\ No newline at end of file
+            ConfigStore.instance = ConfigStore.innerConfigStore(a_dict)
+
+
+class ConfigView(Mapping):
+    '''
+        A read-only config made of layers of values on top of a base config.
+        The layers are searched first (the latest one first), then the base.
+        Nothing is copied, so a worker can take a view of it's parent's config
+        with the overrides for it's name (see ConfigResolver) or with values
+        of it's own (see with_values).
+    '''
+    def __init__(self, base, layers=(), resolver=None):
+        if isinstance(base, ConfigView):
+            # Keep a single level of layers over the base.
+            layers = tuple(layers) + base.layers
+            resolver = resolver or base.resolver
+            base = base.base
+        self.base = base
+        self.layers = tuple(layers)
+        self.resolver = resolver
+
+    def __getitem__(self, key):
+        for layer in self.layers:
+            if key in layer:
+                return layer[key]
+        return self.base[key]
+
+    def __contains__(self, key):
+        return any(key in layer for layer in self.layers) or key in self.base
+
+    def __iter__(self):
+        seen = set()
+        for mapping in self.layers + (self.base,):
+            for key in mapping:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return 'ConfigView(' + repr(dict(self)) + ')'
+
+
+# Returns a view of the config with the given values on top of it.
+def with_values(config, **values):
+    return ConfigView(config, [frozendict(values)])
+
+
+class ConfigResolver(object):
+    '''
+        Finds the overrides given in 'parsed_yaml' for a worker name. The names
+        are compiled once into a trie of their ':' separated parts, and the
+        overrides found for each name are cached.
+
+        A name gets it's own overrides, or the nearest ones of it's parents
+        (down to the data stream for triggers and trials).
+    '''
+    resolvers = weakref.WeakValueDictionary()
+
+    def __init__(self, parsed_yaml):
+        self.parsed_yaml = parsed_yaml
+        self.trie = {}
+        self.cache = {}
+
+        # Each node is [children, overrides of the name ending there].
+        for name, name_config in parsed_yaml.items():
+            if not name_config:
+                continue
+            nodes = self.trie
+            for part in name.split(':'):
+                node = nodes.setdefault(part, [{}, None])
+                nodes = node[0]
+            node[1] = frozendict({
+                option: value for option, value in name_config.items()
+                if option not in BLACKLIST
+            })
+
+    # Returns the resolver of the given 'parsed_yaml', it's only
+    # compiled once while it's in use.
+    @staticmethod
+    def get(parsed_yaml):
+        resolver = ConfigResolver.resolvers.get(id(parsed_yaml))
+        if resolver is None or resolver.parsed_yaml is not parsed_yaml:
+            resolver = ConfigResolver(parsed_yaml)
+            ConfigResolver.resolvers[id(parsed_yaml)] = resolver
+        return resolver
+
+    def get_overrides(self, name):
+        if name in self.cache:
+            return self.cache[name]
+
+        # Overrides of each part of the name that has some.
+        parts = name.split(':')
+        found = {}
+        nodes = self.trie
+        for depth, part in enumerate(parts):
+            if part not in nodes:
+                break
+            if nodes[part][1] is not None:
+                found[depth + 1] = nodes[part][1]
+            nodes = nodes[part][0]
+
+        # The name is searched first, then it's parent, then the
+        # other parents while they have more than 2 parts.
+        overrides = None
+        for depth in range(len(parts), min(len(parts) - 1, 2) - 1, -1):
+            if depth in found:
+                overrides = found[depth]
+                break
+
+        self.cache[name] = overrides
+        return overrides
+
+    # Returns a view of the config with the overrides of the given name.
+    def resolve(self, config, name):
+        overrides = self.get_overrides(name)
+        if isinstance(config, ConfigView):
+            # The parent's overrides are found again for names without their
+            # own, they are already on top of the parent's config.
+            if overrides is None or (config.layers and config.layers[0] is overrides):
+                return config
+        elif overrides is None:
+            return ConfigView(config, resolver=self)
+        return ConfigView(config, [overrides], resolver=self)
+
@@ -18,6 +18,7 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
+import ast
 
 '''
     This file holds processing function for `pupil_lib.py` to use
@@ -26,7 +27,7 @@ Copyright (C) 2018  Gregory W. Mierzwinski
 
 def eye_pyrep_to_prim_default(pyrep_stream, all_data_field, all_data):
     return {
-        'data': [eval(el[0])['diameter'] for el in pyrep_stream['time_series']],
+        'data': [ast.literal_eval(el[0])['diameter'] for el in pyrep_stream['time_series']],
         'timestamps': all_data[all_data_field]['timestamps'],
         'srate': all_data[all_data_field]['srate']
     }
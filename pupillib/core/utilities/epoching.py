@@ -0,0 +1,595 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import math
+
+import numpy as np
+
+from pupillib.core.utilities.utilities import linear_approx
+
+'''
+    Batched trial extraction. All trials of a trigger are cut at once,
+    the boundaries are the same ones that PLibTrialWorker.get_baseline_start
+    and PLibTrialWorker.get_trialtime_end find for a single trial. Trials
+    that the per-trial search would not handle in the usual way (indices
+    wrapping around, no strictly matching timestamp, etc.) are marked as
+    invalid so that they can be cut by the per-trial path instead.
+'''
+
+
+# BOUNDARY_BEFORE Finds the boundaries that are `durations` seconds before
+#   the markers, as in PLibTrialWorker.get_baseline_start.
+#
+#   INPUT:
+#       timestamps   - Strictly increasing timestamps of the stream.
+#       data         - Data of the stream.
+#       marker_inds  - Index of the data point chosen for each marker.
+#       marker_times - Time of each marker.
+#       errors       - Error between each marker and its data point.
+#       durations    - Seconds before each marker, the sign is ignored.
+#       srate        - Sampling rate of the stream.
+#       lower        - Lowest index that the search can use for each marker.
+#
+#   RETURN:
+#       A dict of arrays holding the final index, the final timestamp and
+#       data value, the ideal timestamp and data value, and whether it's valid.
+#
+def boundary_before(timestamps, data, marker_inds, marker_times, errors, durations, srate, lower):
+    durations = np.abs(durations)
+    points = np.array([int(math.ceil(d * srate)) for d in durations], dtype=np.int64)
+    initial_inds = marker_inds - points
+    valid = initial_inds >= lower
+    initial_inds = np.where(valid, initial_inds, marker_inds)
+
+    initial_errors = marker_times - timestamps[initial_inds]
+    ideal_times = marker_times - durations
+    over = (initial_errors > durations) & (initial_errors > errors)
+    under = ~over & (errors < initial_errors) & (initial_errors < durations)
+
+    # Data point right before the ideal time, the per-trial search only
+    # accepts it when the ideal time lies strictly between two points.
+    found = np.searchsorted(timestamps, ideal_times, side='right') - 1
+    in_bounds = (found >= 0) & (found < len(timestamps) - 1)
+    found = np.clip(found, 0, len(timestamps) - 2)
+    strict = in_bounds & (timestamps[found] < ideal_times) & (ideal_times < timestamps[found + 1])
+    valid &= ~over | (strict & (found >= initial_inds) & (found < marker_inds))
+    valid &= ~under | (strict & (found >= lower) & (found <= initial_inds))
+
+    searched = over | under
+    final_inds = np.where(searched, found, initial_inds)
+    final_times = np.where(searched, timestamps[final_inds], ideal_times)
+    final_values = data[final_inds]
+    next_inds = np.minimum(final_inds + 1, len(timestamps) - 1)
+
+    # Same operations as utilities.linear_approx, a zero error keeps
+    # the final value.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (data[next_inds] - final_values) / (timestamps[next_inds] - final_times)
+        consts = final_values - (final_times * slopes)
+        ideal_values = np.where(searched, (ideal_times * slopes) + consts, final_values)
+
+    return {
+        'final_ind': final_inds,
+        'final_timestamp': final_times,
+        'final_data_value': final_values,
+        'ideal_timestamp': ideal_times,
+        'ideal_data': ideal_values,
+        'valid': valid
+    }
+
+
+# BOUNDARY_AFTER Finds the boundaries that are `durations` seconds after
+#   the markers, as in PLibTrialWorker.get_trialtime_end. Negative durations
+#   are marked as invalid.
+#
+#   INPUT:
+#       Same as BOUNDARY_BEFORE, with `upper` being one past the highest
+#       index that the search can use for each marker.
+#
+#   RETURN:
+#       Same as BOUNDARY_BEFORE.
+#
+def boundary_after(timestamps, data, marker_inds, marker_times, errors, durations, srate, upper):
+    points = np.array([int(math.ceil(d * srate)) for d in durations], dtype=np.int64)
+    initial_inds = marker_inds + points
+    valid = (durations >= 0) & (initial_inds < upper)
+    initial_inds = np.where(valid, initial_inds, marker_inds)
+
+    initial_errors = timestamps[initial_inds] - marker_times
+    ideal_times = marker_times + durations
+    over = (initial_errors > durations) & (initial_errors > errors)
+    under = ~over & (errors < initial_errors) & (initial_errors < durations)
+
+    # Data point right after the ideal time.
+    found = np.searchsorted(timestamps, ideal_times, side='right')
+    in_bounds = (found >= 1) & (found < len(timestamps))
+    found = np.clip(found, 1, len(timestamps) - 1)
+    strict = in_bounds & (timestamps[found - 1] < ideal_times) & (ideal_times < timestamps[found])
+    valid &= ~over | (strict & (found > marker_inds) & (found <= initial_inds))
+    valid &= ~under | (strict & (found >= initial_inds) & (found < upper))
+
+    searched = over | under
+    final_inds = np.where(searched, found, initial_inds)
+    final_times = np.where(searched, timestamps[final_inds], ideal_times)
+    final_values = data[final_inds]
+    prev_inds = np.maximum(final_inds - 1, 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (final_values - data[prev_inds]) / (final_times - timestamps[prev_inds])
+        consts = data[prev_inds] - (timestamps[prev_inds] * slopes)
+        ideal_values = np.where(searched, (ideal_times * slopes) + consts, final_values)
+
+    return {
+        'final_ind': final_inds,
+        'final_timestamp': final_times,
+        'final_data_value': final_values,
+        'ideal_timestamp': ideal_times,
+        'ideal_data': ideal_values,
+        'valid': valid
+    }
+
+
+# EXTRACT_EPOCHS Cuts all trials of a trigger at once.
+#
+#   INPUT:
+#       timestamps     - Timestamps of the stream.
+#       data           - Data of the stream.
+#       marker_inds    - Index of the data point chosen for each marker.
+#       marker_times   - Time of each marker.
+#       errors         - Error between each marker and its data point.
+#       baseline_times - Baseline time of each trial (or one for all trials).
+#       trial_times    - Trial time of each trial (or one for all trials).
+#       srate          - Sampling rate of the stream.
+#       lower          - Lowest index that each trial may use, defaults to 0.
+#       upper          - One past the highest index that each trial may use,
+#                        defaults to the length of the stream.
+#
+#   RETURN:
+#       A dict with the 'data' and 'timestamps' matrices (trials x samples,
+#       padded with NaNs), the 'lengths' of each trial, whether each trial
+#       is 'valid', and the 'baseline' and 'trial' boundary arrays. Invalid
+#       trials hold no data and must be cut with the per-trial path.
+#
+def extract_epochs(timestamps, data, marker_inds, marker_times, errors, baseline_times,
+                   trial_times, srate, lower=None, upper=None):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    data = np.asarray(data, dtype=np.float64)
+    marker_inds = np.asarray(marker_inds, dtype=np.int64).reshape(-1)
+    num_trials = len(marker_inds)
+
+    def per_trial(values, default, dtype):
+        if values is None:
+            values = default
+        return np.broadcast_to(np.asarray(values, dtype=dtype), (num_trials,))
+
+    marker_times = per_trial(marker_times, 0, np.float64)
+    errors = per_trial(errors, 0, np.float64)
+    baseline_times = per_trial(baseline_times, 0, np.float64)
+    trial_times = per_trial(trial_times, 0, np.float64)
+    lower = per_trial(lower, 0, np.int64)
+    upper = np.minimum(per_trial(upper, len(timestamps), np.int64), len(timestamps))
+
+    epochs = {
+        'data': np.full((num_trials, 0), np.nan),
+        'timestamps': np.full((num_trials, 0), np.nan),
+        'lengths': np.zeros(num_trials, dtype=np.int64),
+        'valid': np.zeros(num_trials, dtype=bool),
+        'baseline': None,
+        'trial': None
+    }
+    if num_trials == 0 or len(timestamps) < 2 or not np.all(timestamps[1:] > timestamps[:-1]):
+        # The boundaries are found with a binary search, which needs
+        # strictly increasing timestamps.
+        return epochs
+
+    # Same choices as PLibTrialWorker.run, a positive baseline time
+    # is after the marker and a negative trial time is before it.
+    start_after = baseline_times > 0
+    end_before = ~start_after & (trial_times < 0)
+
+    before = boundary_before(timestamps, data, marker_inds, marker_times, errors,
+                             baseline_times, srate, lower)
+    after = boundary_after(timestamps, data, marker_inds, marker_times, errors,
+                           baseline_times, srate, upper)
+    start = {key: np.where(start_after, after[key], before[key]) for key in before}
+
+    before = boundary_before(timestamps, data, marker_inds, marker_times, errors,
+                             trial_times, srate, lower)
+    after = boundary_after(timestamps, data, marker_inds, marker_times, errors,
+                           trial_times, srate, upper)
+    end = {key: np.where(end_before, before[key], after[key]) for key in before}
+
+    valid = start['valid'] & end['valid'] & (start['final_ind'] <= end['final_ind'])
+
+    # The ideal points replace the first and last data points, or are
+    # added to the trial when they lie outside of it.
+    prepend = start_after.astype(np.int64)
+    append = (trial_times < 0).astype(np.int64)
+    lengths = np.where(valid, end['final_ind'] - start['final_ind'] + 1 + prepend + append, 0)
+
+    max_length = int(lengths.max()) if num_trials else 0
+    offsets = np.arange(max_length)
+    inds = start['final_ind'][:, None] - prepend[:, None] + offsets[None, :]
+    inds = np.clip(inds, 0, len(timestamps) - 1)
+    in_trial = offsets[None, :] < lengths[:, None]
+
+    epoch_data = np.where(in_trial, data[inds], np.nan)
+    epoch_times = np.where(in_trial, timestamps[inds], np.nan)
+
+    rows = np.nonzero(valid)[0]
+    epoch_data[rows, 0] = start['ideal_data'][rows]
+    epoch_times[rows, 0] = start['ideal_timestamp'][rows]
+    epoch_data[rows, lengths[rows] - 1] = end['ideal_data'][rows]
+    epoch_times[rows, lengths[rows] - 1] = end['ideal_timestamp'][rows]
+
+    epochs.update({
+        'data': epoch_data,
+        'timestamps': epoch_times,
+        'lengths': lengths,
+        'valid': valid,
+        'baseline': start,
+        'trial': end,
+        'marker_inds': marker_inds,
+        'marker_times': marker_times,
+        'start_after': start_after,
+        'end_before': end_before
+    })
+    return epochs
+
+
+# EPOCH_CHUNKS Builds the per-trial boundary dicts that PLibTrialWorker
+#   produces, for one trial of EXTRACT_EPOCHS.
+#
+#   INPUT:
+#       epochs             - Result of EXTRACT_EPOCHS.
+#       trial              - Row of the trial.
+#       actual_marker_time - Timestamp of the data point chosen for the marker.
+#       offset             - Index in the stream of the first point of the
+#                            chunk that the indices are relative to.
+#
+#   RETURN:
+#       The proc_baseline_chunk and proc_trial_chunk dicts.
+#
+def epoch_chunks(epochs, trial, actual_marker_time, offset=0):
+    marker_ind = int(epochs['marker_inds'][trial])
+    marker_time = float(epochs['marker_times'][trial])
+
+    def chunk(boundary, after):
+        final_ind = int(boundary['final_ind'][trial])
+        final_timestamp = float(boundary['final_timestamp'][trial])
+        ideal_timestamp = float(boundary['ideal_timestamp'][trial])
+        if after:
+            points = final_ind - marker_ind
+            errors = {
+                'total_error': ideal_timestamp - final_timestamp,
+                'ideal_marker_timestamp_m_ideal_timestamp': ideal_timestamp - marker_time,
+                'final_timestamp_m_actual_mrk_ts': final_timestamp - actual_marker_time,
+            }
+        else:
+            points = marker_ind - final_ind
+            errors = {
+                'total_error': final_timestamp - ideal_timestamp,
+                'ideal_marker_timestamp_m_ideal_timestamp': -(marker_time - ideal_timestamp),
+                'final_timestamp_m_actual_mrk_ts': actual_marker_time - final_timestamp,
+            }
+
+        proc_chunk = {
+            'final_ind': final_ind - offset,
+            'final_timestamp': final_timestamp,
+            'final_data_value': float(boundary['final_data_value'][trial]),
+            'ideal_timestamp': ideal_timestamp,
+            'ideal_data': float(boundary['ideal_data'][trial]),
+        }
+        proc_chunk.update(errors)
+        return proc_chunk, points
+
+    start_after = bool(epochs['start_after'][trial])
+    end_before = bool(epochs['end_before'][trial])
+
+    proc_baseline_chunk, points = chunk(epochs['baseline'], start_after)
+    if start_after:
+        proc_baseline_chunk['trial_time_points'] = points
+        # The ideal point is added before the first data point.
+        proc_baseline_chunk['baseline_time_points'] = points + 1
+    else:
+        proc_baseline_chunk['baseline_time_points'] = points
+
+    proc_trial_chunk, points = chunk(epochs['trial'], not end_before)
+    if end_before:
+        proc_trial_chunk['baseline_time_points'] = points
+        # The ideal point is added after the last data point.
+        proc_trial_chunk['trial_time_points'] = points + 1
+    else:
+        proc_trial_chunk['trial_time_points'] = points
+
+    return proc_baseline_chunk, proc_trial_chunk
+
+
+# BATCH_INTERP Same as np.interp, for many rows at once.
+#
+#   INPUT:
+#       x       - Matrix of the points to interpolate at, one row per trial.
+#       lengths - Number of points used in each row of `x`.
+#       xp      - List of the sample points of each row.
+#       fp      - List of the sample values of each row, rows that
+#                 are None are skipped.
+#
+#   RETURN:
+#       A matrix with the same shape as `x` holding the interpolated values,
+#       padded with NaNs.
+#
+def batch_interp(x, lengths, xp, fp):
+    result = np.full(x.shape, np.nan)
+    rows = [row for row in range(len(xp)) if fp[row] is not None and lengths[row] > 0]
+    if not rows:
+        return result
+
+    xp = [np.asarray(xp[row], dtype=np.float64) for row in rows]
+    fp = [np.asarray(fp[row], dtype=np.float64) for row in rows]
+    xp_lengths = np.array([len(points) for points in xp], dtype=np.int64)
+    for points, values in zip(xp, fp):
+        if len(points) == 0:
+            raise ValueError('array of sample points is empty')
+        if len(points) != len(values):
+            raise ValueError('fp and xp are not of the same length.')
+
+    xp_all = np.concatenate(xp)
+    fp_all = np.concatenate(fp)
+    xp_rows = np.repeat(np.arange(len(rows)), xp_lengths)
+    xp_starts = np.cumsum(xp_lengths) - xp_lengths
+
+    # Rows with unsorted sample points are left to np.interp.
+    same_row = xp_rows[1:] == xp_rows[:-1]
+    unsorted = np.unique(xp_rows[1:][same_row & ~(xp_all[1:] >= xp_all[:-1])])
+    unsorted = set(unsorted.tolist()) | set(np.nonzero(np.isnan(xp_all[xp_starts]))[0].tolist())
+
+    row_inds = np.asarray(rows, dtype=np.int64)
+    x_lengths = np.asarray(lengths, dtype=np.int64)[row_inds]
+    in_row = np.arange(x.shape[1])[None, :] < x_lengths[:, None]
+    x_all = x[row_inds][in_row]
+    x_rows = np.repeat(np.arange(len(rows)), x_lengths)
+    x_cols = np.arange(len(x_all)) - (np.cumsum(x_lengths) - x_lengths)[x_rows]
+
+    # Complex numbers are ordered by their real part and then by their
+    # imaginary part, so a single search finds the sample point before
+    # each point in its own row.
+    xp_keys = np.empty(len(xp_all), dtype=np.complex128)
+    xp_keys.real = xp_rows
+    xp_keys.imag = xp_all
+    x_keys = np.empty(len(x_all), dtype=np.complex128)
+    x_keys.real = x_rows
+    x_keys.imag = x_all
+
+    starts = xp_starts[x_rows]
+    last = xp_lengths[x_rows] - 1
+    inds = np.searchsorted(xp_keys, x_keys, side='right') - starts - 1
+    points = starts + np.clip(inds, 0, last)
+
+    # Points outside of the sample points, or on one of them, take its value.
+    values = fp_all[points]
+    inner = (inds >= 0) & (inds < last) & (xp_all[points] != x_all)
+    points = points[inner]
+    x_inner = x_all[inner]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = (fp_all[points + 1] - fp_all[points]) / (xp_all[points + 1] - xp_all[points])
+        inner_values = slopes * (x_inner - xp_all[points]) + fp_all[points]
+
+        # If we get nan in one direction, try the other (as np.interp does).
+        nans = np.isnan(inner_values)
+        if np.any(nans):
+            retry = slopes[nans] * (x_inner[nans] - xp_all[points[nans] + 1]) + fp_all[points[nans] + 1]
+            flat = np.isnan(retry) & (fp_all[points[nans]] == fp_all[points[nans] + 1])
+            retry[flat] = fp_all[points[nans]][flat]
+            inner_values[nans] = retry
+    values[inner] = inner_values
+    values[np.isnan(x_all)] = np.nan
+
+    result[row_inds[x_rows], x_cols] = values
+    for row in unsorted:
+        result[rows[row], :x_lengths[row]] = np.interp(x[rows[row], :x_lengths[row]], xp[row], fp[row])
+    return result
+
+
+# RESAMPLE_TRIALS Resamples trials onto evenly spaced times starting at 0,
+#   as np.linspace and np.interp would for each trial.
+#
+#   INPUT:
+#       timestamps - List of the timestamps of each trial.
+#       series     - List of data series, each one holding the data of every
+#                    trial (or None for trials that don't have it).
+#       srate      - Sampling rate to resample to.
+#
+#   RETURN:
+#       The matrix of new timestamps, the length of each trial and a list of
+#       the resampled data matrices, one for each series. The matrices have
+#       one row per trial and are padded with NaNs when the trials don't
+#       have the same length.
+#
+def resample_trials(timestamps, series, srate):
+    num_trials = len(timestamps)
+    stimes = [np.asarray(times) - times[0] for times in timestamps]
+    starts = np.array([times[0] for times in stimes], dtype=np.float64)
+    stops = np.array([times[-1] for times in stimes], dtype=np.float64)
+    lengths = np.array([int(srate*(stop - start)) for start, stop in zip(starts, stops)],
+                       dtype=np.int64).reshape(-1)
+    if np.any(lengths < 0):
+        raise ValueError('Number of samples, %s, must be non-negative.' % lengths.min())
+
+    # Same steps as np.linspace.
+    max_length = int(lengths.max()) if num_trials else 0
+    deltas = stops - starts
+    divs = np.maximum(lengths - 1, 1)
+    steps = np.where(lengths > 1, deltas / divs, deltas)
+    new_times = np.arange(max_length, dtype=np.float64)[None, :] * steps[:, None]
+    new_times += starts[:, None]
+
+    ends = np.nonzero(lengths > 1)[0]
+    new_times[ends, lengths[ends] - 1] = stops[ends]
+    new_times[np.arange(max_length)[None, :] >= lengths[:, None]] = np.nan
+
+    new_series = [batch_interp(new_times, lengths, stimes, datas) for datas in series]
+    return new_times, lengths, new_series
+
+
+# RESAMPLE_STREAMS Clips data streams to a time range that they all cover
+#   and resamples them onto the same evenly spaced times, as np.linspace
+#   and np.interp would for each stream. The first and last points of each
+#   stream are linearly approximated at the ends of the range.
+#
+#   INPUT:
+#       timestamps - List of the increasing timestamps of each stream.
+#       datas      - List of the data of each stream.
+#       start      - Start of the time range.
+#       end        - End of the time range.
+#       srate      - Sampling rate to resample to.
+#
+#   RETURN:
+#       The new timestamps, shared by all streams, and the matrix
+#       of resampled data with one row per stream.
+#
+def resample_streams(timestamps, datas, start, end, srate):
+    num = int(srate * (end - start))
+    if num < 0:
+        raise ValueError('Number of samples, %s, must be non-negative.' % num)
+    new_times = np.linspace(start, end, num=num)
+
+    xp = []
+    fp = []
+    for times, data in zip(timestamps, datas):
+        times = np.array(times, dtype=np.float64)
+        data = np.array(data, dtype=np.float64)
+
+        # Cut right before the start and right after the end, and
+        # move the points that were cut on to the range.
+        first, last = np.searchsorted(times, [start, end])
+        first = max(first - 1, 0)
+        last = min(last, len(times) - 1)
+        times = times[first:last + 1]
+        data = data[first:last + 1]
+
+        if times[0] != start:
+            data[0] = linear_approx(data[0], times[0], data[1], times[1], start)
+            times[0] = start
+        if times[-1] != end:
+            data[-1] = linear_approx(data[-2], times[-2], data[-1], times[-1], end)
+            times[-1] = end
+
+        xp.append(times)
+        fp.append(data)
+
+    new_data = batch_interp(
+        np.broadcast_to(new_times, (len(xp), len(new_times))),
+        np.full(len(xp), len(new_times), dtype=np.int64),
+        xp, fp
+    )
+    return new_times, new_data
+
+
+# STACK_TRIALS Stacks the data of many trials into a matrix.
+#
+#   INPUT:
+#       arrays - List of the data of each trial.
+#
+#   RETURN:
+#       The matrix, with one row per trial padded with NaNs, and
+#       the length of each trial.
+#
+def stack_trials(arrays):
+    lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+    matrix = np.full((len(arrays), int(lengths.max()) if len(arrays) else 0), np.nan)
+    for row, array in enumerate(arrays):
+        matrix[row, :lengths[row]] = array
+    return matrix, lengths
+
+
+# REMOVE_BASELINE Computes the baseline mean of many trials at once and
+#   removes it from their data. The baseline is made of the linearly
+#   approximated points at both ends of the baseline range and all
+#   data points in between.
+#
+#   INPUT:
+#       timestamps     - List of the timestamps of each trial.
+#       datas          - List of the data of each trial.
+#       baseline_range - Start and end of the baseline, in seconds from
+#                        the start of the trials.
+#
+#   RETURN:
+#       The baseline means, the matrix of baseline removed data (padded with
+#       NaNs) and the length of the data of each trial.
+#
+def remove_baseline(timestamps, datas, baseline_range):
+    times, lengths = stack_trials(timestamps)
+    data, data_lengths = stack_trials(datas)
+    if np.any(lengths == 0):
+        raise Exception("Error: Cannot remove the baseline of an empty trial. ")
+    if np.any(data_lengths < lengths):
+        raise Exception("Error: Trials must have as many data points as timestamps. ")
+    all_data = data
+    data = data[:, :times.shape[1]]
+
+    rows = np.arange(len(lengths))
+    times = times - times[:, :1]
+    start, end = baseline_range[0], baseline_range[1]
+
+    # Check to make sure the baseline range is OK.
+    if np.any(start < times[:, 0]):
+        raise Exception("Error: Cannot have a negative baseline range start. All trials start at 0. ")
+    if np.any(end > times[rows, lengths - 1]):
+        raise Exception("Error: Cannot have a baseline range that exceeds the total time of the trial. ")
+
+    # The intervals [times[i], times[i+1]) that hold the start and the end
+    # of the range. The end is only looked for after the start.
+    curr_times = times[:, :-1]
+    next_times = times[:, 1:]
+    cols = np.arange(curr_times.shape[1])[None, :]
+    has_start = (curr_times <= start) & (start < next_times)
+    first_inds = np.argmax(has_start, axis=1)
+    found_first = np.any(has_start, axis=1)
+    has_end = (curr_times <= end) & (end < next_times) & (cols > first_inds[:, None])
+    last_inds = np.argmax(has_end, axis=1)
+    found_last = np.any(has_end, axis=1)
+    if not np.all(found_first):
+        raise Exception("Error: Cannot find the start of the baseline range in a trial. ")
+
+    # Without an end, all points up to the second last one are used.
+    stop_inds = np.where(found_last, last_inds, lengths - 1)
+    counts = 1 + (stop_inds - first_inds - 1) + found_last
+
+    def edge_values(inds, edge_time):
+        next_inds = np.minimum(inds + 1, times.shape[1] - 1)
+        val1, ts1 = data[rows, inds], times[rows, inds]
+        val2, ts2 = data[rows, next_inds], times[rows, next_inds]
+        # Same operations as utilities.linear_approx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            line_slope = (val2 - val1) / (ts2 - ts1)
+            line_const = (val1 - (ts1 * line_slope))
+            return np.where(ts1 == edge_time, val1, (edge_time * line_slope) + line_const)
+
+    # Summing with a cumulative sum keeps the same order of additions as
+    # walking through the points, the points outside of the range add 0.
+    in_range = (cols > first_inds[:, None]) & (cols < stop_inds[:, None])
+    points = np.where(in_range, data[:, :-1], 0.0)
+    points[rows, first_inds] = edge_values(first_inds, start)
+    ends = np.nonzero(found_last)[0]
+    points[ends, last_inds[ends]] = edge_values(last_inds, end)[ends]
+    sums = np.cumsum(points, axis=1)[:, -1] if points.shape[1] else np.zeros(len(rows))
+
+    means = sums / counts
+    return means, all_data - means[:, None], data_lengths
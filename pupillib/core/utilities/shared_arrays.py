@@ -0,0 +1,104 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import os
+import tempfile
+
+import numpy as np
+
+'''
+    Helpers to pass numpy arrays between processes through memory-mapped
+    files, rather than pickling their data. Only a small placeholder that
+    holds the path of the file is pickled.
+'''
+
+# Arrays of these kinds are mapped, others (strings, objects) are pickled.
+MAPPED_KINDS = 'biuf'
+
+
+class MappedArray(object):
+    # Placeholder for an array that was written to a memory-mapped file.
+    def __init__(self, path, shape, dtype, writeable=True):
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+        self.writeable = writeable
+
+
+# TO_MAPPED_ARRAYS Replaces the numeric arrays in the (nested) dicts and
+# lists of obj with MappedArray placeholders.
+# An array that appears more than once in obj is written once, and
+# stays a single (shared) array once it's read back in.
+#   INPUT:
+#       obj     - The object to replace arrays in.
+#       tmp_dir - Directory to write the memory-mapped files in.
+#   RETURN:
+#       A copy of obj that can be pickled cheaply.
+#
+def to_mapped_arrays(obj, tmp_dir, memo=None):
+    if memo is None:
+        memo = {}
+    if isinstance(obj, dict):
+        return {key: to_mapped_arrays(val, tmp_dir, memo) for key, val in obj.items()}
+    if isinstance(obj, list):
+        return [to_mapped_arrays(val, tmp_dir, memo) for val in obj]
+    if isinstance(obj, np.ndarray) and obj.dtype.kind in MAPPED_KINDS and obj.size > 0:
+        if id(obj) in memo:
+            return memo[id(obj)]
+        fd, path = tempfile.mkstemp(suffix='.npy', dir=tmp_dir)
+        os.close(fd)
+        mapped = np.lib.format.open_memmap(path, mode='w+', dtype=obj.dtype, shape=obj.shape)
+        mapped[...] = obj
+        mapped.flush()
+        del mapped
+        memo[id(obj)] = MappedArray(path, obj.shape, obj.dtype, writeable=obj.flags.writeable)
+        return memo[id(obj)]
+    return obj
+
+
+# FROM_MAPPED_ARRAYS Replaces the MappedArray placeholders in obj with the
+# arrays they stand for, and removes their files.
+#
+# The arrays stay mapped (copy-on-write) to their files which are removed
+# right away. The data is read in when it is used and is freed with the
+# last array that uses it. On platforms that can't remove mapped files,
+# the arrays are copied into memory first.
+#
+def from_mapped_arrays(obj, memo=None):
+    if memo is None:
+        memo = {}
+    if isinstance(obj, dict):
+        return {key: from_mapped_arrays(val, memo) for key, val in obj.items()}
+    if isinstance(obj, list):
+        return [from_mapped_arrays(val, memo) for val in obj]
+    if isinstance(obj, MappedArray):
+        if id(obj) in memo:
+            return memo[id(obj)]
+        array = np.asarray(np.load(obj.path, mmap_mode='c'))
+        try:
+            os.remove(obj.path)
+        except OSError:
+            array = np.array(array)
+            os.remove(obj.path)
+        if not getattr(obj, 'writeable', True):
+            array.flags.writeable = False
+        memo[id(obj)] = array
+        return array
+    return obj
@@ -21,9 +21,10 @@ Copyright (C) 2018  Gregory W. Mierzwinski
 import numpy as np
 import sys
 import math
-import copy
 import codecs
 
+from pupillib.core.utilities.config_store import BLACKLIST, ConfigResolver, ConfigView
+
 # GET_ERROR Retrieves an error of the distance between two values and the
 # input time.
 #   INPUT:
@@ -179,6 +180,119 @@ def get_marker_indices(marker_names, trig):
     return inds
 
 
+# GET_GRID_POSITIONS Gets the positions of some markers in the time grid
+#   that the data streams of a dataset share after being resampled.
+#
+#   INPUT:
+#       markers    - Markers of the dataset.
+#       timestamps - Timestamps of the data stream.
+#       inds       - Indices of the markers.
+#   RETURN:
+#       The positions of the markers (as ALIGN_MARKERS uses them), or None
+#       if the data stream doesn't use the shared time grid.
+#
+def get_grid_positions(markers, timestamps, inds):
+    if 'grid_timestamps' not in markers or markers['grid_timestamps'] is not timestamps:
+        return None
+    return markers['grid_positions'][inds]
+
+
+# ALIGN_MARKERS Finds the data point that is closest to each marker.
+#   A marker is aligned to the two data points that surround it (strictly),
+#   and the one with the smallest error is taken - the later point is taken
+#   when both errors are equal, for parity with the Matlab implementation.
+#   Markers are aligned in order, each one after the previous one, and the
+#   alignment stops at the first marker that can't be aligned.
+#
+#   INPUT:
+#       timestamps   - Timestamps of the data stream.
+#       marker_times - Times of the markers to align.
+#       positions    - Optional, positions of the markers in the (strictly
+#                      increasing) timestamps as np.searchsorted finds them.
+#                      Used when they were already found for a shared grid.
+#   RETURN:
+#       data_indices   - Index of the chosen data point for each aligned marker.
+#       data_times     - Timestamp of the chosen data point.
+#       data_errors    - Distance between the marker and the chosen data point.
+#       data_curr_prev - 0 when the later (current) point was chosen, 1 for the
+#                        earlier (previous) one.
+#
+def align_markers(timestamps, marker_times, positions=None):
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    marker_times = np.asarray(marker_times, dtype=np.float64).reshape(-1)
+    if len(timestamps) < 2 or len(marker_times) == 0:
+        return [], [], [], []
+
+    # Index of the first data point after each marker, valid markers
+    # lie strictly between two data points.
+    if positions is not None:
+        curr_inds = np.asarray(positions, dtype=np.int64).reshape(-1)
+    elif not np.all(timestamps[1:] > timestamps[:-1]):
+        # Binary search needs increasing timestamps.
+        return align_markers_sequential(timestamps, marker_times)
+    else:
+        curr_inds = np.searchsorted(timestamps, marker_times, side='left')
+    in_range = (curr_inds >= 1) & (curr_inds < len(timestamps))
+    curr_inds = np.minimum(curr_inds, len(timestamps) - 1)
+    valid = in_range & (timestamps[curr_inds] != marker_times)
+
+    # Each marker must fall after the data point chosen for the previous
+    # one, otherwise it (and every marker after it) is never reached.
+    valid[1:] &= curr_inds[1:] > curr_inds[:-1]
+    num_marks = len(valid) if np.all(valid) else int(np.argmin(valid))
+
+    curr_inds = curr_inds[:num_marks]
+    marker_times = marker_times[:num_marks]
+    curr_times = timestamps[curr_inds]
+    prev_times = timestamps[curr_inds - 1]
+
+    take_prev = curr_times - marker_times > marker_times - prev_times
+    data_indices = np.where(take_prev, curr_inds - 1, curr_inds)
+    data_times = np.where(take_prev, prev_times, curr_times)
+    data_errors = np.where(take_prev, marker_times - prev_times, curr_times - marker_times)
+    data_curr_prev = take_prev.astype(int)
+
+    return data_indices.tolist(), data_times.tolist(), data_errors.tolist(), data_curr_prev.tolist()
+
+
+# ALIGN_MARKERS_SEQUENTIAL Same as ALIGN_MARKERS, by walking through the
+#   timestamps. Used for timestamps that are not increasing.
+#
+def align_markers_sequential(timestamps, marker_times):
+    data_indices = []
+    data_times = []
+    data_errors = []
+    data_curr_prev = []
+
+    num_marks = 0
+    prev_timestamp = timestamps[0]
+    for index in range(1, len(timestamps)):
+        # Stop once we've found all of the markers in the data
+        if num_marks >= len(marker_times):
+            break
+
+        curr_timestamp = timestamps[index]
+        marker_time = marker_times[num_marks]
+        if prev_timestamp < marker_time < curr_timestamp:
+            if curr_timestamp - marker_time > marker_time - prev_timestamp:
+                # The previous index has a lower error so it should be used.
+                data_indices.append(index-1)
+                data_times.append(float(prev_timestamp))
+                data_errors.append(float(marker_time - prev_timestamp))
+                data_curr_prev.append(1)
+            else:
+                # They are equal, pick the current over prev for parity
+                # with Matlab implementation. Or it is a smaller error.
+                data_indices.append(index)
+                data_times.append(float(curr_timestamp))
+                data_errors.append(float(curr_timestamp - marker_time))
+                data_curr_prev.append(0)
+            num_marks += 1
+        prev_timestamp = curr_timestamp
+
+    return data_indices, data_times, data_errors, data_curr_prev
+
+
 def custom_interval_upsample(data, times, interval):
     new_data = []
     new_times = []
@@ -204,32 +318,21 @@ def custom_interval_upsample(data, times, interval):
 
     return [new_data, new_times]
 
-# Don't replace these fields.
-BLACKLIST = {
-    'parsed_yaml': False,
-    'max_workers': False,
-    'logger': False,
-    'store': False
-}
+
+# PARSE_YAML_FOR_CONFIG Returns the config of the worker with the given name.
+#   The overrides given in the yaml config for the name (or it's parents) are
+#   layered over the given config, see ConfigResolver.
+#   INPUT:
+#       config - The config of the parent worker.
+#       name   - The name of the worker.
+#   RETURN:
+#       A read-only view of the config with the overrides for the name.
 def parse_yaml_for_config(config, name):
-    new_config = copy.deepcopy(config)
-    name_config = config['parsed_yaml'].get(name, None)
-
-    if not name_config:
-        # Check if some other portion of the config (higher-level)
-        # exists and use that one
-        newname = ':'.join(name.split(':')[:-1])
-        name_config = config['parsed_yaml'].get(newname, None)
-        while not name_config and len(newname.split(':')) > 2:
-            newname = ':'.join(newname.split(':')[:-1])
-            name_config = config['parsed_yaml'].get(newname, None)
-        if not name_config:
-            return config
-
-    for option in name_config:
-        if option not in BLACKLIST:
-            new_config[option] = name_config[option]
-    return new_config
+    if isinstance(config, ConfigView) and config.resolver is not None:
+        resolver = config.resolver
+    else:
+        resolver = ConfigResolver.get(config['parsed_yaml'])
+    return resolver.resolve(config, name)
 
 
 def jsonify_pd(data):
@@ -0,0 +1,80 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from pupillib.core.utilities.config_store import ConfigStore
+from pupillib.core.utilities.shared_arrays import to_mapped_arrays, from_mapped_arrays
+
+'''
+    Execution backends of the worker tree, chosen with the 'backend' config
+    entry:
+        thread  - (default) Workers are started as nested threads.
+        serial  - Workers are run one after the other in the calling thread.
+        process - The data stream workers (and everything below them) are
+                  run in a pool of processes. The stream arrays are passed
+                  to the processes, and the results back, through
+                  memory-mapped files.
+'''
+
+BACKENDS = ['thread', 'process', 'serial']
+
+
+def get_backend(config):
+    backend = config['backend'] if 'backend' in config else 'thread'
+    if backend not in BACKENDS:
+        raise Exception("Error: Unknown backend '" + str(backend) + "', it must be one of: " +
+                        ', '.join(BACKENDS))
+    return backend
+
+
+def run_worker_in_process(worker_class, config, name, tmp_dir, args):
+    # Used by the process backend to run a worker in a worker process.
+    ConfigStore.set_instance(config)
+    worker = worker_class(config, *from_mapped_arrays(args))
+    worker.setName(name)
+    worker.run()
+    return to_mapped_arrays(worker.proc_data, tmp_dir)
+
+
+class ProcessBackend(object):
+    def __init__(self, max_workers=None):
+        if max_workers is not None and max_workers < 1:
+            max_workers = None
+        self.tmp_dir = tempfile.mkdtemp(prefix='pupillib_')
+        self.pool = ProcessPoolExecutor(max_workers=max_workers)
+
+    '''
+        Runs worker_class(config, *args) with the given name in the pool,
+        the future's result is given by ProcessBackend.result.
+    '''
+    def submit(self, worker_class, config, name, *args):
+        return self.pool.submit(run_worker_in_process, worker_class, config, name, self.tmp_dir,
+                                to_mapped_arrays(list(args), self.tmp_dir))
+
+    @staticmethod
+    def result(future):
+        return from_mapped_arrays(future.result())
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
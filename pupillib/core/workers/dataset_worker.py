@@ -23,18 +23,22 @@ import threading
 from threading import Thread
 
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.workers.backends import get_backend
 from pupillib.core.workers.eye_worker import PLibEyeWorker
 from pupillib.core.workers.generic_eye_level_worker import GenericEyeLevelWorker
 from pupillib.core.workers.processors.dataset_processor import DatasetProcessor
+from pupillib.core.workers.scheduler import Task
 
 from pupillib.core.utilities import utilities
 
 
 class PLibDatasetWorker(Thread):
-    def __init__(self, config, dataset=None):
+    def __init__(self, config, dataset=None, process_backend=None):
         Thread.__init__(self)
         self.config = config    # Metadata about how to process the given datasets.
         self.dataset = dataset
+        # Pool that runs the data stream workers with the 'process' backend.
+        self.process_backend = process_backend
         self.logger = MultiProcessingLog.get_logger()
 
         self.initial_data = {
@@ -45,159 +49,130 @@ class PLibDatasetWorker(Thread):
         self.proc_eye_data = {}
         self.proc_generic_data = {}
         self.proc_dataset_data = {}
+        self.dataset_processor = None
+        self.rejected_streams = []
 
-    def run_eye_workers(self):
+        # Used when the data streams are run as tasks of a scheduler.
+        self.stream_workers = []
+        self.post_task = None
+
+    def run_pre_processing(self):
         # If this dataset is in the yaml config, specify it's
         # configuration by replacing the current one with a new one.
         self.config = utilities.parse_yaml_for_config(self.config, self.getName())
 
         # Run the pre processors.
-        # Run the pre processors.
-        dataset_processor = DatasetProcessor()
+        self.dataset_processor = DatasetProcessor()
         self.initial_data['dataset'] = self.dataset
-        rejected_streams = dataset_processor.reject_streams(self.initial_data)
+        self.rejected_streams = self.dataset_processor.reject_streams(self.initial_data)
         self.initial_data['dataset'] = {
             name: data
                 for name, data in self.initial_data['dataset'].items()
-                if name not in rejected_streams
+                if name not in self.rejected_streams
         }
-        if len(rejected_streams) > 0:
+        if len(self.rejected_streams) > 0:
             self.logger.send(
-                'INFO', 'Rejecting the following streams: ' + str(rejected_streams), os.getpid(), threading.get_ident()
+                'INFO', 'Rejecting the following streams: ' + str(self.rejected_streams), os.getpid(),
+                threading.get_ident()
             )
-            if 'all' in rejected_streams:
+            if 'all' in self.rejected_streams:
                 self.logger.send(
                     "INFO", "No data was given, or all streams are broken.", os.getpid(), threading.get_ident()
                 )
-                return None
+                return False
+        self.dataset = self.initial_data['dataset']
 
         if self.config['dataset_pre_processing']:
             for config in self.config['dataset_pre_processing']:
-                if config['name'] in dataset_processor.pre_processing.all:
-                    self.initial_data = dataset_processor.pre_processing.all[config['name']](self.initial_data, config)
-        self.dataset = self.initial_data['dataset']
+                if config['name'] in self.dataset_processor.pre_processing.all:
+                    self.initial_data = self.dataset_processor.pre_processing.all[config['name']](
+                        self.initial_data, config
+                    )
+            self.dataset = self.initial_data['dataset']
+        return True
 
-        eye_worker0 = PLibEyeWorker(self.config, self.dataset['eye0'], self.dataset['markers'])
-        eye_worker1 = PLibEyeWorker(self.config, self.dataset['eye1'], self.dataset['markers'])
-        eye_workers = [eye_worker0, eye_worker1]
-        if self.config['max_workers'] >= self.config['num_datasets'] + self.config['num_eyes']:
-            eye_count = 0
-            for i in eye_workers:
-                i.setName(self.getName() + ':eye' + str(eye_count))
-                eye_count += 1
-                i.start()
-            for i in eye_workers:
-                i.join()
+    # Returns a list of (data name, worker class) for each data
+    # stream that is processed. These are the eyes of pupil data
+    # (TODO: Completely disable and remove eye_workers if possible),
+    # or the requested streams for custom data.
+    def get_streams(self):
+        if not self.dataset['custom_data']:
+            datanames = ['eye0', 'eye1']
+            worker_class = PLibEyeWorker
         else:
-            if 'eye0' not in rejected_streams:
-                eye_worker0.setName(self.getName() + ':eye0')
-                eye_worker0.run()
-            if 'eye1' not in rejected_streams:
-                eye_worker1.setName(self.getName() + ':eye1')
-                eye_worker1.run()
-
-        eye_count = 0
+            datanames = self.dataset['dataname_list']
+            worker_class = GenericEyeLevelWorker
+        return [
+            (data_name, worker_class) for data_name in datanames
+            if data_name not in self.rejected_streams
+        ]
+
+    # Returns the cost that was estimated for a data stream, or 0.
+    def get_planned_cost(self, data_name):
+        name = self.getName() + ":" + data_name
+        if 'worker_plan' in self.config and name in self.config['worker_plan']:
+            return self.config['worker_plan'][name]['cost']
+        return 0
+
+    def get_stream_worker(self, data_name, worker_class):
+        stream_worker = worker_class(self.config, self.dataset[data_name], self.dataset['markers'])
+        stream_worker.setName(self.getName() + ":" + data_name)
+        return stream_worker
+
+    def run_post_processing(self, proc_data_for_data_name):
+        # The sampling rate is the one of eye0 for pupil data, and the
+        # one of the last stream processed for custom data.
+        srate_name = list(proc_data_for_data_name)[0 if not self.dataset['custom_data'] else -1]
         self.proc_dataset_data = {
             'config': {
                 'name': self.getName(),
-                'srate': eye_worker0.proc_data['config']['srate']
+                'srate': proc_data_for_data_name[srate_name]['config']['srate']
             },
-            'data': {
-                'eye0': eye_worker0.proc_data,
-                'eye1': eye_worker1.proc_data
-            }
+            'data': proc_data_for_data_name
         }
+        if self.dataset['custom_data']:
+            self.proc_generic_data = proc_data_for_data_name
 
         # Run the post processors.
         if self.config['dataset_post_processing']:
-            if not dataset_processor:
-                dataset_processor = DatasetProcessor()
-
             for config in self.config['dataset_post_processing']:
-                if config['name'] in dataset_processor.post_processing.all:
-                    dataset_processor.post_processing.all[config['name']](self.proc_dataset_data, config)
-
-    def run_generic_workers(self):
-        # If this dataset is in the yaml config, specify it's
-        # configuration by replacing the current one with a new one.
-        testing = self.config['testing']
-        self.config = utilities.parse_yaml_for_config(self.config, self.getName())
-
-        # Run the pre processors.
-        dataset_processor = DatasetProcessor()
-        self.initial_data['dataset'] = self.dataset
-        rejected_streams = dataset_processor.reject_streams(self.initial_data)
-        self.initial_data['dataset'] = {
-            name: data
-            for name, data in self.initial_data['dataset'].items()
-            if name not in rejected_streams
-        }
-        if len(rejected_streams) > 0:
-            self.logger.send(
-                'INFO', 'Rejecting the following streams: ' + str(rejected_streams), os.getpid(), threading.get_ident()
-            )
-            if 'all' in rejected_streams:
-                self.logger.send(
-                    "INFO", "No data was given, or all streams are broken.", os.getpid(), threading.get_ident()
-                )
-                return None
-        self.dataset = self.initial_data['dataset']
-
-        if self.config['dataset_pre_processing']:
-            for config in self.config['dataset_pre_processing']:
-                if config['name'] in dataset_processor.pre_processing.all:
-                    self.initial_data = dataset_processor.pre_processing.all[config['name']](self.initial_data, config)
-            self.dataset = self.initial_data['dataset']
-
-        generic_workers = {}
-        base_generic_worker = GenericEyeLevelWorker(self.config)
-        proc_data_for_data_name = {}
-        parallel = False
-
-        srate = 0
-        datanames = self.dataset['dataname_list']
-        for data_name in datanames:
-            if data_name in rejected_streams:
-                continue
-            data_for_data_name = self.dataset[data_name]
-
-            if self.config['max_workers'] >= self.config['num_datasets'] + len(datanames):
-                generic_worker = GenericEyeLevelWorker(self.config, data_for_data_name, self.dataset['markers'])
-                generic_worker.setName(self.getName() + ":" + data_name)
-                generic_workers[data_name] = generic_worker
-                generic_worker.start()
-                parallel = True
-            else:
-                base_generic_worker.setName(self.getName() + ":" + data_name)
-                base_generic_worker.set_data(data_for_data_name, self.dataset['markers'])
-                base_generic_worker.run()
-                proc_data_for_data_name[data_name] = base_generic_worker.proc_data
-                base_generic_worker.reset_initial_data()
-
-        if parallel:
-            for data_name in generic_workers:
-                generic_workers[data_name].join()
-            for data_name in datanames:
-                proc_data_for_data_name[data_name] = generic_workers[data_name].proc_data
-
-        self.proc_dataset_data = {
-            'config': {
-                'name': self.getName(),
-                'srate': base_generic_worker.proc_data['config']['srate']
-            }
-        }
-
-        self.proc_generic_data = proc_data_for_data_name
-        self.proc_dataset_data['data'] = proc_data_for_data_name
+                if config['name'] in self.dataset_processor.post_processing.all:
+                    self.dataset_processor.post_processing.all[config['name']](self.proc_dataset_data, config)
+
+    '''
+        Adds the tasks of this dataset to the scheduler: one that pre-processes
+        it and adds the tasks of it's data streams, and one that post-processes
+        the streams. Returns the last one.
+    '''
+    def add_tasks(self, scheduler, dependencies=None):
+        pre_task = Task(self.getName() + ':pre', self.add_stream_tasks, scheduler, dependencies=dependencies)
+        self.post_task = Task(self.getName() + ':post', self.finish_stream_tasks, dependencies=[pre_task])
+        scheduler.submit(pre_task, self.post_task)
+        return self.post_task
+
+    def add_stream_tasks(self, scheduler):
+        self.stream_workers = []
+        if self.dataset['custom_data']:
+            self.logger.send('INFO', 'Processing custom data.')
+        if not self.run_pre_processing():
+            return
 
-        # Run the post processors.
-        if self.config['dataset_post_processing']:
-            if not dataset_processor:
-                dataset_processor = DatasetProcessor()
+        self.stream_workers = [
+            (data_name, self.get_stream_worker(data_name, worker_class))
+            for data_name, worker_class in self.get_streams()
+        ]
+        scheduler.add_dependencies(self.post_task, [
+            stream_worker.add_tasks(scheduler) for _, stream_worker in self.stream_workers
+        ])
 
-            for config in self.config['dataset_post_processing']:
-                if config['name'] in dataset_processor.post_processing.all:
-                    dataset_processor.post_processing.all[config['name']](self.proc_dataset_data, config)
+    def finish_stream_tasks(self):
+        if not self.stream_workers:
+            return
+        self.run_post_processing({
+            data_name: stream_worker.proc_data for data_name, stream_worker in self.stream_workers
+        })
+        self.stream_workers = []
+        self.logger.send('INFO', 'Done all data streams for ' + self.getName())
 
     def run(self):
         if self.config['testing']:
@@ -206,10 +181,31 @@ class PLibDatasetWorker(Thread):
             self.logger.send('ERROR', 'Dataset worker is missing a dataset', os.getpid(), threading.get_ident())
             return
 
-        # TODO: Completely disable and remove eye_workers if possible
-        if not self.dataset['custom_data']:
-            self.run_eye_workers()
-        else:
+        if self.dataset['custom_data']:
             self.logger.send('INFO', 'Processing custom data.')
-            self.run_generic_workers()
+        if not self.run_pre_processing():
+            return
+
+        streams = self.get_streams()
+        if get_backend(self.config) == 'process':
+            # The most costly streams are submitted first.
+            futures = {
+                data_name: self.process_backend.submit(worker_class, self.config, self.getName() + ":" + data_name,
+                                                       self.dataset[data_name], self.dataset['markers'])
+                for data_name, worker_class in sorted(
+                    streams, key=lambda stream: self.get_planned_cost(stream[0]), reverse=True
+                )
+            }
+            proc_data_for_data_name = {
+                data_name: self.process_backend.result(futures[data_name])
+                for data_name, _ in streams
+            }
+        else:
+            proc_data_for_data_name = {}
+            for data_name, worker_class in streams:
+                stream_worker = self.get_stream_worker(data_name, worker_class)
+                stream_worker.run()
+                proc_data_for_data_name[data_name] = stream_worker.proc_data
+
+        self.run_post_processing(proc_data_for_data_name)
         self.logger.send('INFO', 'Done all data streams for ' + self.getName())
@@ -25,7 +25,9 @@ import numpy as np
 from threading import Thread
 
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.utilities.config_store import with_values
 from pupillib.core.workers.processors.eye_processor import EyeProcessor
+from pupillib.core.workers.scheduler import Task
 from pupillib.core.workers.trigger_worker import PLibTriggerWorker
 
 import pupillib.core.utilities.utilities as utilities
@@ -34,11 +36,11 @@ import pupillib.core.utilities.utilities as utilities
 class PLibEyeWorker(Thread):
     def __init__(self, config, eye_dataset=None, markers=None):
         Thread.__init__(self)
-        self.config = copy.deepcopy(config)    # Metadata about how to process the given datasets.
         self.eye_dataset = eye_dataset
         self.eye_dataset['srate'] = np.size(self.eye_dataset['data'], 0) / \
                 (np.max(self.eye_dataset['timestamps']) - np.min(self.eye_dataset['timestamps']))
-        self.config['srate'] = eye_dataset['srate']
+        # Metadata about how to process the given datasets.
+        self.config = with_values(config, srate=eye_dataset['srate'])
         self.markers = markers
         self.logger = MultiProcessingLog.get_logger()
 
@@ -50,8 +52,44 @@ class PLibEyeWorker(Thread):
 
         self.trigger_data = {}
         self.proc_data = {}
+        self.eye_processor = None
+
+        # Used when the triggers are run as tasks of a scheduler.
+        self.trigger_workers = []
+        self.post_task = None
 
     def run(self):
+        self.run_pre_processing()
+        for trigger, trigger_worker in self.get_trigger_workers():
+            trigger_worker.run()
+            self.trigger_data[trigger] = copy.deepcopy(trigger_worker.proc_trigger_data)
+        self.run_post_processing()
+
+    '''
+        Adds the tasks of this eye to the scheduler: one that pre-processes
+        it and adds the tasks of it's triggers, and one that post-processes
+        the triggers. Returns the last one.
+    '''
+    def add_tasks(self, scheduler, dependencies=None):
+        pre_task = Task(self.getName() + ':pre', self.add_trigger_tasks, scheduler, dependencies=dependencies)
+        self.post_task = Task(self.getName() + ':post', self.finish_trigger_tasks, dependencies=[pre_task])
+        scheduler.submit(pre_task, self.post_task)
+        return self.post_task
+
+    def add_trigger_tasks(self, scheduler):
+        self.run_pre_processing()
+        self.trigger_workers = self.get_trigger_workers()
+        scheduler.add_dependencies(self.post_task, [
+            trigger_worker.add_tasks(scheduler) for _, trigger_worker in self.trigger_workers
+        ])
+
+    def finish_trigger_tasks(self):
+        for trigger, trigger_worker in self.trigger_workers:
+            self.trigger_data[trigger] = copy.deepcopy(trigger_worker.proc_trigger_data)
+        self.trigger_workers = []
+        self.run_post_processing()
+
+    def run_pre_processing(self):
         self.trigger_data = {}
         self.proc_data = {}
         if self.config['testing']:
@@ -64,28 +102,29 @@ class PLibEyeWorker(Thread):
         print('with the following triggers: ' + str(self.config['triggers']))
 
         # Run the pre processors.
-        eye_processor = None
+        self.eye_processor = None
         if self.config['eye_pre_processing']:
-            eye_processor = EyeProcessor()
+            self.eye_processor = EyeProcessor()
 
             for config in self.config['eye_pre_processing']:
-                if config['name'] in eye_processor.pre_processing.all:
-                    eye_processor.pre_processing.all[config['name']](self.initial_data, config)
+                if config['name'] in self.eye_processor.pre_processing.all:
+                    self.eye_processor.pre_processing.all[config['name']](self.initial_data, config)
 
-        trigger_workers = {}
-        base_trig_worker = PLibTriggerWorker(self.config, self.eye_dataset)
-        parallel = False
-        # For each trigger, get the number of trials that are within
-        # each of them and start a thread to process those.
-        trig_list = []
+    def get_trigger_list(self):
         if self.config['triggers'] and self.markers['eventnames'] is not None:
-            trig_list = self.config['triggers']
-        else:
-            trig_list = []
+            return self.config['triggers']
+        return []
 
-        for i in trig_list:
+    # Returns a list of (trigger name, trigger worker) for
+    # each trigger that is found in the markers.
+    def get_trigger_workers(self):
+        # For each trigger, get the number of trials that are within
+        # each of them and make a worker to process those.
+        trigger_workers = []
+        for i in self.get_trigger_list():
             inds = utilities.get_marker_indices(self.markers['eventnames'], i)
             proc_mtimes = utilities.indVal(self.markers['timestamps'], inds)
+            proc_positions = utilities.get_grid_positions(self.markers, self.eye_dataset['timestamps'], inds)
             print('Now at trigger: ' + i)
 
             if len(proc_mtimes) == 0:
@@ -94,31 +133,14 @@ class PLibEyeWorker(Thread):
                 continue
 
             self.trigger_data[i] = {}
-            # If we have enough workers available, do them all in parallel.
-            # Otherwise, we simply do them sequentially.
-            if self.config['max_workers'] > self.config['num_datasets'] + \
-                    self.config['num_eyes'] + self.config['total_triggers']:
-                trigger_worker = PLibTriggerWorker(self.config, self.eye_dataset, inds, proc_mtimes, copy.deepcopy(i))
-                trigger_worker.setName(self.getName() + ":trigger" + i)
-                trigger_workers[i] = trigger_worker
-                trigger_worker.start()
-                parallel = True
-            else:
-                base_trig_worker.setName(self.getName() + ":trigger" + i)
-                base_trig_worker.marker_inds = inds
-                base_trig_worker.marker_times = proc_mtimes
-                base_trig_worker.marker_name = copy.deepcopy(i)
-                base_trig_worker.reset_initial_data()
-                base_trig_worker.run()
-                self.trigger_data[i] = copy.deepcopy(base_trig_worker.proc_trigger_data)
-
-        if parallel:
-            for i in trigger_workers:
-                trigger_workers[i].join()
-            #self.logger.send('INFO', 'Done all eyes for ' + self.getName())
-            for i in self.config['triggers']:
-                self.trigger_data[i] = copy.deepcopy(trigger_workers[i].proc_trigger_data)
-
+            trigger_worker = PLibTriggerWorker(self.config, self.eye_dataset, inds, proc_mtimes, copy.deepcopy(i),
+                                               marker_positions=proc_positions)
+            trigger_worker.setName(self.getName() + ":trigger" + i)
+            trigger_workers.append((i, trigger_worker))
+        return trigger_workers
+
+    def run_post_processing(self):
+        trig_list = self.get_trigger_list()
         self.proc_data = {
             'config': {
                 'dataset': self.eye_dataset,
@@ -134,9 +156,9 @@ class PLibEyeWorker(Thread):
 
         # Run the post processors.
         if self.config['eye_post_processing']:
-            if not eye_processor:
-                eye_processor = EyeProcessor()
+            if not self.eye_processor:
+                self.eye_processor = EyeProcessor()
 
             for config in self.config['eye_post_processing']:
-                if config['name'] in eye_processor.post_processing.all:
-                    eye_processor.post_processing.all[config['name']](self.proc_eye_data, config)
+                if config['name'] in self.eye_processor.post_processing.all:
+                    self.eye_processor.post_processing.all[config['name']](self.proc_eye_data, config)
@@ -18,15 +18,16 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
-import copy
 import os
 import threading
 import numpy as np
 from threading import Thread
 
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.utilities.config_store import with_values
 from pupillib.core.workers.processors.eye_processor import EyeProcessor
 from pupillib.core.workers.processors.generic_eye_level_processor import GenericEyeLevelProcessor
+from pupillib.core.workers.scheduler import Task
 from pupillib.core.workers.trigger_worker import PLibTriggerWorker
 
 import pupillib.core.utilities.utilities as utilities
@@ -35,14 +36,17 @@ import pupillib.core.utilities.utilities as utilities
 class GenericEyeLevelWorker(Thread):
     def __init__(self, config, dataset=None, markers=None):
         Thread.__init__(self)
-        self.config = copy.deepcopy(config)    # Metadata about how to process the given datasets.
         self.dataset = dataset
+        srate = 0
         if dataset and 'data' in self.dataset and 'timestamp' in self.dataset:
             self.dataset['srate'] = np.size(self.dataset['data'], 0) / \
                 (np.max(self.dataset['timestamps']) - np.min(self.dataset['timestamps']))
-            self.config['srate'] = dataset['srate']
-        else:
-            self.config['srate'] = 0
+            srate = dataset['srate']
+        elif dataset and 'srate' in dataset:
+            # Same as set_data, for workers that are started in parallel.
+            srate = dataset['srate']
+        # Metadata about how to process the given datasets.
+        self.config = with_values(config, srate=srate)
 
         self.markers = markers
         print(self.markers)
@@ -56,6 +60,11 @@ class GenericEyeLevelWorker(Thread):
 
         self.trigger_data = {}
         self.proc_data = {}
+        self.processor = None
+
+        # Used when the triggers are run as tasks of a scheduler.
+        self.trigger_workers = []
+        self.post_task = None
 
     def reset_initial_data(self):
         self.config = self.initial_data['config']
@@ -68,7 +77,7 @@ class GenericEyeLevelWorker(Thread):
             self.dataset['srate'] = np.size(data['data'], 0) / \
                 (np.max(data['timestamps']) - np.min(data['timestamps']))
         self.markers = markers
-        self.config['srate'] = self.dataset['srate']
+        self.config = with_values(self.config, srate=self.dataset['srate'])
 
         self.initial_data = {
             'config': self.config,    # Metadata about how to process the given datasets.
@@ -77,19 +86,51 @@ class GenericEyeLevelWorker(Thread):
         }
 
     def run(self):
-        self.trigger_data = {}
-        self.proc_data = {}
+        self.run_pre_processing()
+        for trigger, trigger_worker in self.get_trigger_workers():
+            trigger_worker.run()
+            self.trigger_data[trigger] = trigger_worker.proc_trigger_data
+        self.run_post_processing()
+
+    '''
+        Adds the tasks of this data stream to the scheduler: one that
+        pre-processes it and adds the tasks of it's triggers, and one that
+        post-processes the triggers. Returns the last one.
+    '''
+    def add_tasks(self, scheduler, dependencies=None):
+        pre_task = Task(self.getName() + ':pre', self.add_trigger_tasks, scheduler, dependencies=dependencies)
+        self.post_task = Task(self.getName() + ':post', self.finish_trigger_tasks, dependencies=[pre_task])
+        scheduler.submit(pre_task, self.post_task)
+        return self.post_task
+
+    def add_trigger_tasks(self, scheduler):
+        self.run_pre_processing()
+        self.trigger_workers = self.get_trigger_workers()
+        scheduler.add_dependencies(self.post_task, [
+            trigger_worker.add_tasks(scheduler) for _, trigger_worker in self.trigger_workers
+        ])
+
+    def finish_trigger_tasks(self):
+        for trigger, trigger_worker in self.trigger_workers:
+            self.trigger_data[trigger] = trigger_worker.proc_trigger_data
+        self.trigger_workers = []
+        self.run_post_processing()
+
+    def get_processor(self):
+        data_proc_list = {
+            'eye0': EyeProcessor(),
+            'eye1': EyeProcessor(),
+        }
 
-        def data_name_to_processor(data_name):
-            data_proc_list = {
-                'eye0': EyeProcessor(),
-                'eye1': EyeProcessor(),
-            }
+        data_name = self.getName().split(":")[-1]
+        if data_name in data_proc_list:
+            return data_proc_list[data_name]
+        else:
+            return GenericEyeLevelProcessor()
 
-            if data_name in data_proc_list:
-                return data_proc_list[data_name]
-            else:
-                return GenericEyeLevelProcessor()
+    def run_pre_processing(self):
+        self.trigger_data = {}
+        self.proc_data = {}
 
         if self.config['testing']:
             self.logger.send('INFO', 'I am an eye worker. I split the triggers.', os.getpid(), threading.get_ident())
@@ -102,27 +143,29 @@ class GenericEyeLevelWorker(Thread):
         print('with the following triggers: ' + str(self.config['triggers']))
 
         # Run the pre processors.
-        processor = None
-        name = self.getName().split(":")[-1]
+        self.processor = None
         if self.config['eye_pre_processing']:
-            processor = data_name_to_processor(name)
+            self.processor = self.get_processor()
 
             for config in self.config['eye_pre_processing']:
-                if config['name'] in processor.pre_processing.all:
-                    processor.pre_processing.all[config['name']](self.dataset, config)
+                if config['name'] in self.processor.pre_processing.all:
+                    self.processor.pre_processing.all[config['name']](self.dataset, config)
 
-        trigger_workers = {}
-        base_trig_worker = PLibTriggerWorker(self.config, self.dataset)
-        parallel = False
-        # For each trigger, get the number of trials that are within
-        # each of them and start a thread to process those.
-        trig_list = []
+    def get_trigger_list(self):
         if self.config['triggers'] and self.markers['eventnames'] is not None:
-            trig_list = self.config['triggers']
+            return self.config['triggers']
+        return []
 
-        for i in trig_list:
+    # Returns a list of (trigger name, trigger worker) for
+    # each trigger that is found in the markers.
+    def get_trigger_workers(self):
+        # For each trigger, get the number of trials that are within
+        # each of them and make a worker to process those.
+        trigger_workers = []
+        for i in self.get_trigger_list():
             inds = utilities.get_marker_indices(self.markers['eventnames'], i)
             proc_mtimes = utilities.indVal(self.markers['timestamps'], inds)
+            proc_positions = utilities.get_grid_positions(self.markers, self.dataset['timestamps'], inds)
             #self.logger.send('INFO', str(inds), os.getpid(), threading.get_ident())
             #self.logger.send('INFO', str(proc_mtimes), os.getpid(), threading.get_ident())
             if len(proc_mtimes) == 0:
@@ -131,32 +174,14 @@ class GenericEyeLevelWorker(Thread):
                 continue
 
             self.trigger_data[i] = {}
-
-            # If we have enough workers available, do them all in parallel.
-            # Otherwise, we simply do them sequentially.
-            if self.config['max_workers'] > self.config['num_datasets'] + \
-                    self.config['num_eyes'] + self.config['total_triggers']:
-                trigger_worker = PLibTriggerWorker(self.config, self.dataset, inds, proc_mtimes, i)
-                trigger_worker.setName(self.getName() + ":trigger" + i)
-                trigger_workers[i] = trigger_worker
-                trigger_worker.start()
-                parallel = True
-            else:
-                base_trig_worker.setName(self.getName() + ":trigger" + i)
-                base_trig_worker.marker_inds = inds
-                base_trig_worker.marker_times = proc_mtimes
-                base_trig_worker.marker_name = copy.deepcopy(i)
-                base_trig_worker.reset_initial_data()
-                base_trig_worker.run()
-                self.trigger_data[i] = copy.deepcopy(base_trig_worker.proc_trigger_data)
-
-        if parallel:
-            for i in trigger_workers:
-                trigger_workers[i].join()
-            #self.logger.send('INFO', 'Done all eyes for ' + self.getName())
-            for i in self.config['triggers']:
-                self.trigger_data[i] = trigger_workers[i].proc_trigger_data
-
+            trigger_worker = PLibTriggerWorker(self.config, self.dataset, inds, proc_mtimes, i,
+                                               marker_positions=proc_positions)
+            trigger_worker.setName(self.getName() + ":trigger" + i)
+            trigger_workers.append((i, trigger_worker))
+        return trigger_workers
+
+    def run_post_processing(self):
+        trig_list = self.get_trigger_list()
         self.proc_data = {
             'config': {
                 'name': self.getName(),
@@ -177,9 +202,9 @@ class GenericEyeLevelWorker(Thread):
 
         # Run the post processors.
         if self.config['eye_post_processing']:
-            if not processor:
-                processor = data_name_to_processor(name)
+            if not self.processor:
+                self.processor = self.get_processor()
 
             for config in self.config['eye_post_processing']:
-                if config['name'] in processor.post_processing.all:
-                    processor.post_processing.all[config['name']](self.proc_data, config)
\ No newline at end of file
+                if config['name'] in self.processor.post_processing.all:
+                    self.processor.post_processing.all[config['name']](self.proc_data, config)
@@ -25,6 +25,7 @@ import numpy as np
 from pupillib.core.workers.processors.decorator_registrar import *
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
 from pupillib.core.utilities.utilities import *
+from pupillib.core.utilities.epoching import resample_streams
 
 # Imports for pre and post processing functions go below this line and above
 # the end line below. This is the recommended method of adding new and long
@@ -48,7 +49,8 @@ DSTREAMS_BLACKLIST = [
     'custom_data',
     'merged',
     'dataname_list',
-    'dataset_name'
+    'dataset_name',
+    'timestamps'
 ]
 
 class DatasetDefaults():
@@ -239,8 +241,8 @@ class DatasetProcessor():
                 arrt = np.asarray(d['timestamps'])
 
                 new_dataset_data['dataset'][dset] = {
-                    'data': list(arrd[numbers]),
-                    'timestamps': list(arrt[numbers])
+                    'data': arrd[numbers],
+                    'timestamps': arrt[numbers]
                 }
                 new_dataset_data['dataset'][dset]['srate'] = len(new_dataset_data['dataset'][dset]['data'])/(
                     new_dataset_data['dataset'][dset]['timestamps'][-1] -
@@ -262,89 +264,37 @@ class DatasetProcessor():
 
             dataset_data = clean_nan_data(dataset_data)
 
-            for dset in dataset_data['dataset']:
-                d = dataset_data['dataset'][dset]
-                if type(d) is not dict:
-                    continue
-                if 'data' not in d:
-                    continue
-                dataset_data['dataset'][dset]['data'] = list(np.nan_to_num(d['data']))
-
             min_dataname, max_dataname = pick_best_stream(dataset_data)
-            min_datastream = dataset_data['dataset'][min_dataname]['timestamps']
-            max_datastream = dataset_data['dataset'][max_dataname]['timestamps']
-            global_min = min_datastream[0]
-            global_max = max_datastream[-1]
-
-            all_data = {
-                dataname: dataset_data['dataset'][dataname]
-                    for dataname in dataset_data['dataset']
-                    if dataname not in DSTREAMS_BLACKLIST
-            }
-            for dataname in all_data:
-                dstream = all_data[dataname]
-                data_ts = dstream['timestamps']
-                data_dset = dstream['data']
-
-                # Replace start points
-                cur_start = 0
-                cur_min = data_ts[0]
-                new_data_ts = data_ts
-                new_data_dset = data_dset
-                if cur_min != global_min:
-                    new_data_ts = []
-                    for count, _ in enumerate(data_ts[:-1]):
-                        if data_ts[count] < global_min <= data_ts[count+1]:
-                            cur_start = count
-                            break
-
-                    # Replace first data points
-                    new_data_ts = data_ts[cur_start:]
-                    new_data_dset = data_dset[cur_start:]
-
-                    # Interpolate a new data point
-                    new_data_dset[0] = linear_approx(
-                        new_data_dset[0], new_data_ts[0],
-                        new_data_dset[1], new_data_ts[1],
-                        global_min
-                    )
-                    new_data_ts[0] = global_min
-
-                # Replace end points
-                cur_max = data_ts[-1]
-                if cur_max != global_max:
-                    cur_end = len(data_ts) - 1
-                    cur_end_offset = 0
-                    reved_ts = data_ts[::-1]
-                    for count, _ in enumerate(reved_ts):
-                        if reved_ts[count] >= global_max > reved_ts[count+1]:
-                            cur_end_offset = count
-                            break
-
-                    # Second value of slice is exclusive, add 1
-                    # to keep the value (it's going to be replaced)
-                    cur_end = cur_end - cur_end_offset + 1
-                    new_data_ts = new_data_ts[:cur_end]
-                    new_data_dset = new_data_dset[:cur_end]
-
-                    # Interpolate a new data point
-                    new_data_dset[-1] = linear_approx(
-                        new_data_dset[-2], new_data_ts[-2],
-                        new_data_dset[-1], new_data_ts[-1],
-                        global_max
-                    )
-                    new_data_ts[-1] = global_max
-
-                new_dstream = dstream
-                if srate != 'None' and srate is not None:
-                    print('Resampling data to ' + str(srate) + 'Hz...')
-                    total_time = global_max - global_min
-                    new_xrange = np.linspace(global_min, global_max, num=srate * (total_time))
-
-                    new_dstream['data'] = np.interp(new_xrange, new_data_ts, new_data_dset)
-                    new_dstream['timestamps'] = new_xrange
-
-                    dataset_data['dataset'][dataname] = new_dstream
+            global_min = dataset_data['dataset'][min_dataname]['timestamps'][0]
+            global_max = dataset_data['dataset'][max_dataname]['timestamps'][-1]
+
+            datanames = [
+                dataname for dataname in dataset_data['dataset']
+                if dataname not in DSTREAMS_BLACKLIST
+            ]
+            if srate != 'None' and srate is not None:
+                print('Resampling data to ' + str(srate) + 'Hz...')
+
+                # All streams are clipped to the times that they all share
+                # and resampled onto the same timestamps.
+                new_xrange, new_data = resample_streams(
+                    [dataset_data['dataset'][dataname]['timestamps'] for dataname in datanames],
+                    [dataset_data['dataset'][dataname]['data'] for dataname in datanames],
+                    global_min, global_max, srate
+                )
+                # The streams share one read-only timestamp array, so the
+                # markers are placed in it once for the whole dataset.
+                new_xrange.flags.writeable = False
+                dataset_data['dataset']['timestamps'] = new_xrange
+                for row, dataname in enumerate(datanames):
+                    dataset_data['dataset'][dataname]['data'] = new_data[row]
+                    dataset_data['dataset'][dataname]['timestamps'] = new_xrange
+
+                markers = dataset_data['dataset']['markers']
+                markers['grid_timestamps'] = new_xrange
+                markers['grid_positions'] = np.searchsorted(
+                    new_xrange, np.asarray(markers['timestamps'], dtype=np.float64), side='left'
+                )
 
             for dset in dataset_data['dataset']:
                 if dset in DSTREAMS_BLACKLIST:
@@ -18,10 +18,12 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
+import functools
+
 import numpy as np
-import copy
 
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.utilities.epoching import stack_trials
 from pupillib.core.workers.processors.decorator_registrar import *
 
 # Imports for pre and post processing functions go below this line and above
@@ -65,48 +67,150 @@ class TrialDefaults():
         ]
 
 
-def filter_fft_data(data, low_freq, high_freq, srate):
-    dist_between_samples = 1 / srate
-
-    # Bad hack to deal with the windowing and edge effects
-    # TODO: Make this function lose data on it's edges
-    # TODO: or leave it alone.
-    init_length = len(data)
-    pad_data = np.concatenate(
-        [
-            data[0:int(len(data) / 2)][::-1],
-            data,
-            data[int(len(data) / 2):][::-1]
-        ]
-    )
+@functools.lru_cache(maxsize=128)
+def get_fft_mask(length, srate, low_freq, high_freq):
+    # Frequencies of a real FFT of the given length that are kept by
+    # the band-pass filter, the zero frequency is always kept.
+    freq_bins = np.fft.rfftfreq(length, d=1 / srate)
+    mask = ~((freq_bins < low_freq) | (freq_bins > high_freq))
+    mask[freq_bins == 0] = True
+    mask.setflags(write=False)
+    return mask
+
+
+def filter_fft_trials(datas, low_freq, high_freq, srate):
+    # Filters many trials at once, all trials with the same
+    # length are stacked and filtered together.
+    datas = [np.asarray(data, dtype=np.float64) for data in datas]
+    filtered = [None] * len(datas)
 
-    freq_bins = np.fft.fftfreq(pad_data.size, d=dist_between_samples)
-    freq_signal = np.fft.fft(pad_data, n=len(pad_data))
+    rows_by_length = {}
+    for row, data in enumerate(datas):
+        rows_by_length.setdefault(len(data), []).append(row)
 
-    filt_freq_signal = freq_signal.copy()
-    zero_freq = copy.deepcopy(filt_freq_signal[freq_bins == 0])
-    filt_freq_signal[(abs(freq_bins) < low_freq)] = 0
-    filt_freq_signal[(abs(freq_bins) > high_freq)] = 0
-    filt_freq_signal[freq_bins == 0] = zero_freq
+    for init_length, rows in rows_by_length.items():
+        trials = np.stack([datas[row] for row in rows])
 
-    start = int(init_length / 2)
-    filt_signal = np.fft.ifft(filt_freq_signal, n=len(pad_data)).real
-    filt_signal = filt_signal[start:start + init_length]
-    return filt_signal
+        # Bad hack to deal with the windowing and edge effects
+        # TODO: Make this function lose data on it's edges
+        # TODO: or leave it alone.
+        start = int(init_length / 2)
+        pad_data = np.concatenate(
+            [
+                trials[:, 0:start][:, ::-1],
+                trials,
+                trials[:, start:][:, ::-1]
+            ],
+            axis=1
+        )
+
+        freq_signal = np.fft.rfft(pad_data, axis=1)
+        freq_signal[:, ~get_fft_mask(pad_data.shape[1], srate, low_freq, high_freq)] = 0
+        filt_signal = np.fft.irfft(freq_signal, n=pad_data.shape[1], axis=1)
+        filt_signal = filt_signal[:, start:start + init_length]
+
+        for i, row in enumerate(rows):
+            filtered[row] = filt_signal[i]
+
+    return filtered
+
+
+def filter_fft_data(data, low_freq, high_freq, srate):
+    return filter_fft_trials([data], low_freq, high_freq, srate)[0]
+
+
+def moving_average_trials(datas, window_size):
+    # Moving average of many trials at once, with the edges padded by
+    # mirroring the data. All trials with the same length are stacked
+    # and use cumulative sums, so the cost doesn't depend on the window size.
+
+    # Ensure window size is always odd
+    if window_size % 2 == 0:
+        window_size += 1
+    window_sides = int((window_size - 1)/2)
+
+    datas = [np.asarray(data, dtype=np.float64) for data in datas]
+    averaged = [None] * len(datas)
+
+    rows_by_length = {}
+    for row, data in enumerate(datas):
+        rows_by_length.setdefault(len(data), []).append(row)
+
+    for length, rows in rows_by_length.items():
+        trials = np.stack([datas[row] for row in rows])
+        pad_data = np.concatenate(
+            [
+                trials[:, :window_size][:, ::-1],
+                trials,
+                trials[:, max(length - window_size, 0):][:, ::-1]
+            ],
+            axis=1
+        )
+
+        # Windows are centered on the points between the padding.
+        num_windows = max(pad_data.shape[1] - 2*window_size, 0)
+        starts = window_size - window_sides + np.arange(num_windows)
+
+        # Values are centered on their mean before summing to
+        # limit the rounding errors of the cumulative sum.
+        finite = np.isfinite(pad_data)
+        counts = np.maximum(finite.sum(axis=1), 1)
+        centers = np.where(finite, pad_data, 0).sum(axis=1) / counts
+        centered = np.where(finite, pad_data - centers[:, None], 0)
+        sums = np.concatenate([np.zeros((len(rows), 1)), np.cumsum(centered, axis=1)], axis=1)
+        new_data = (sums[:, starts + window_size] - sums[:, starts]) / window_size + centers[:, None]
+
+        # Windows with non-finite values are averaged directly.
+        nonfinite = np.concatenate(
+            [np.zeros((len(rows), 1), dtype=np.int64), np.cumsum(~finite, axis=1)], axis=1
+        )
+        bad_rows, bad_windows = np.nonzero(
+            nonfinite[:, starts + window_size] - nonfinite[:, starts] > 0
+        )
+        for i, window in zip(bad_rows, bad_windows):
+            new_data[i, window] = np.mean(pad_data[i, starts[window]:starts[window] + window_size])
+
+        for i, row in enumerate(rows):
+            averaged[row] = new_data[i]
+
+    return averaged
+
+
+# Rejects trials that have more than `zeros_to_count` data points that
+# are zero when rounded to `digit_tolerance` digits, values greater or
+# equal to `gtval`, or values less or equal to `ltval`. Criteria that are
+# None are not used. All trials are stacked and checked in one pass, and
+# a boolean vector that is True for the rejected trials is returned.
+def get_trial_rejections(datas, zeros_to_count=None, digit_tolerance=0, gtval=None, ltval=None):
+    trials, lengths = stack_trials(datas)
+    reject = np.zeros(len(datas), dtype=bool)
+    if trials.shape[1] == 0:
+        return reject
+
+    if zeros_to_count is not None:
+        # Padding is NaN, so it's never counted as a zero.
+        zcounts = np.sum(np.round(trials, digit_tolerance) == 0, axis=1)
+        reject |= zcounts > zeros_to_count
+    if gtval is not None:
+        reject |= np.fmax.reduce(trials, axis=1) >= gtval
+    if ltval is not None:
+        reject |= np.fmin.reduce(trials, axis=1) <= ltval
+
+    return reject
+
+
+# Same as get_trial_rejections, for use with process_trials(..., batch=True).
+def filter_rm_trials(datas, **criteria):
+    return [bool(reject) for reject in get_trial_rejections(datas, **criteria)]
 
 
 def filter_rm_trials_with_vals_gt(data, gtval):
-    maxdata = max(data)
-    if maxdata >= gtval:
-        return True
-    return False
+    return bool(get_trial_rejections([data], gtval=gtval)[0])
 
 
 def filter_rm_trials_with_vals_lt(data, ltval):
-    mindata = min(data)
-    if mindata <= ltval:
-        return True
-    return False
+    return bool(get_trial_rejections([data], ltval=ltval)[0])
+
 
 class TrialProcessor():
     def __init__(self):
@@ -143,15 +247,11 @@ class TrialProcessor():
             zero_count_tolerance = args[0]['zeros_to_count']
             digit_tolerance = args[1]['digit_tolerance']
 
-            zcount = 0
-            throw_away = False
-            data = trial_data['trial']['data']
-            for i in data:
-                if np.round(i, digit_tolerance) == 0:
-                    zcount += 1
-                    if zcount > zero_count_tolerance:
-                        throw_away = True
-                        break
+            throw_away = get_trial_rejections(
+                [trial_data['trial']['data']],
+                zeros_to_count=zero_count_tolerance,
+                digit_tolerance=digit_tolerance
+            )[0]
 
             if throw_away:
                 trial_data['reject'] = True
@@ -161,29 +261,9 @@ class TrialProcessor():
         @post
         def filter_moving_average(trial_data, config):
             args = config['config']
-            logger = MultiProcessingLog.get_logger()
             window_size = args[0]['window_size']
 
-            # Ensure window size is always odd
-            if window_size % 2 == 0:
-                window_size += 1
-            window_sides = int((window_size - 1)/2)
-
-            data = trial_data['trial']['data']
-            new_data = []
-            pad_data = list(data[:window_size][::-1]) + list(data) + list(data[-window_size:][::-1])
-            for count, _ in enumerate(pad_data):
-                if count <= window_size - 1 or count > (len(pad_data) - 1) - window_size:
-                    continue
-
-                window = pad_data[count-window_sides:count] +\
-                         [pad_data[count]] +\
-                         pad_data[count+1:count+window_sides+1]
-
-                avg = np.mean(window)
-                new_data.append(avg.copy())
-
-            trial_data['trial']['data'] = new_data
+            trial_data['trial']['data'] = moving_average_trials([trial_data['trial']['data']], window_size)[0]
             return trial_data
 
         @post
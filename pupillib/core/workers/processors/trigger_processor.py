@@ -36,6 +36,8 @@ from pupillib.core.workers.processors.processing_functions.testing_functions imp
 from matplotlib import pyplot as plt
 
 from pupillib.core.utilities.utilities import *
+from pupillib.core.utilities.epoching import remove_baseline, resample_trials, stack_trials
+from pupillib.core.workers.processors.trial_processor import get_trial_rejections
 
 
 # --------------------------- Imports end line ----------------------------#
@@ -102,101 +104,90 @@ class TriggerProcessor():
             if len(proc_trial_data) <= 0:
                 return trigger_data
 
-            for trial_num, trial_info in proc_trial_data.items():
-                if 'reject' in trial_info and trial_info['reject']:
-                    continue
-                times = trial_info['trial']['timestamps']
-                stimes = np.asarray(times) - times[0]
-                new_xrange = np.linspace(stimes[0], stimes[-1], num=srate*(stimes[-1]-stimes[0]))
-
-                trial_info['trial']['data'] = np.interp(
-                    new_xrange,
-                    stimes,
-                    trial_info['trial']['data']
-                )
+            trials = [
+                trial_info for trial_num, trial_info in proc_trial_data.items()
+                if not ('reject' in trial_info and trial_info['reject'])
+            ]
+            if len(trials) <= 0:
+                return trigger_data
+
+            # Resample all trials at once, each trial points to its
+            # row in the resampled matrices.
+            new_times, lengths, (new_data, new_proc_data) = resample_trials(
+                [trial_info['trial']['timestamps'] for trial_info in trials],
+                [
+                    [trial_info['trial']['data'] for trial_info in trials],
+                    [trial_info['trial_proc']['data'] if 'trial_proc' in trial_info else None
+                     for trial_info in trials]
+                ],
+                srate
+            )
+
+            for row, trial_info in enumerate(trials):
+                new_xrange = new_times[row, :lengths[row]]
+                trial_info['trial']['data'] = new_data[row, :lengths[row]]
                 trial_info['trial']['timestamps'] = new_xrange
 
                 if 'trial_proc' in trial_info:
-                    trial_info['trial_proc']['data'] = np.interp(
-                        new_xrange,
-                        stimes,
-                        trial_info['trial_proc']['data']
-                    )
+                    trial_info['trial_proc']['data'] = new_proc_data[row, :lengths[row]]
                     trial_info['trial_proc']['timestamps'] = new_xrange
 
             return trigger_data
 
+        # Rejects trials with all of the given criteria in one pass
+        # over the trials of this trigger. The config can contain
+        # 'zeros_to_count' (with 'digit_tolerance'), 'gtval' and 'ltval'.
+        @post
+        def reject_trials(trigger_data, config):
+            criteria = {}
+            for arg in config['config']:
+                criteria.update(arg)
+
+            proc_trial_data = trigger_data['trials']
+            trial_nums = [
+                trial_num for trial_num, trial_info in proc_trial_data.items()
+                if 'trial' in trial_info and len(trial_info['trial']['data']) > 0
+            ]
+            if len(trial_nums) <= 0:
+                return trigger_data
+
+            rejections = get_trial_rejections(
+                [proc_trial_data[trial_num]['trial']['data'] for trial_num in trial_nums],
+                **criteria
+            )
+            for trial_num, reject in zip(trial_nums, rejections):
+                if reject:
+                    proc_trial_data[trial_num]['reject'] = True
+
+            return trigger_data
+
         # This function should only be run after the
         # custom resampling phase.
         @post
         def rm_baseline(trigger_data, config):
-            args = config['config']
-            logger = MultiProcessingLog.get_logger()
-            testing = trigger_data['config']['testing']
             proc_trial_data = trigger_data['trials']
-            new_trial_data = copy.deepcopy(proc_trial_data)
             baseline_range = trigger_data['config']['baseline']
             if not baseline_range:
                 return trigger_data
 
-            for trial_num, trial_info in proc_trial_data.items():
-                if 'baseline_mean' in new_trial_data[trial_num]:
-                    continue
-
-                times = copy.deepcopy(trial_info['trial']['timestamps'])
-                data = copy.deepcopy(trial_info['trial']['data'])
-
-                # Subtract initial
-                times = times - times[0]
-                total_time = times[-1]
-
-                # Check to make sure the baseline range is OK.
-                if baseline_range[0] < times[0]:
-                    raise Exception("Error: Cannot have a negative baseline range start. All trials start at 0. ")
-                if baseline_range[1] > total_time:
-                    raise Exception("Error: Cannot have a baseline range that exceeds the total time of the trial. ")
-
-                # Get the initial point, then the final point, with all points in
-                # between as the baseline mean for each trial.
-
-                bmean = 0
-                pcount = 0
-                found_first = False
-                for time_ind in range(len(times)-1):
-                    # While we have not found the first point, continue looking
-                    if not found_first:
-                        if times[time_ind] <= baseline_range[0] < times[time_ind+1]:
-                            pcount += 1
-                            if baseline_range[0] == times[time_ind]:
-                                bmean += data[time_ind]
-                            else:
-                                bmean += linear_approx(data[time_ind], times[time_ind],
-                                                       data[time_ind+1], times[time_ind+1],
-                                                       baseline_range[0])
-                            found_first = True
-                        continue
-
-                    # Check if we have the final point area, if we do, get it and
-                    # finish looking for points.
-                    if times[time_ind] <= baseline_range[1] < times[time_ind+1]:
-                        pcount += 1
-                        if baseline_range[1] == times[time_ind]:
-                            bmean += data[time_ind]
-                        else:
-                            bmean += linear_approx(data[time_ind], times[time_ind],
-                                                   data[time_ind + 1], times[time_ind + 1],
-                                                   baseline_range[1])
-                        break
-
-                    # We get here when we're in between the first and final points.
-                    pcount += 1
-                    bmean += data[time_ind]
+            trial_nums = [
+                trial_num for trial_num, trial_info in proc_trial_data.items()
+                if 'baseline_mean' not in trial_info
+            ]
+            if len(trial_nums) <= 0:
+                return trigger_data
 
-                # For each trial, calculate the baseline removed data and store the baseline mean.
-                new_trial_data[trial_num]['baseline_mean'] = bmean/pcount
-                new_trial_data[trial_num]['trial_rmbaseline']['data'] = data - new_trial_data[trial_num]['baseline_mean']
+            # Get the baseline means of all trials at once, then store them
+            # along with the baseline removed data for each trial.
+            means, rmbaseline, lengths = remove_baseline(
+                [proc_trial_data[trial_num]['trial']['timestamps'] for trial_num in trial_nums],
+                [proc_trial_data[trial_num]['trial']['data'] for trial_num in trial_nums],
+                baseline_range
+            )
 
-            trigger_data['trials'] = new_trial_data
+            for row, trial_num in enumerate(trial_nums):
+                proc_trial_data[trial_num]['baseline_mean'] = means[row]
+                proc_trial_data[trial_num]['trial_rmbaseline']['data'] = rmbaseline[row, :lengths[row]]
 
             return trigger_data
 
@@ -204,7 +195,6 @@ class TriggerProcessor():
         @post
         def get_percent_change(trigger_data, config):
             proc_trial_data = trigger_data['trials']
-            pcs = {}
 
             if not trigger_data['config']['baseline']:
                 return trigger_data
@@ -217,22 +207,32 @@ class TriggerProcessor():
                         break
                 proc_trial_data = trigger_data['trials']
 
-            for trial_num, trial_info in proc_trial_data.items():
-                bmean = trial_info['baseline_mean']
-                data = copy.deepcopy(trial_info['trial_rmbaseline']['data'])
-
-                if bmean and bmean != 0:
-                    pcs[trial_num] = data / bmean
-                else:
-                    self.logger.send('WARNING', 'Baseline mean is 0 or undefined for a trial for name: ' + trial_info['config']['name'],
-                         os.getpid(), threading.get_ident())
-                    self.logger.send('WARNING', 'Not computing percent change for name: ' + trial_info['config']['name'],
-                         os.getpid(), threading.get_ident())
-                    pcs[trial_num] = data
-                    trigger_data['trials'][trial_num]['reject'] = True
-
-            for trial_num in pcs:
-                trigger_data['trials'][trial_num]['trial_pc']['data'] = pcs[trial_num]
+            trial_nums = list(proc_trial_data.keys())
+            if len(trial_nums) <= 0:
+                return trigger_data
+
+            # Trials with a baseline mean of 0 (or undefined) are rejected
+            # and keep their baseline removed data.
+            bmeans = [proc_trial_data[trial_num]['baseline_mean'] for trial_num in trial_nums]
+            valid = np.array([bool(bmean) and bmean != 0 for bmean in bmeans])
+            bmeans = np.array([bmean if ok else 1 for bmean, ok in zip(bmeans, valid)], dtype=np.float64)
+
+            data, lengths = stack_trials(
+                [proc_trial_data[trial_num]['trial_rmbaseline']['data'] for trial_num in trial_nums]
+            )
+            data[valid] /= bmeans[valid][:, None]
+
+            for row, trial_num in enumerate(trial_nums):
+                proc_trial_data[trial_num]['trial_pc']['data'] = data[row, :lengths[row]]
+                if not valid[row]:
+                    proc_trial_data[trial_num]['reject'] = True
+
+            if not np.all(valid):
+                names = [proc_trial_data[trial_num]['config']['name']
+                         for row, trial_num in enumerate(trial_nums) if not valid[row]]
+                self.logger.send('WARNING', 'Baseline mean is 0 or undefined, not computing percent change for ' +
+                                 str(len(names)) + ' trials with names: ' + ', '.join(names),
+                                 os.getpid(), threading.get_ident())
 
             return trigger_data
 
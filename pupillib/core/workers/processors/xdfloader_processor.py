@@ -18,6 +18,7 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
+import ast
 import os
 import threading
 import numpy as np
@@ -62,16 +63,36 @@ class XdfLoaderProcessor():
             col_num = config['num']
             return np.asarray(primitive_entry['time_series'][:, col_num])
 
+        # Parsed samples of each python representation stream, so that
+        # every sample is only parsed once even when multiple columns
+        # (gaze_x-pyrep and gaze_y-pyrep) are taken from the same stream.
+        # The entry is kept alongside to keep its id from being reused.
+        parsed_pyreps = {}
+
+        def parse_pyrep(pyrep_entry):
+            key = id(pyrep_entry)
+            if key not in parsed_pyreps:
+                parsed_pyreps[key] = (
+                    pyrep_entry,
+                    [ast.literal_eval(el[0]) for el in pyrep_entry['time_series']]
+                )
+            return parsed_pyreps[key][1]
+
         @transform
         def get_pyrep_column(pyrep_entry, config):
             val2get = config['name']
+            samples = parse_pyrep(pyrep_entry)
+
+            vals = np.empty(len(samples))
             if 'num' in config:
                 num2get = config['num']
-                vals = [eval(el[0])[val2get][num2get] for el in pyrep_entry['time_series']]
+                for i, sample in enumerate(samples):
+                    vals[i] = sample[val2get][num2get]
             else:
-                vals = [eval(el[0])[val2get] for el in pyrep_entry['time_series']]
+                for i, sample in enumerate(samples):
+                    vals[i] = sample[val2get]
 
-            return np.asarray(vals)
+            return vals
 
         @transform
         def get_xdf_timestamps(entry, config):
@@ -0,0 +1,212 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import os
+import threading
+from collections import deque
+
+from pupillib.core.utilities.MPLogger import MultiProcessingLog
+
+'''
+    Task graph scheduler used by the 'thread' backend.
+
+    Each unit of work (loading a dataset, pre-processing a dataset or a data
+    stream, extracting the trials of a trigger, processing a chunk of trials,
+    post-processing) is a Task that only runs once all of its dependencies are
+    done. Tasks can add new tasks while they run, and add dependencies to
+    tasks that haven't started yet, so the graph grows as the data is found.
+
+    The tasks are run by a fixed pool of threads. Each thread has its own
+    queue that it takes the newest tasks from, and when it's empty, it steals
+    the oldest tasks from the longest queue of the other threads. This way,
+    a dataset with many trials keeps all threads busy instead of the one it
+    was given.
+'''
+
+
+# Returns the number of threads to run the tasks with.
+#   INPUT:
+#       config - The config, 'max_workers' limits the number of threads.
+#   RETURN:
+#       The number of threads, never more than the number of CPUs.
+def get_num_workers(config):
+    if 'no_parallel' in config and config['no_parallel']:
+        return 1
+    num_cpus = os.cpu_count() or 1
+    max_workers = config['max_workers'] if 'max_workers' in config else None
+    if max_workers is None or max_workers < 1:
+        return num_cpus
+    return min(max_workers, num_cpus)
+
+
+class Task(object):
+    def __init__(self, name, func, *args, dependencies=None):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.dependencies = [task for task in (dependencies or []) if task is not None]
+
+        # Set by the scheduler.
+        self.dependents = []
+        self.remaining = 0
+        self.started = False
+        self.done = False
+        self.result = None
+
+    def run(self):
+        self.result = self.func(*self.args)
+        return self.result
+
+
+class TaskScheduler(object):
+    def __init__(self, num_workers=1):
+        self.num_workers = max(1, num_workers)
+        self.queues = [deque() for _ in range(self.num_workers)]
+        self.condition = threading.Condition()
+        self.local = threading.local()
+        self.logger = MultiProcessingLog.get_logger()
+
+        self.next_queue = 0
+        self.pending = 0
+        self.num_tasks = 0
+        self.num_stolen = 0
+        self.error = None
+
+    '''
+        Adds a task that runs func(*args) once the given tasks are done.
+        Can be called before or during a run.
+    '''
+    def add_task(self, name, func, *args, dependencies=None):
+        task = Task(name, func, *args, dependencies=dependencies)
+        self.submit(task)
+        return task
+
+    '''
+        Adds the given tasks at once, so they can depend on each other
+        (in the order given).
+    '''
+    def submit(self, *tasks):
+        with self.condition:
+            for task in tasks:
+                self.pending += 1
+                self.num_tasks += 1
+                for dependency in task.dependencies:
+                    if not dependency.done:
+                        dependency.dependents.append(task)
+                        task.remaining += 1
+                if task.remaining == 0:
+                    self.push(task)
+
+    '''
+        Adds dependencies to a task that hasn't started yet. It's used by
+        tasks that find more work to wait on, so the task they add dependencies
+        to must depend on them.
+    '''
+    def add_dependencies(self, task, dependencies):
+        with self.condition:
+            if task.started:
+                raise Exception("Error: Can't add dependencies to the task " + task.name +
+                                ", it has already started.")
+            for dependency in dependencies:
+                if dependency is None or dependency.done:
+                    continue
+                dependency.dependents.append(task)
+                task.remaining += 1
+
+    # Queues a task that is ready to run, on the queue of the current
+    # worker thread so that it's data stays close. Must hold the condition.
+    def push(self, task):
+        index = getattr(self.local, 'index', None)
+        if index is None:
+            index = self.next_queue
+            self.next_queue = (self.next_queue + 1) % self.num_workers
+        self.queues[index].append(task)
+        self.condition.notify()
+
+    # Gets the next task for a worker thread, or steals one from
+    # the longest queue. Must hold the condition.
+    def pop(self, index):
+        if self.queues[index]:
+            return self.queues[index].pop()
+
+        longest = max(self.queues, key=len)
+        if longest:
+            self.num_stolen += 1
+            return longest.popleft()
+        return None
+
+    def finish(self, task):
+        with self.condition:
+            task.done = True
+            self.pending -= 1
+            for dependent in task.dependents:
+                dependent.remaining -= 1
+                if dependent.remaining == 0:
+                    self.push(dependent)
+            task.dependents = []
+            if self.pending == 0:
+                self.condition.notify_all()
+
+    def work(self, index):
+        self.local.index = index
+        while True:
+            with self.condition:
+                task = self.pop(index)
+                while task is None and self.pending > 0 and self.error is None:
+                    self.condition.wait()
+                    task = self.pop(index)
+                if task is None or self.error is not None:
+                    return
+                task.started = True
+
+            try:
+                task.run()
+            except Exception as e:
+                with self.condition:
+                    if self.error is None:
+                        self.error = (task, e)
+                    self.condition.notify_all()
+                return
+            self.finish(task)
+
+    '''
+        Runs all tasks, including the ones that are added while running,
+        and returns when they are done. If a task fails, the remaining
+        tasks are dropped and the error is raised here.
+    '''
+    def run(self):
+        threads = [
+            threading.Thread(target=self.work, args=(index,), name='plib-scheduler-' + str(index))
+            for index in range(self.num_workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            task, e = self.error
+            self.logger.send('ERROR', 'Task ' + task.name + ' failed: ' + str(e), os.getpid(),
+                             threading.get_ident())
+            raise e
+
+        self.logger.send('INFO', 'Ran ' + str(self.num_tasks) + ' tasks on ' + str(self.num_workers) +
+                         ' threads, ' + str(self.num_stolen) + ' were stolen.', os.getpid(),
+                         threading.get_ident())
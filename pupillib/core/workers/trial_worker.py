@@ -25,6 +25,8 @@ import threading
 import traceback
 from threading import Thread
 
+import numpy as np
+
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
 from pupillib.core.workers.processors.trial_processor import TrialProcessor
 
@@ -271,74 +273,19 @@ class PLibTrialWorker(Thread):
 
         return proc_trial_chunk, testing_passed
 
-    def run(self):
-        testing = self.config['testing']
-        deep_test = True if self.config['testing_depth'] == 'deep' else False
-
-        # If this trial is in the yaml config, specify it's
-        # configuration by replacing the current one with a new one.
-
-        self.config = utilities.parse_yaml_for_config(self.config, self.getName())
-
-        # Run the pre processors.
-        trial_processor = None
-        if self.config['trial_pre_processing']:
-            trial_processor = TrialProcessor()
-
-            for config in self.config['trial_pre_processing']:
-                if config['name'] in trial_processor.pre_processing.all:
-                    trial_processor.pre_processing.all[config['name']](self.initial_data, config)
-
-        if testing and deep_test:
-            self.logger.send('INFO', 'I am a trial worker. I split the trials from the dataset.',
-                              os.getpid(), threading.get_ident())
-            self.logger.send('INFO', self.getName(),
-                             os.getpid(), threading.get_ident())
-            self.logger.send('INFO', self.getName() + ': ' + 'Srate: ' + str(self.chunk_data['srate']) +
-                             ' Length: ' + str(len(self.chunk_data['timestamps'])), os.getpid(), threading.get_ident())
-
-        # Run the pre-processor functions on the trial
-        # and also set whether or not any were even run.
-        # for i in self.config[]
-
-        # Logic for correctly breaking the data down goes here.
-        # Only run tests in them if 'deep' testing is on.
-        try:
-            # If the given baseline time is given as 0 or less.
-            if self.chunk_data['baseline_time_sec'] <= 0:
-                proc_baseline_chunk, testing_passed = self.get_baseline_start(self.chunk_data, testing=(testing and deep_test),
-                                                                              name=self.getName())
-                if self.chunk_data['trial_time_sec'] >= 0:
-                    proc_trial_chunk, testing_passed = self.get_trialtime_end(self.chunk_data,
-                                                                              testing=(testing and deep_test),
-                                                                              name=self.getName())
-                else:
-                    proc_trial_chunk, testing_passed = self.get_baseline_start(self.chunk_data,
-                                                                               testing=(testing and deep_test),
-                                                                               name=self.getName(), use_trial_time=True)
-            else:
-                proc_baseline_chunk, testing_passed = self.get_trialtime_end(self.chunk_data, testing=(testing and deep_test),
-                                                         name=self.getName(), use_baseline_time=True)
-                proc_trial_chunk, testing_passed = self.get_trialtime_end(self.chunk_data, testing=(testing and deep_test), name=self.getName())
-        except Exception as e:
-            self.logger.send('CRITICAL', 'Exception occurred while we were processing the trial: ' + self.getName() +
-                             '\nThe exception is: \n' + traceback.format_exc(), os.getpid(), threading.get_ident())
-            return None
-
-        if testing and deep_test:
-            self.logger.send('INFO', self.getName() + ':  proc_baseline_chunk: ' + str(proc_baseline_chunk),
-                             os.getpid(), threading.get_ident())
-            self.logger.send('INFO', self.getName() + ':  proc_trial_chunk: ' + str(proc_trial_chunk) + '  : trial',
-                             os.getpid(), threading.get_ident())
-
+    def cut_trial(self, proc_baseline_chunk, proc_trial_chunk, testing=False, testing_passed=True):
+        # Cuts the trial out of the chunk and replaces, or adds, its first and
+        # last points with the ideal ones found by the boundary functions.
         # Final_ind is inclusive, keep it.
         # So, we add one at the end to make sure we get it.
         # This part cuts out the data for any cases, and doesn't depend upon the
         # centering index of the marker.
-        proc_data_chunk = self.chunk_data['data'][
-                                          proc_baseline_chunk['final_ind']:proc_trial_chunk['final_ind'] + 1]
-        proc_time_chunk = self.chunk_data['timestamps'][
-                                          proc_baseline_chunk['final_ind']:proc_trial_chunk['final_ind'] + 1]
+        # The chunk given by the trigger worker is a view of the whole
+        # stream, this is the only copy that is made for the trial.
+        proc_data_chunk = np.array(self.chunk_data['data'][
+                                   proc_baseline_chunk['final_ind']:proc_trial_chunk['final_ind'] + 1], dtype=float)
+        proc_time_chunk = np.array(self.chunk_data['timestamps'][
+                                   proc_baseline_chunk['final_ind']:proc_trial_chunk['final_ind'] + 1], dtype=float)
 
         actual_data_chunk = {
             'timestamps': proc_time_chunk,
@@ -424,19 +371,16 @@ class PLibTrialWorker(Thread):
                                  '  Chunk Length: data - ' + str(len(actual_data_chunk['data'])) + '  timestamps- ' +
                                  str(len(actual_data_chunk['timestamps'])),
                                  os.getpid(), threading.get_ident())
-        if testing:
-            if testing_passed:
-                self.logger.send('INFO', self.getName() + ':  TEST-PASS  Testing passed!',
-                                 os.getpid(), threading.get_ident())
-            else:
-                self.logger.send('CRITICAL', self.getName() + ': TEST-FAIL Testing failed, oh no! This can`t be!',
-                                 os.getpid(), threading.get_ident())
 
         # Replace with the final or append the ideal final linearly
         # interpolated data point.
         if self.chunk_data['baseline_time_sec'] > 0:
-            actual_data_chunk['timestamps'] = [proc_baseline_chunk['ideal_timestamp']] + actual_data_chunk['timestamps']
-            actual_data_chunk['data'] = [proc_baseline_chunk['ideal_data']] + actual_data_chunk['data']
+            actual_data_chunk['timestamps'] = np.concatenate(
+                ([proc_baseline_chunk['ideal_timestamp']], actual_data_chunk['timestamps'])
+            )
+            actual_data_chunk['data'] = np.concatenate(
+                ([proc_baseline_chunk['ideal_data']], actual_data_chunk['data'])
+            )
             proc_baseline_chunk['baseline_time_points'] += 1
         else:
             actual_data_chunk['timestamps'][0] = proc_baseline_chunk['ideal_timestamp']
@@ -465,8 +409,12 @@ class PLibTrialWorker(Thread):
         # Replace with the final or append the ideal final linearly
         # interpolated data point.
         if self.chunk_data['trial_time_sec'] < 0:
-            actual_data_chunk['timestamps'] += [proc_trial_chunk['ideal_timestamp']]
-            actual_data_chunk['data'] += [proc_trial_chunk['ideal_data']]
+            actual_data_chunk['timestamps'] = np.concatenate(
+                (actual_data_chunk['timestamps'], [proc_trial_chunk['ideal_timestamp']])
+            )
+            actual_data_chunk['data'] = np.concatenate(
+                (actual_data_chunk['data'], [proc_trial_chunk['ideal_data']])
+            )
             proc_trial_chunk['trial_time_points'] += 1
         else:
             actual_data_chunk['timestamps'][-1] = proc_trial_chunk['ideal_timestamp']
@@ -493,6 +441,119 @@ class PLibTrialWorker(Thread):
                                      ' expected: ' +
                                      str(self.chunk_data['actual_marker_time']), os.getpid(), threading.get_ident)
 
+        return actual_data_chunk, testing_passed
+
+    def check_epoch(self, epoch, proc_baseline_chunk, proc_trial_chunk, actual_data_chunk):
+        # Checks that the trial cut by the trigger worker, with all the other
+        # trials, is the same as the one that was cut here.
+        testing_passed = True
+        for name, batch_chunk, trial_chunk in (('baseline', epoch['proc_baseline_chunk'], proc_baseline_chunk),
+                                               ('trial', epoch['proc_trial_chunk'], proc_trial_chunk)):
+            if batch_chunk != trial_chunk:
+                self.logger.send('CRITICAL', self.getName() + ': batched ' + name + ' boundary is wrong: ' +
+                                 str(batch_chunk) + ' expected: ' + str(trial_chunk),
+                                 os.getpid(), threading.get_ident())
+                testing_passed = False
+
+        for field in ('timestamps', 'data'):
+            if not np.array_equal(epoch[field], actual_data_chunk[field]):
+                self.logger.send('CRITICAL', self.getName() + ': batched trial ' + field + ' are wrong.',
+                                 os.getpid(), threading.get_ident())
+                testing_passed = False
+
+        if testing_passed:
+            self.logger.send('INFO', self.getName() + ': batched trial is good.',
+                             os.getpid(), threading.get_ident())
+        return testing_passed
+
+    def run(self):
+        testing = self.config['testing']
+        deep_test = True if self.config['testing_depth'] == 'deep' else False
+
+        # If this trial is in the yaml config, specify it's
+        # configuration by replacing the current one with a new one.
+
+        self.config = utilities.parse_yaml_for_config(self.config, self.getName())
+
+        # Run the pre processors.
+        trial_processor = None
+        if self.config['trial_pre_processing']:
+            trial_processor = TrialProcessor()
+
+            for config in self.config['trial_pre_processing']:
+                if config['name'] in trial_processor.pre_processing.all:
+                    trial_processor.pre_processing.all[config['name']](self.initial_data, config)
+
+        if testing and deep_test:
+            self.logger.send('INFO', 'I am a trial worker. I split the trials from the dataset.',
+                              os.getpid(), threading.get_ident())
+            self.logger.send('INFO', self.getName(),
+                             os.getpid(), threading.get_ident())
+            self.logger.send('INFO', self.getName() + ': ' + 'Srate: ' + str(self.chunk_data['srate']) +
+                             ' Length: ' + str(len(self.chunk_data['timestamps'])), os.getpid(), threading.get_ident())
+
+        # Run the pre-processor functions on the trial
+        # and also set whether or not any were even run.
+        # for i in self.config[]
+
+        # Logic for correctly breaking the data down goes here.
+        # Only run tests in them if 'deep' testing is on.
+        epoch = self.chunk_data['epoch'] if 'epoch' in self.chunk_data else None
+        try:
+            if epoch is not None and not (testing and deep_test):
+                # Boundaries were found for all trials at once by the trigger worker.
+                # With deep testing, they are found again below and checked.
+                proc_baseline_chunk = self.chunk_data['epoch']['proc_baseline_chunk']
+                proc_trial_chunk = self.chunk_data['epoch']['proc_trial_chunk']
+                testing_passed = True
+            # If the given baseline time is given as 0 or less.
+            elif self.chunk_data['baseline_time_sec'] <= 0:
+                proc_baseline_chunk, testing_passed = self.get_baseline_start(self.chunk_data, testing=(testing and deep_test),
+                                                                              name=self.getName())
+                if self.chunk_data['trial_time_sec'] >= 0:
+                    proc_trial_chunk, testing_passed = self.get_trialtime_end(self.chunk_data,
+                                                                              testing=(testing and deep_test),
+                                                                              name=self.getName())
+                else:
+                    proc_trial_chunk, testing_passed = self.get_baseline_start(self.chunk_data,
+                                                                               testing=(testing and deep_test),
+                                                                               name=self.getName(), use_trial_time=True)
+            else:
+                proc_baseline_chunk, testing_passed = self.get_trialtime_end(self.chunk_data, testing=(testing and deep_test),
+                                                         name=self.getName(), use_baseline_time=True)
+                proc_trial_chunk, testing_passed = self.get_trialtime_end(self.chunk_data, testing=(testing and deep_test), name=self.getName())
+        except Exception as e:
+            self.logger.send('CRITICAL', 'Exception occurred while we were processing the trial: ' + self.getName() +
+                             '\nThe exception is: \n' + traceback.format_exc(), os.getpid(), threading.get_ident())
+            return None
+
+        if testing and deep_test:
+            self.logger.send('INFO', self.getName() + ':  proc_baseline_chunk: ' + str(proc_baseline_chunk),
+                             os.getpid(), threading.get_ident())
+            self.logger.send('INFO', self.getName() + ':  proc_trial_chunk: ' + str(proc_trial_chunk) + '  : trial',
+                             os.getpid(), threading.get_ident())
+
+        if epoch is None or (testing and deep_test):
+            actual_data_chunk, testing_passed = self.cut_trial(proc_baseline_chunk, proc_trial_chunk,
+                                                               testing=testing, testing_passed=testing_passed)
+            if epoch is not None:
+                testing_passed = self.check_epoch(epoch, proc_baseline_chunk, proc_trial_chunk,
+                                                  actual_data_chunk) and testing_passed
+        else:
+            # The trigger worker already cut this trial with the other ones.
+            actual_data_chunk = {
+                'timestamps': epoch['timestamps'],
+                'data': epoch['data']
+            }
+
+        if testing:
+            if testing_passed:
+                self.logger.send('INFO', self.getName() + ':  TEST-PASS  Testing passed!',
+                                 os.getpid(), threading.get_ident())
+            else:
+                self.logger.send('CRITICAL', self.getName() + ': TEST-FAIL Testing failed, oh no! This can`t be!',
+                                 os.getpid(), threading.get_ident())
+
         # Create the final data structure.
         self.proc_trial_data = {
             'config': {
@@ -502,7 +563,7 @@ class PLibTrialWorker(Thread):
                 # Store some portions of the chunk data that was
                 # given by the parent trigger worker.
                 'partial_chunk_data': {i: self.chunk_data[i] for i in self.chunk_data
-                                       if i != 'data' and i != 'timestamps'},
+                                       if i != 'data' and i != 'timestamps' and i != 'epoch'},
 
                 'name': copy.deepcopy(self.getName()),
                 'contains_marker': True if self.chunk_data['baseline_time_sec'] <= 0 <=
@@ -510,7 +571,7 @@ class PLibTrialWorker(Thread):
                                         else False
             },
 
-            'trial': copy.deepcopy(actual_data_chunk),
+            'trial': actual_data_chunk,
             'trial_rmbaseline': {'data': [], 'timestamps': []},
             'trial_pc': {'data': [], 'timestamps': []},
             'srate': self.chunk_data['srate'],
@@ -18,29 +18,44 @@ along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
 Copyright (C) 2018  Gregory W. Mierzwinski
 ---------------------------------------------------------------------------~(*)
 '''
-import copy
 import math
 import os
 import threading
 from threading import Thread
 
+import numpy as np
+
+from pupillib.core.plib_parser import update_worker_count_with_trials
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
+from pupillib.core.utilities.config_store import ConfigView
 from pupillib.core.workers.processors.trigger_processor import *
+from pupillib.core.workers.scheduler import Task
 from pupillib.core.workers.trial_worker import PLibTrialWorker
 
+import pupillib.core.utilities.epoching as epoching
 import pupillib.core.utilities.utilities as utilities
 
 
+# Number of trial chunks that are made for each thread of the scheduler.
+TRIAL_CHUNKS_PER_WORKER = 4
+
+
 class PLibTriggerWorker(Thread):
-    def __init__(self, config, eye_dataset=None, marker_inds=None, marker_times=None, marker_name=''):
+    def __init__(self, config, eye_dataset=None, marker_inds=None, marker_times=None, marker_name='',
+                 marker_positions=None):
         Thread.__init__(self)
-        self.config = copy.deepcopy(config)    # Metadata about how to process the given datasets.
+        self.config = ConfigView(config)    # Metadata about how to process the given datasets.
         self.eye_dataset = eye_dataset
-        self.data = self.eye_dataset['data']
-        self.timestamps = self.eye_dataset['timestamps']
+        # Trials are cut as views of these arrays, so they
+        # are only converted once per trigger.
+        self.data = np.asarray(self.eye_dataset['data'])
+        self.timestamps = np.asarray(self.eye_dataset['timestamps'])
         self.marker_inds = marker_inds
         self.marker_times = marker_times
         self.marker_name = marker_name
+        # Positions of the markers in the timestamps, when they were
+        # found once for the whole dataset.
+        self.marker_positions = marker_positions
 
         self.initial_data = {
             'config': config,    # Metadata about how to process the given datasets.
@@ -54,6 +69,11 @@ class PLibTriggerWorker(Thread):
         # To be initialized
         self.proc_trigger_data = {}
         self.proc_trial_data = {}
+        self.marker_data = None
+
+        # Used when the trials are run as tasks of a scheduler.
+        self.trial_tasks = []
+        self.finish_task = None
 
         self.logger = MultiProcessingLog.get_logger()
 
@@ -67,10 +87,84 @@ class PLibTriggerWorker(Thread):
             'marker_name': self.marker_name
         }
 
+    # Runs a list of (trial_num, name, chunk_data) trials with a single
+    # trial worker and returns their results in the same order.
+    def run_trial_chunk(self, trials):
+        trial_worker = PLibTrialWorker(self.config)
+        results = []
+        for _, name, data_chunk in trials:
+            # Reset the config, it's replaced with the trial's own one.
+            trial_worker.config = self.config
+            trial_worker.setName(name)
+            trial_worker.chunk_data = data_chunk
+            trial_worker.reset_initial_data()
+            trial_worker.run()
+            # Each run builds a new result, it's safe to keep it as is.
+            results.append(trial_worker.proc_trial_data)
+        return results
+
+    # Splits the trials into chunks to be processed by the given
+    # number of threads, or by the number of workers planned for
+    # this trigger when there are less. A few chunks per worker keep
+    # them busy when some trials take longer than others.
+    def get_trial_chunks(self, trials, num_workers):
+        if num_workers <= 1:
+            return [trials]
+        self.config = update_worker_count_with_trials(self.config, len(trials), self.getName())
+        num_workers = max(1, min(self.config['trial_workers'], num_workers, len(trials)))
+        chunk_size = max(1, int(math.ceil(len(trials) / (num_workers * TRIAL_CHUNKS_PER_WORKER))))
+        return [trials[start:start + chunk_size] for start in range(0, len(trials), chunk_size)]
+
+    # Stores the results of the trials in trial order.
+    def set_trial_results(self, trials, results):
+        for (trial_num, _, _), result in zip(trials, results):
+            self.proc_trial_data[trial_num] = result
+
+    def run_trials(self, trials):
+        self.set_trial_results(trials, self.run_trial_chunk(trials))
+
+    '''
+        Adds the tasks of this trigger to the scheduler: one that finds the
+        trials, one for each chunk of trials, and one that post-processes them.
+        Returns the last one.
+    '''
+    def add_tasks(self, scheduler, dependencies=None):
+        prepare_task = Task(self.getName() + ':pre', self.add_trial_tasks, scheduler, dependencies=dependencies)
+        self.finish_task = Task(self.getName() + ':post', self.finish_trial_tasks, dependencies=[prepare_task])
+        scheduler.submit(prepare_task, self.finish_task)
+        return self.finish_task
+
+    def add_trial_tasks(self, scheduler):
+        self.proc_trial_data = {}
+        self.proc_trigger_data = {}
+        trials = self.prepare_trials()
+        self.trial_tasks = []
+        if trials:
+            self.trial_tasks = [
+                (chunk, scheduler.add_task(chunk[0][1] + '-' + chunk[-1][0], self.run_trial_chunk, chunk))
+                for chunk in self.get_trial_chunks(trials, scheduler.num_workers)
+            ]
+            scheduler.add_dependencies(self.finish_task, [task for _, task in self.trial_tasks])
+
+    def finish_trial_tasks(self):
+        for chunk, task in self.trial_tasks:
+            self.set_trial_results(chunk, task.result)
+        self.trial_tasks = []
+        self.finish_trigger()
+
     def run(self):
         self.proc_trial_data = {}
         self.proc_trigger_data = {}
 
+        trials = self.prepare_trials()
+        if trials:
+            self.run_trials(trials)
+        self.finish_trigger()
+
+    # Finds the trials of this trigger and cuts out their chunks.
+    #   RETURN:
+    #       trials - A list of (trial_num, name, chunk_data) for each trial.
+    def prepare_trials(self):
         if self.config['testing']:
             self.logger.send('INFO', 'I am a trigger work. I split the triggers indices into trial workers.', os.getpid(), threading.get_ident())
 
@@ -87,120 +181,94 @@ class PLibTriggerWorker(Thread):
                 if config['name'] in trigger_processor.pre_processing.all:
                     self.initial_data = trigger_processor.pre_processing.all[config['name']](self.initial_data, config)
 
-        # For each trial in a given trigger, start a new thread to retrieve it.
-        # Do a deep copy here so that we don't have to deal with access conflicts.
-        num_marks = 0
-        prev_timestamp = self.timestamps[0]
-        data_indices = []
-        data_times = []
-        data_errors = []
-        data_curr_prev = [] # 0 for taking curr, 1 for taking prev
+        # Find the data points closest to each marker.
+        data_indices, data_times, data_errors, data_curr_prev = utilities.align_markers(
+            self.timestamps, self.marker_times, positions=self.marker_positions
+        )
+        num_marks = len(data_indices)
+
         srate = self.config['srate']
         [baseline, trial_time] = self.config['trial_range']
-        base_trial_worker = PLibTrialWorker(self.config)
-        trial_workers = {}
-        parallel = False
+        trial_chunks = []
         found_marker_trials = False
 
-        for index in range(1, len(self.timestamps)):
-            # Stop once we've found all of the markers in the data
-            if num_marks >= len(self.marker_times):
-                break
+        trial_windows = []
+        for mark_num, chosen_ind in enumerate(data_indices):
+            # Copy a chunk out. Twice the size, just to be safe.
+            # srate: (data points)/second
+            # TODO:
+            # But first, check to see if this trial number needs a different baseline and trial_time
+            # to be cut.
+            trial_name = self.getName() + ':trial' + str(mark_num+1)
+            baseline_trial = baseline
+            trial_time_trial = trial_time
+
+            if 'parsed_yaml' in self.config:
+                if trial_name in self.config['parsed_yaml']:
+                    trial_conf = self.config['parsed_yaml'][trial_name]
+                    if 'baseline_time' in trial_conf:
+                        baseline_trial = trial_conf['baseline_time']
+                    if 'trial_time' in trial_conf:
+                        trial_time_trial = trial_conf['trial_time']
+
+            baseline_points = int(math.ceil(srate * abs(baseline_trial) * 2))
+            trial_points = int(math.ceil(srate * abs(trial_time_trial) * 2))
+
+            # Cut out data
+            size_increase = 5
+            baseline_start_point = chosen_ind - size_increase*baseline_points
+            marker_ind = size_increase * baseline_points
+            if baseline_start_point < 0:
+                marker_ind = chosen_ind
+                baseline_start_point = 0
+            chunk_end = chosen_ind + size_increase*trial_points + 1
+            trial_windows.append((baseline_trial, trial_time_trial, baseline_start_point, marker_ind, chunk_end))
+
+        # Find the boundaries of all trials at once, the trials that can't
+        # be cut this way are cut by the trial worker itself.
+        epochs = None
+        if trial_windows and not self.config['only_markers_in_streams']:
+            baselines, trial_times, lower, _, upper = zip(*trial_windows)
+            epochs = epoching.extract_epochs(
+                self.timestamps, self.data, data_indices, self.marker_times[:num_marks],
+                data_errors, baselines, trial_times, srate, lower=lower, upper=upper
+            )
 
-            # For each timestamp
-            curr_timestamp = self.timestamps[index]
-
-            # If we found a spot for a marker
-            if prev_timestamp < self.marker_times[num_marks] < curr_timestamp:
-                chosen_ind = 0
-                if curr_timestamp - self.marker_times[num_marks] > self.marker_times[num_marks] - prev_timestamp:
-                    # The current index has a lower error so it should be used.
-                    chosen_ind = index-1
-                    data_indices.append(index-1)
-                    data_times.append(prev_timestamp)
-                    data_errors.append(self.marker_times[num_marks] - prev_timestamp)
-                    data_curr_prev.append(1)
-                elif curr_timestamp - self.marker_times[num_marks] <= self.marker_times[num_marks] - prev_timestamp:
-                    # They are equal, pick the current over prev for parity
-                    # with Matlab implementation. Or it is a smaller error.
-                    chosen_ind = index
-                    data_indices.append(index)
-                    data_times.append(curr_timestamp)
-                    data_errors.append(curr_timestamp - self.marker_times[num_marks])
-                    data_curr_prev.append(0)
-
-                # Copy a chunk out. Twice the size, just to be safe.
-                # srate: (data points)/second
-                # TODO:
-                # But first, check to see if this trial number needs a different baseline and trial_time
-                # to be cut.
-                trial_name = self.getName() + ':trial' + str(num_marks+1)
-                baseline_trial = baseline
-                trial_time_trial = trial_time
-
-                if 'parsed_yaml' in self.config:
-                    if trial_name in self.config['parsed_yaml']:
-                        trial_conf = self.config['parsed_yaml'][trial_name]
-                        if 'baseline_time' in trial_conf:
-                            baseline_trial = trial_conf['baseline_time']
-                        if 'trial_time' in trial_conf:
-                            trial_time_trial = trial_conf['trial_time']
-
-                baseline_points = int(math.ceil(srate * abs(baseline_trial) * 2))
-                trial_points = int(math.ceil(srate * abs(trial_time_trial) * 2))
-
-                # Cut out data
-                size_increase = 5
-                baseline_start_point = chosen_ind - size_increase*baseline_points
-                marker_ind = size_increase * baseline_points
-                if baseline_start_point < 0:
-                    marker_ind = chosen_ind
-                    baseline_start_point = 0
-                data_chunk = {
-                    'data': copy.deepcopy(
-                             self.eye_dataset['data']
-                             [baseline_start_point:chosen_ind + size_increase*trial_points + 1]
-                    ),
-                    'timestamps': copy.deepcopy(
-                             self.eye_dataset['timestamps']
-                             [baseline_start_point:chosen_ind + size_increase*trial_points + 1]
-                    ),
-                    'srate': srate,
-                    'marker_ind': marker_ind,
-                    'actual_marker_ind': chosen_ind,
-                    'actual_marker_time': self.eye_dataset['timestamps'][chosen_ind],
-                    'marker_time': self.marker_times[num_marks],
-                    'error': data_errors[num_marks],
-                    'curr_prev': data_curr_prev[num_marks],
-                    'baseline_time_sec': baseline_trial,
-                    'trial_time_sec': trial_time_trial
+        for mark_num, chosen_ind in enumerate(data_indices):
+            baseline_trial, trial_time_trial, baseline_start_point, marker_ind, chunk_end = trial_windows[mark_num]
+
+            # The chunk holds views of the stream, the trial worker
+            # copies out only the final epoch.
+            data_chunk = {
+                'data': self.data[baseline_start_point:chunk_end],
+                'timestamps': self.timestamps[baseline_start_point:chunk_end],
+                'srate': srate,
+                'marker_ind': marker_ind,
+                'actual_marker_ind': chosen_ind,
+                'actual_marker_time': self.timestamps[chosen_ind],
+                'marker_time': self.marker_times[mark_num],
+                'error': data_errors[mark_num],
+                'curr_prev': data_curr_prev[mark_num],
+                'baseline_time_sec': baseline_trial,
+                'trial_time_sec': trial_time_trial
+            }
+
+            if epochs is not None and epochs['valid'][mark_num]:
+                proc_baseline_chunk, proc_trial_chunk = epoching.epoch_chunks(
+                    epochs, mark_num, float(data_chunk['actual_marker_time']), offset=baseline_start_point
+                )
+                length = epochs['lengths'][mark_num]
+                data_chunk['epoch'] = {
+                    'data': epochs['data'][mark_num, :length],
+                    'timestamps': epochs['timestamps'][mark_num, :length],
+                    'proc_baseline_chunk': proc_baseline_chunk,
+                    'proc_trial_chunk': proc_trial_chunk
                 }
 
-                found_marker_trials = True
-
-                if not self.config['only_markers_in_streams']:
-                    # Process the trial, either in parallel or sequentially.
-                    if False:
-                        # If we have no limit, run all in parallel.
-                        parallel = True
-                        trial_worker = PLibTrialWorker(copy.deepcopy(self.config), copy.deepcopy(data_chunk))
-                        trial_workers[str(index)] = trial_worker
-                        trial_worker.setName(self.getName() + ':trial' + str(num_marks+1))
-                        trial_worker.trial_num = str(num_marks+1)
-                        trial_worker.start()
-                    else:
-                        # Otherwise, they need to be split.
-                        # For now, just run them sequentially.
-                        base_trial_worker.setName(self.getName() + ':trial' + str(num_marks + 1))
-                        base_trial_worker.chunk_data = data_chunk
-                        base_trial_worker.reset_initial_data()
-                        base_trial_worker.run()
-                        self.proc_trial_data[str(num_marks+1)] = copy.deepcopy(base_trial_worker.proc_trial_data)
-
-                # Look for the next marker
-                num_marks += 1
-
-            prev_timestamp = curr_timestamp
+            found_marker_trials = True
+
+            if not self.config['only_markers_in_streams']:
+                trial_chunks.append((str(mark_num + 1), self.getName() + ':trial' + str(mark_num + 1), data_chunk))
 
         if num_marks < len(self.marker_times):
             self.logger.send(
@@ -210,13 +278,13 @@ class PLibTriggerWorker(Thread):
                 str(len(self.marker_times) - num_marks)
             )
 
-        if not self.config['only_markers_in_streams']:
-            if parallel:
-                for i in trial_workers:
-                    trial_workers[i].join()
-                for i in trial_workers:
-                    if trial_workers[i].proc_trial_data['trial']:
-                        self.proc_trial_data[trial_workers[i].trial_num] = trial_workers[i].proc_trial_data
+        self.marker_data = (data_indices, data_times, data_errors, data_curr_prev)
+        return trial_chunks
+
+    # Gathers the processed trials and runs the post processors.
+    def finish_trigger(self):
+        data_indices, data_times, data_errors, data_curr_prev = self.marker_data
+        trigger_processor = None
 
         self.proc_trial_data = {name: data for name, data in self.proc_trial_data.items() if data}
 
@@ -248,8 +316,11 @@ class PLibTriggerWorker(Thread):
 
         # Always run the custom_resample algorithm and make sure it runs first -
         # data is not too usefull otherwise.
+        # The config is shared with the other workers, so the list
+        # is rebuilt rather than changed in place.
+        post_processing = list(self.config['trigger_post_processing'])
         indrm = 0
-        for i, entry in enumerate(self.config['trigger_post_processing']):
+        for i, entry in enumerate(post_processing):
             if entry['name'] == 'custome_resample' and i == 0:
                 break
             if entry['name'] == 'None':
@@ -259,17 +330,17 @@ class PLibTriggerWorker(Thread):
                 indrm = i
                 break
         if indrm:
-            self.config['trigger_post_processing'].pop(indrm)
+            post_processing.pop(indrm)
 
-        self.config['trigger_post_processing'].insert(
+        post_processing.insert(
             0, {'name': 'custom_resample', 'config': [{'srate': 256}]}
         )
 
-        if self.config['trigger_post_processing']:
+        if post_processing:
             if not trigger_processor:
                 trigger_processor = TriggerProcessor()
 
-            for config in self.config['trigger_post_processing']:
+            for config in post_processing:
                 if config['name'] in trigger_processor.post_processing.all:
                     self.proc_trigger_data = trigger_processor.post_processing.all[config['name']](
                         self.proc_trigger_data,
@@ -4,15 +4,24 @@ This function is closely following the load_xdf reference implementation.
 
 """
 
+import io
+import json
+import mmap
 import os
 import struct
 import itertools
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, the streams are always decoded in this process.
+    shared_memory = None
 import xml.etree.ElementTree as ET
 from collections import OrderedDict, defaultdict
 
 import numpy as np
 
-__all__ = ['load_xdf']
+__all__ = ['load_xdf', 'iter_xdf']
 __version__ = '1.14.0'
 
 
@@ -28,7 +37,11 @@ def load_xdf(filename,
              clock_reset_threshold_stds=5,
              clock_reset_threshold_offset_seconds=1,
              clock_reset_threshold_offset_stds=10,
-             winsor_threshold=0.0001):
+             winsor_threshold=0.0001,
+             select_streams=None,
+             use_mmap=False,
+             cache_index=False,
+             max_workers=1):
     """Import an XDF file.
 
     This is an importer for multi-stream XDF (Extensible Data Format) 
@@ -65,6 +78,28 @@ def load_xdf(filename,
            modified) data, 2) the (optionally modified) time stamps, and 3)
            the (optionally modified) header (default: []).
 
+        select_streams : Only decode and return the streams that are selected
+          by this. Either a list of stream names, or a function that is given
+          the ['info'] dict of each stream and returns whether the stream
+          should be loaded. Implies use_mmap. (default: None, all streams)
+
+        use_mmap : Whether to memory-map the file, index its chunks in a
+          first pass, and only then decode the samples of the selected
+          streams straight from the mapped file. The on_chunk function is
+          then called with all chunks of one stream before the chunks of
+          the next stream. (default: false)
+
+        cache_index : Whether to store the chunk index of the file next to it
+          (as <filename>.index.json) and to reuse it on later loads for as
+          long as the size and modification time of the file are unchanged.
+          Implies use_mmap. (default: false)
+
+        max_workers : Number of processes that decode the streams of the file
+          in parallel, one stream per process. The decoded numeric samples
+          are passed back through shared memory, which needs Python 3.8;
+          older versions decode in this process. Implies use_mmap.
+          (default: 1, decode in this process)
+
         Parameters for advanced failure recovery in clock synchronization:
 
         handle_clock_resets : Whether the importer should check for potential
@@ -164,50 +199,188 @@ def load_xdf(filename,
 
     """
 
-    class StreamData:
-        """Temporary per-stream data."""
-        def __init__(self, xml):
-            """Init a new StreamData object from a stream header."""
-            fmt2char = {'int8': 'b', 'int16': 'h', 'int32': 'i', 'int64': 'q',
-                        'float32': 'f', 'double64': 'd'}
-            fmt2nbytes = {'int8': 1, 'int16': 2, 'int32': 4, 'int64': 8,
-                          'float32': 4, 'double64': 8}
-            # number of channels
-            self.nchns = int(xml['info']['channel_count'][0])
-            # nominal sampling rate in Hz
-            self.srate = int(xml['info']['nominal_srate'][0])
-            # format string (int8, int16, int32, float32, double64, string)
-            self.fmt = xml['info']['channel_format'][0]
-            # list of time-stamp chunks (each an ndarray, in seconds)
-            self.time_stamps = []
-            # list of time-series chunks (each an ndarray or list of lists)
-            self.time_series = []
-            # list of clock offset measurement times (in seconds)
-            self.clock_times = []
-            # list of clock offset measurement values (in seconds)
-            self.clock_values = []
-            # last observed time stamp, for delta decompression
-            self.last_timestamp = 0.0
-            # nominal sampling interval, in seconds, for delta decompression
-            self.tdiff = 1.0/self.srate if self.srate > 0 else 0.0
-            # pre-calc some parsing parameters for efficiency
-            if self.fmt != 'string':
-                # number of bytes to read from stream to handle one sample
-                self.samplebytes = self.nchns * fmt2nbytes[self.fmt]
-                # format string to pass to struct.unpack() to handle one sample
-                self.structfmt = '<%s%s' % (self.nchns, fmt2char[self.fmt])
-
     if verbose:
         print('Importing XDF file %s...' % filename)
     if not os.path.exists(filename):
         raise Exception('file %s does not exist.' % filename)
 
+    if use_mmap or cache_index or max_workers > 1 or \
+            select_streams is not None:
+        streams, temp, fileheader = _read_xdf_indexed(filename, select_streams,
+                                                      on_chunk, verbose,
+                                                      cache_index, max_workers)
+    else:
+        streams, temp, fileheader = _read_xdf(filename, on_chunk, verbose)
+
+    # Concatenate the signal across chunks
+    for stream in temp.values():
+        if stream.time_stamps:
+            # stream with non-empty list of chunks
+            stream.time_stamps = np.concatenate(stream.time_stamps)
+            if stream.fmt == 'string':
+                stream.time_series = list(itertools.chain(*stream.time_series))
+            else:
+                stream.time_series = np.concatenate(stream.time_series)
+        else:
+            # stream without any chunks
+            stream.time_stamps = np.zeros((0,))
+            if stream.fmt == 'string':
+                stream.time_series = []
+            else:
+                stream.time_series = np.zeros((stream.nchns, 0))
+
+    # perform (fault-tolerant) clock synchronization if requested
+    if synchronize_clocks:
+        if verbose:
+            print('  performing clock synchronization...')
+        temp = _clock_sync(temp, handle_clock_resets,
+                           clock_reset_threshold_stds,
+                           clock_reset_threshold_seconds,
+                           clock_reset_threshold_offset_stds,
+                           clock_reset_threshold_offset_seconds,
+                           winsor_threshold)
+    
+    # perform jitter removal if requested
+    if dejitter_timestamps:
+        if verbose:
+            print('  performing jitter removal...')
+        temp = _jitter_removal(temp, jitter_break_threshold_seconds,
+                               jitter_break_threshold_samples,)
+    else:
+        for stream in temp.values():
+            duration = stream.time_stamps[-1] - stream.time_stamps[0]
+            stream.effective_srate = len(stream.time_stamps)/duration
+
+    for k in streams.keys():
+        stream = streams[k]
+        tmp = temp[k]
+        stream['info']['effective_srate'] = tmp.effective_srate
+        stream['time_series'] = tmp.time_series
+        stream['time_stamps'] = tmp.time_stamps
+
+    streams = [s for s in streams.values()]
+    return streams, fileheader
+
+
+class StreamData:
+    """Temporary per-stream data."""
+    def __init__(self, xml):
+        """Init a new StreamData object from a stream header."""
+        fmt2char = {'int8': 'b', 'int16': 'h', 'int32': 'i', 'int64': 'q',
+                    'float32': 'f', 'double64': 'd'}
+        fmt2nbytes = {'int8': 1, 'int16': 2, 'int32': 4, 'int64': 8,
+                      'float32': 4, 'double64': 8}
+        # number of channels
+        self.nchns = int(xml['info']['channel_count'][0])
+        # nominal sampling rate in Hz
+        self.srate = int(xml['info']['nominal_srate'][0])
+        # format string (int8, int16, int32, float32, double64, string)
+        self.fmt = xml['info']['channel_format'][0]
+        # list of time-stamp chunks (each an ndarray, in seconds)
+        self.time_stamps = []
+        # list of time-series chunks (each an ndarray or list of lists)
+        self.time_series = []
+        # list of clock offset measurement times (in seconds)
+        self.clock_times = []
+        # list of clock offset measurement values (in seconds)
+        self.clock_values = []
+        # last observed time stamp, for delta decompression
+        self.last_timestamp = 0.0
+        # nominal sampling interval, in seconds, for delta decompression
+        self.tdiff = 1.0/self.srate if self.srate > 0 else 0.0
+        # pre-calc some parsing parameters for efficiency
+        if self.fmt != 'string':
+            # number of bytes to read from stream to handle one sample
+            self.samplebytes = self.nchns * fmt2nbytes[self.fmt]
+            # format string to pass to struct.unpack() to handle one sample
+            self.structfmt = '<%s%s' % (self.nchns, fmt2char[self.fmt])
+            # numpy dtype of one value, for decoding whole chunks at once
+            self.dtype = np.dtype('<' + fmt2char[self.fmt])
+
+
+def iter_xdf(filename, select_streams=None, verbose=False):
+    """Iterate over the samples of an XDF file, one chunk at a time.
+
+    Unlike load_xdf, this never holds more than one chunk of the file in
+    memory, so it can be used on recordings that don't fit in memory. The
+    time stamps are yielded as they were recorded, i.e. without clock
+    synchronization or jitter removal.
+
+    Args:
+        filename : name of the file to import (*.xdf)
+
+        select_streams : Only yield samples of the streams that are selected
+          by this. Either a list of stream names, or a function that is given
+          the ['info'] dict of each stream and returns whether the stream
+          should be read. (default: None, all streams)
+
+        verbose : Whether to print verbose diagnostics. (default: false)
+
+    Yields:
+        (stream, time_series, time_stamps) for each [Samples] chunk, in the
+        order of the file. stream is the header dict of the stream the chunk
+        belongs to (the same dict for every chunk of a stream), time_series
+        the [#samples x #channels] values of the chunk (a list of lists for
+        string streams), and time_stamps the time stamps of the samples.
+    """
+    if not os.path.exists(filename):
+        raise Exception('file %s does not exist.' % filename)
+
+    streams = {}
+    for tag, s, content in _iter_chunks(filename, {}, select_streams,
+                                        verbose):
+        if tag == 2:
+            streams[s] = content
+        elif tag == 3:
+            values, stamps = content
+            yield streams[s], values, stamps
+
+
+def _read_xdf(filename, on_chunk, verbose):
+    """Read and decode all chunks of an XDF file, in order of appearance."""
     # dict of returned streams, in order of apparance, indexed by stream id
     streams = OrderedDict()
     # dict of per-stream temporary data (StreamData), indexed by stream id
     temp = {}
     # XML content of the file header chunk
     fileheader = None
+
+    for tag, s, content in _iter_chunks(filename, temp, None, verbose):
+        if tag == 1:
+            fileheader = content
+        elif tag == 2:
+            streams[s] = content
+        elif tag == 3:
+            values, stamps = content
+            # optionally send through the on_chunk function
+            if on_chunk is not None:
+                values, stamps, streams[s] = on_chunk(values, stamps,
+                                                      streams[s], s)
+            # append to the time series...
+            temp[s].time_series.append(values)
+            temp[s].time_stamps.append(stamps)
+        elif tag == 6:
+            streams[s]['footer'] = content
+        elif tag == 4:
+            clock_time, clock_value = content
+            temp[s].clock_times.append(clock_time)
+            temp[s].clock_values.append(clock_value)
+
+    return streams, temp, fileheader
+
+
+def _iter_chunks(filename, temp, select_streams, verbose):
+    """Read and decode the chunks of an XDF file, in order of appearance.
+
+    Yields (tag, stream id, content) for each chunk, where the content is
+    the XML dict of header and footer chunks, (values, stamps) of [Samples]
+    chunks and (clock time, clock value) of [ClockOffset] chunks. The
+    StreamData of each stream is created in temp; it carries the decoding
+    state of the stream from chunk to chunk. Chunks of streams that are not
+    selected are skipped, apart from their headers.
+    """
+    # ids of the streams that are read
+    selected = set()
     # number of bytes in the file for fault tolerance
     filesize = os.path.getsize(filename)
 
@@ -225,6 +398,7 @@ def load_xdf(filename,
             try:
                 # read [NumLengthBytes], [Length]
                 chunklen = _read_varlen_int(f)
+                chunkend = f.tell() + chunklen
             except:
                 if f.tell() < filesize-1024:
                     print('  got zero-length chunk, scanning forward to next '
@@ -246,7 +420,7 @@ def load_xdf(filename,
             if tag == 1:
                 # read [FileHeader] chunk
                 xml_string = f.read(chunklen-2)
-                fileheader = _xml2dict(ET.fromstring(xml_string))
+                yield tag, None, _xml2dict(ET.fromstring(xml_string))
             elif tag == 2:
                 # read [StreamHeader] chunk...
                 # read [StreamId]
@@ -254,128 +428,522 @@ def load_xdf(filename,
                 # read [Content]
                 xml_string = f.read(chunklen-6)
                 hdr = _xml2dict(ET.fromstring(xml_string))
-                streams[s] = hdr
                 if verbose:
                     print('  found stream ' + hdr['info']['name'][0])
+                if not _is_selected(hdr, select_streams):
+                    continue
+                selected.add(s)
                 # initialize per-stream temp data
                 temp[s] = StreamData(hdr)
+                yield tag, s, hdr
             elif tag == 3:
                 # read [Samples] chunk...
                 try:
                     # read [StreamId]
                     s = struct.unpack('<I', f.read(4))[0]
+                    if s not in selected:
+                        f.seek(chunkend)
+                        continue
                     # read [NumSampleBytes], [NumSamples]
                     nsamples = _read_varlen_int(f)
-                    # allocate space
-                    stamps = np.zeros((nsamples,))
-                    if temp[s].fmt == 'string':
-                        # read a sample comprised of strings
-                        values = [[None]*temp[s].nchns for _ in range(nsamples)]
-                        # for each sample...
-                        for k in range(nsamples):
-                            # read or deduce time stamp
-                            if struct.unpack('B', f.read(1))[0]:
-                                stamps[k] = struct.unpack('<d', f.read(8))[0]
-                            else:
-                                stamps[k] = (temp[s].last_timestamp +
-                                             temp[s].tdiff)
-                            temp[s].last_timestamp = stamps[k]
-                            # read the values
-                            for ch in range(temp[s].nchns):
-                                raw = f.read(_read_varlen_int(f))
-                                values[k][ch] = raw.decode(errors='replace')
-                    else:
-                        # read a sample comprised of numeric values
-                        values = np.zeros((nsamples, temp[s].nchns))
-                        # for each sample...
-                        for k in range(nsamples):
-                            # read or deduce time stamp
-                            if struct.unpack('B', f.read(1))[0]:
-                                stamps[k] = struct.unpack('<d', f.read(8))[0]
-                            else:
-                                stamps[k] = (temp[s].last_timestamp +
-                                             temp[s].tdiff)
-                            temp[s].last_timestamp = stamps[k]
-                            # read the values
-                            raw = f.read(temp[s].samplebytes)
-                            values[k, :] = struct.unpack(temp[s].structfmt, raw)
+                    # read the rest of the chunk in one go and decode it
+                    raw = f.read(chunkend - f.tell())
+                    values, stamps = _decode_chunk(raw, nsamples, temp[s])
                     if verbose:
                         print('  reading [%s,%s]' % (temp[s].nchns, nsamples))
-                    # optionally send through the on_chunk function
-                    if on_chunk is not None:
-                        values, stamps, streams[s] = on_chunk(values, stamps,
-                                                              streams[s], s)
-                    # append to the time series...
-                    temp[s].time_series.append(values)
-                    temp[s].time_stamps.append(stamps)
                 except Exception as e:
                     # an error occurred (perhaps a chopped-off file): emit a
                     # warning and scan forward to the next recognized chunk
                     print('  got error (%s), scanning forward to next '
                           'boundary chunk.', e)
                     _scan_forward(f)
+                    continue
+                yield tag, s, (values, stamps)
             elif tag == 6:
                 # read [StreamFooter] chunk
                 s = struct.unpack('<I', f.read(4))[0]
                 xml_string = f.read(chunklen-6)
-                streams[s]['footer'] = _xml2dict(ET.fromstring(xml_string))
+                if s in selected:
+                    yield tag, s, _xml2dict(ET.fromstring(xml_string))
             elif tag == 4:
                 # read [ClockOffset] chunk
                 s = struct.unpack('<I', f.read(4))[0]
-                temp[s].clock_times.append(struct.unpack('<d', f.read(8))[0])
-                temp[s].clock_values.append(struct.unpack('<d', f.read(8))[0])
+                clock_time = struct.unpack('<d', f.read(8))[0]
+                clock_value = struct.unpack('<d', f.read(8))[0]
+                if s in selected:
+                    yield tag, s, (clock_time, clock_value)
             else:
                 # skip other chunk types (Boundary, ...)
                 f.read(chunklen-2)
-    
-    # Concatenate the signal across chunks
-    for stream in temp.values():
-        if stream.time_stamps:
-            # stream with non-empty list of chunks
-            stream.time_stamps = np.concatenate(stream.time_stamps)
-            if stream.fmt == 'string':
-                stream.time_series = list(itertools.chain(*stream.time_series))
-            else:
-                stream.time_series = np.concatenate(stream.time_series)
-        else:
-            # stream without any chunks
-            stream.time_stamps = np.zeros((0,))
-            if stream.fmt == 'string':
-                stream.time_series = []
+
+
+def _index_xdf(f, filesize, verbose):
+    """Scan the chunk headers of an XDF file without decoding any samples.
+
+    Returns a dict with the position of the file header and, for each
+    stream id in order of appearance, the positions of its header, footer,
+    [Samples] chunks and [ClockOffset] chunks. Headers, footers and samples
+    are given as [offset, length] of their content in the file; the samples
+    entries hold the number of samples of the chunk as a third value.
+    """
+    index = {'fileheader': None, 'streams': OrderedDict()}
+
+    # read [MagicCode]
+    if f.read(4) != b'XDF:':
+        raise Exception('not a valid XDF file.')
+
+    # for each chunk...
+    while True:
+
+        # noinspection PyBroadException
+        try:
+            # read [NumLengthBytes], [Length]
+            chunklen = _read_varlen_int(f)
+            chunkend = f.tell() + chunklen
+        except:
+            if f.tell() < filesize-1024:
+                print('  got zero-length chunk, scanning forward to next '
+                      'boundary chunk.')
+                _scan_forward(f)
+                continue
             else:
-                stream.time_series = np.zeros((stream.nchns, 0))
+                if verbose:
+                    print('  reached end of file.')
+                break
 
-    # perform (fault-tolerant) clock synchronization if requested
-    if synchronize_clocks:
+        # read [Tag]
+        tag = struct.unpack('<H', f.read(2))[0]
         if verbose:
-            print('  performing clock synchronization...')
-        temp = _clock_sync(temp, handle_clock_resets,
-                           clock_reset_threshold_stds,
-                           clock_reset_threshold_seconds,
-                           clock_reset_threshold_offset_stds,
-                           clock_reset_threshold_offset_seconds,
-                           winsor_threshold)
-    
-    # perform jitter removal if requested
-    if dejitter_timestamps:
+            print('  read tag: %i at %d bytes, length=%d'
+                  % (tag, f.tell(), chunklen))
+
+        if tag == 1:
+            # [FileHeader] chunk
+            index['fileheader'] = [f.tell(), chunklen-2]
+        elif tag == 2:
+            # [StreamHeader] chunk
+            s = struct.unpack('<I', f.read(4))[0]
+            index['streams'][s] = {'header': [f.tell(), chunklen-6],
+                                   'footer': None,
+                                   'samples': [],
+                                   'clock_offsets': []}
+        elif tag == 3:
+            # [Samples] chunk, only its [StreamId] and [NumSamples] are read
+            try:
+                s = struct.unpack('<I', f.read(4))[0]
+                nsamples = _read_varlen_int(f)
+                if chunkend > filesize:
+                    raise RuntimeError('chunk runs past the end of the file')
+                index['streams'][s]['samples'].append(
+                    [f.tell(), chunkend - f.tell(), nsamples])
+            except Exception as e:
+                # an error occurred (perhaps a chopped-off file): emit a
+                # warning and scan forward to the next recognized chunk
+                print('  got error (%s), scanning forward to next '
+                      'boundary chunk.' % e)
+                _scan_forward(f)
+                continue
+        elif tag == 6:
+            # [StreamFooter] chunk
+            s = struct.unpack('<I', f.read(4))[0]
+            index['streams'][s]['footer'] = [f.tell(), chunklen-6]
+        elif tag == 4:
+            # [ClockOffset] chunk
+            s = struct.unpack('<I', f.read(4))[0]
+            index['streams'][s]['clock_offsets'].append(f.tell())
+        # skip the rest of the chunk (Boundary, ...)
+        f.seek(min(chunkend, filesize))
+
+    return index
+
+
+def _read_xdf_indexed(filename, select_streams, on_chunk, verbose,
+                      cache_index=False, max_workers=1):
+    """Read an XDF file through a memory map, decoding only some streams."""
+    filesize = os.path.getsize(filename)
+    index = None
+    if cache_index:
+        index = _load_index_file(filename, verbose)
+
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if index is None:
+                index = _index_xdf(buf, filesize, verbose)
+                if cache_index:
+                    _save_index_file(filename, index, verbose)
+            return _decode_indexed(buf, index, select_streams, on_chunk,
+                                   verbose, filename, max_workers)
+
+
+# version of the index file layout, bump it when the layout changes
+INDEX_FILE_VERSION = 1
+
+
+def _index_filename(filename):
+    """Name of the file that the chunk index of an XDF file is kept in."""
+    return filename + '.index.json'
+
+
+def _file_signature(filename):
+    """Size and modification time of a file, to check an index against."""
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def _load_index_file(filename, verbose):
+    """Load the stored chunk index of an XDF file.
+
+    Returns None if there is no index, or if it was made for a different
+    version of the file.
+    """
+    index_filename = _index_filename(filename)
+    if not os.path.exists(index_filename):
+        return None
+
+    # noinspection PyBroadException
+    try:
+        with open(index_filename, 'r') as f:
+            stored = json.load(f, object_pairs_hook=OrderedDict)
+        if stored['version'] != INDEX_FILE_VERSION or \
+                stored['file'] != _file_signature(filename):
+            if verbose:
+                print('  index file %s is out of date.' % index_filename)
+            return None
+        # json only knows string keys, the stream ids are integers
+        streams = OrderedDict((int(s), chunks)
+                              for s, chunks in stored['streams'].items())
+        return {'fileheader': stored['fileheader'], 'streams': streams}
+    except Exception as e:
+        print('  could not read index file %s (%s), ignoring it.'
+              % (index_filename, e))
+        return None
+
+
+def _save_index_file(filename, index, verbose):
+    """Store the chunk index of an XDF file next to it."""
+    index_filename = _index_filename(filename)
+    stored = OrderedDict([
+        ('version', INDEX_FILE_VERSION),
+        ('file', _file_signature(filename)),
+        ('fileheader', index['fileheader']),
+        ('streams', index['streams']),
+    ])
+
+    # write to a temporary file first so that a concurrent load never
+    # sees a partially written index
+    tmp_filename = '%s.%d.tmp' % (index_filename, os.getpid())
+    try:
+        with open(tmp_filename, 'w') as f:
+            json.dump(stored, f)
+        os.replace(tmp_filename, index_filename)
         if verbose:
-            print('  performing jitter removal...')
-        temp = _jitter_removal(temp, jitter_break_threshold_seconds,
-                               jitter_break_threshold_samples,)
+            print('  stored chunk index in %s.' % index_filename)
+    except (IOError, OSError) as e:
+        # the index is only an optimization, e.g. the recording may be
+        # on a read-only drive
+        if verbose:
+            print('  could not store index file %s (%s).'
+                  % (index_filename, e))
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def _decode_indexed(buf, index, select_streams, on_chunk, verbose,
+                    filename=None, max_workers=1):
+    """Decode the selected streams of an indexed XDF file."""
+    # XML content of the file header chunk
+    fileheader = None
+    if index['fileheader'] is not None:
+        offset, length = index['fileheader']
+        fileheader = _xml2dict(ET.fromstring(buf[offset:offset+length]))
+
+    # dict of returned streams, in order of apparance, indexed by stream id
+    streams = OrderedDict()
+    # dict of per-stream temporary data (StreamData), indexed by stream id
+    temp = {}
+    for s, chunks in index['streams'].items():
+        offset, length = chunks['header']
+        hdr = _xml2dict(ET.fromstring(buf[offset:offset+length]))
+        if not _is_selected(hdr, select_streams):
+            continue
+        streams[s] = hdr
+        if verbose:
+            print('  found stream ' + hdr['info']['name'][0])
+        temp[s] = StreamData(hdr)
+
+        for offset in chunks['clock_offsets']:
+            clock_time, clock_value = struct.unpack_from('<dd', buf, offset)
+            temp[s].clock_times.append(clock_time)
+            temp[s].clock_values.append(clock_value)
+
+    # decode the samples, in other processes if there are enough streams
+    # to go around (and shared memory is available)
+    with_samples = [s for s in streams if index['streams'][s]['samples']]
+    if max_workers > 1 and len(with_samples) > 1 and \
+            shared_memory is not None:
+        decoded = _decode_streams_in_pool(filename, streams, index,
+                                          with_samples, max_workers)
     else:
-        for stream in temp.values():
-            duration = stream.time_stamps[-1] - stream.time_stamps[0]
-            stream.effective_srate = len(stream.time_stamps)/duration
+        decoded = {s: _decode_stream(buf, index['streams'][s]['samples'],
+                                     temp[s])
+                   for s in streams}
 
-    for k in streams.keys():
-        stream = streams[k]
-        tmp = temp[k]
-        stream['info']['effective_srate'] = tmp.effective_srate
-        stream['time_series'] = tmp.time_series
-        stream['time_stamps'] = tmp.time_stamps
+    for s in streams:
+        chunks = index['streams'][s]
+        for values, stamps in decoded.get(s, []):
+            if verbose:
+                print('  reading [%s,%s]' % (temp[s].nchns, len(stamps)))
+            # optionally send through the on_chunk function
+            if on_chunk is not None:
+                values, stamps, streams[s] = on_chunk(values, stamps,
+                                                      streams[s], s)
+            # append to the time series...
+            temp[s].time_series.append(values)
+            temp[s].time_stamps.append(stamps)
+
+        if chunks['footer'] is not None:
+            offset, length = chunks['footer']
+            streams[s]['footer'] = _xml2dict(
+                ET.fromstring(buf[offset:offset+length]))
+
+    return streams, temp, fileheader
+
+
+def _decode_stream(buf, samples, stream):
+    """Decode the [Samples] chunks of one stream into (values, stamps)."""
+    blocks = []
+    for offset, length, nsamples in samples:
+        try:
+            blocks.append(_decode_chunk(buf[offset:offset+length], nsamples,
+                                        stream))
+        except Exception as e:
+            print('  got error (%s), skipping chunk.' % e)
+    return blocks
+
+
+def _decode_streams_in_pool(filename, streams, index, stream_ids,
+                            max_workers):
+    """Decode the samples of several streams in a pool of processes.
+
+    Each process decodes one whole stream, as the time stamps of a chunk
+    can depend on the chunks before it. The values and time stamps of
+    numeric streams are written to shared memory that is sized from the
+    sample counts of the index; string samples are sent back as they are.
+    Returns the (values, stamps) of each chunk per stream id, like
+    _decode_stream does.
+    """
+    buffers = {}
+    try:
+        with ProcessPoolExecutor(max_workers=min(max_workers,
+                                                 len(stream_ids))) as pool:
+            futures = {}
+            nchns = {}
+            for s in stream_ids:
+                samples = index['streams'][s]['samples']
+                shm_names = None
+                if streams[s]['info']['channel_format'][0] != 'string':
+                    nsamples = max(sum(n for _, _, n in samples), 1)
+                    nchns[s] = int(streams[s]['info']['channel_count'][0])
+                    buffers[s] = (
+                        shared_memory.SharedMemory(
+                            create=True, size=nsamples*max(nchns[s], 1)*8),
+                        shared_memory.SharedMemory(create=True,
+                                                   size=nsamples*8)
+                    )
+                    shm_names = tuple(b.name for b in buffers[s])
+                futures[s] = pool.submit(_decode_stream_shared, filename,
+                                         streams[s], samples, shm_names)
+
+            decoded = {}
+            for s in stream_ids:
+                lengths, blocks = futures[s].result()
+                if s in buffers:
+                    decoded[s] = _split_shared(buffers[s], lengths, nchns[s])
+                else:
+                    decoded[s] = blocks
+            return decoded
+    finally:
+        for shms in buffers.values():
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+
+def _split_shared(shms, lengths, nchns):
+    """Copy the samples out of shared memory, split into their chunks."""
+    total = sum(lengths)
+    values = np.ndarray((total, nchns), dtype=np.float64,
+                        buffer=shms[0].buf).copy()
+    stamps = np.ndarray((total,), dtype=np.float64,
+                        buffer=shms[1].buf).copy()
+    bounds = np.cumsum([0] + lengths)
+    return [(values[start:end], stamps[start:end])
+            for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def _decode_stream_shared(filename, hdr, samples, shm_names):
+    """Decode one stream of an XDF file; runs in a worker process.
+
+    Numeric samples are written to the given shared memory buffers, and
+    only the number of samples of each decoded chunk is returned. String
+    samples are returned as (values, stamps) blocks.
+    """
+    stream = StreamData(hdr)
+    with open(filename, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            blocks = _decode_stream(buf, samples, stream)
+    lengths = [len(stamps) for _, stamps in blocks]
+    if shm_names is None:
+        return lengths, blocks
+
+    shms = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    try:
+        total = sum(lengths)
+        values = np.ndarray((total, stream.nchns), dtype=np.float64,
+                            buffer=shms[0].buf)
+        stamps = np.ndarray((total,), dtype=np.float64, buffer=shms[1].buf)
+        start = 0
+        for block_values, block_stamps in blocks:
+            end = start + len(block_stamps)
+            values[start:end] = block_values
+            stamps[start:end] = block_stamps
+            start = end
+        del values, stamps
+    finally:
+        for shm in shms:
+            shm.close()
+    return lengths, None
+
+
+def _is_selected(hdr, select_streams):
+    """Whether the stream with the given header should be loaded."""
+    if select_streams is None:
+        return True
+    if callable(select_streams):
+        return select_streams(hdr['info'])
+    return hdr['info']['name'][0] in select_streams
+
+
+def _decode_chunk(raw, nsamples, stream):
+    """Decode the content of a [Samples] chunk that follows [NumSamples]."""
+    if stream.fmt == 'string':
+        return _decode_string_chunk(raw, nsamples, stream)
+    # decode in bulk; chunks that mix samples with and without time
+    # stamps are decoded sample by sample
+    decoded = _decode_numeric_chunk(raw, nsamples, stream)
+    if decoded is not None:
+        return decoded
+    return _read_chunk_samples(io.BytesIO(raw), nsamples, stream)
+
+
+def _read_chunk_samples(f, nsamples, stream):
+    """Read the samples of a [Samples] chunk one at a time."""
+    # allocate space
+    stamps = np.zeros((nsamples,))
+    if stream.fmt == 'string':
+        # read a sample comprised of strings
+        values = [[None]*stream.nchns for _ in range(nsamples)]
+    else:
+        # read a sample comprised of numeric values
+        values = np.zeros((nsamples, stream.nchns))
+    # for each sample...
+    for k in range(nsamples):
+        # read or deduce time stamp
+        if struct.unpack('B', f.read(1))[0]:
+            stamps[k] = struct.unpack('<d', f.read(8))[0]
+        else:
+            stamps[k] = stream.last_timestamp + stream.tdiff
+        stream.last_timestamp = stamps[k]
+        # read the values
+        if stream.fmt == 'string':
+            for ch in range(stream.nchns):
+                raw = f.read(_read_varlen_int(f))
+                values[k][ch] = raw.decode(errors='replace')
+        else:
+            raw = f.read(stream.samplebytes)
+            values[k, :] = struct.unpack(stream.structfmt, raw)
+    return values, stamps
 
-    streams = [s for s in streams.values()]
-    return streams, fileheader
+
+def _decode_numeric_chunk(raw, nsamples, stream):
+    """Decode the content of a numeric [Samples] chunk in bulk.
+
+    Works when either every sample or no sample of the chunk carries its
+    own time stamp, since the samples then have a fixed size. Returns
+    (values, stamps) like _read_chunk_samples, or None for chunks with
+    mixed time stamp flags.
+    """
+    values_field = ('values', stream.dtype, (stream.nchns,))
+    stamped = np.dtype([('flag', 'u1'), ('stamp', '<f8'), values_field])
+    unstamped = np.dtype([('flag', 'u1'), values_field])
+    if len(raw) == nsamples*stamped.itemsize:
+        samples = np.frombuffer(raw, dtype=stamped, count=nsamples)
+        if not np.all(samples['flag']):
+            return None
+        stamps = samples['stamp'].astype(np.float64)
+    elif len(raw) == nsamples*unstamped.itemsize:
+        samples = np.frombuffer(raw, dtype=unstamped, count=nsamples)
+        if np.any(samples['flag']):
+            return None
+        # deduce the time stamps by accumulating the sampling interval in
+        # the same order as the per-sample path, to get identical values
+        stamps = np.full((nsamples + 1,), stream.tdiff)
+        stamps[0] = stream.last_timestamp
+        stamps = np.cumsum(stamps)[1:]
+    else:
+        return None
+    if nsamples > 0:
+        stream.last_timestamp = stamps[-1]
+    values = samples['values'].astype(np.float64)
+    return values, stamps
+
+
+# unpackers of the values of variable-length integers, by their byte count
+_VARLEN_UNPACK = {1: struct.Struct('B').unpack_from,
+                  4: struct.Struct('<I').unpack_from,
+                  8: struct.Struct('<Q').unpack_from}
+_unpack_double = struct.Struct('<d').unpack_from
+
+
+def _decode_string_chunk(raw, nsamples, stream):
+    """Decode the content of a string [Samples] chunk in one pass.
+
+    The chunk is walked in memory to find where each string starts and
+    ends, and the strings are only decoded once all of them are found.
+    Returns (values, stamps) like _read_chunk_samples.
+    """
+    nchns = stream.nchns
+    tdiff = stream.tdiff
+    last_timestamp = stream.last_timestamp
+    stamps = np.zeros((nsamples,))
+    # (start, end) of every string of the chunk, sample by sample
+    bounds = []
+    pos = 0
+    for k in range(nsamples):
+        # read or deduce time stamp
+        if raw[pos]:
+            last_timestamp = _unpack_double(raw, pos + 1)[0]
+            pos += 9
+        else:
+            last_timestamp = last_timestamp + tdiff
+            pos += 1
+        stamps[k] = last_timestamp
+        # find the strings of the sample
+        for _ in range(nchns):
+            nbytes = raw[pos]
+            if nbytes not in _VARLEN_UNPACK:
+                raise RuntimeError('invalid variable-length integer '
+                                   'encountered.')
+            start = pos + 1 + nbytes
+            pos = start + _VARLEN_UNPACK[nbytes](raw, pos + 1)[0]
+            bounds.append((start, pos))
+    if nsamples > 0:
+        stream.last_timestamp = stamps[-1]
+
+    strings = [raw[start:end].decode(errors='replace')
+               for start, end in bounds]
+    values = [strings[k*nchns:(k+1)*nchns] for k in range(nsamples)]
+    return values, stamps
 
 
 def _read_varlen_int(f):
@@ -21,13 +21,16 @@ Copyright (C) 2018  Gregory W. Mierzwinski
 import os
 cwd = os.getcwd()
 
-from pupillib.core.plib_parser import PLibParser
+from pupillib.core.plib_parser import PLibParser, plan_worker_count
 from pupillib.core.utilities.MPLogger import MultiProcessingLog
 from pupillib.core.utilities.utilities import *
+from pupillib.core.workers.backends import ProcessBackend, get_backend
 from pupillib.core.workers.dataset_worker import PLibDatasetWorker
 from pupillib.core.workers.processors.xdfloader_processor import XdfLoaderProcessor
+from pupillib.core.workers.scheduler import TaskScheduler, get_num_workers
 from pupillib.dependencies.xdf.Python.xdf import load_xdf
 from pupillib.core.utilities.config_store import ConfigStore
+from pupillib.core.utilities.shared_arrays import to_mapped_arrays, from_mapped_arrays
 from pupillib.core.utilities.default_dataset_processors import (
     eye_pyrep_to_prim_default,
     gaze_pyrep_to_prim_default,
@@ -37,7 +40,10 @@ from pupillib.core.data_container import PupilDatasets
 
 import threading
 from threading import Thread
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import shutil
+import tempfile
 import time
 import datetime
 import json
@@ -172,21 +178,27 @@ def xdf_pupil_load_v2(name_list, pcap_data):
     for name in final_missing:
         logger.error('Missing %s from datastream' % name)
 
-    # Now extract the timeseries for all requested names that exist
-    pcap_tseries = pcap_data['time_series']
+    # Now extract the timeseries for all requested names that exist.
+    # All of the channels are taken from the (samples x channels) matrix
+    # at once, and transposed so that each one is a contiguous row.
+    pcap_tseries = np.asarray(pcap_data['time_series'], dtype=np.float64)
     pcap_tstamps = pcap_data['time_stamps']
+    if pcap_tseries.size == 0:
+        # Empty streams are loaded as (channels x 0)
+        pcap_tseries = np.zeros((0, len(allchans)))
+
+    cnames = list(chaninds.keys())
+    columns = np.ascontiguousarray(
+        pcap_tseries[:, [chaninds[cname] for cname in cnames]].T
+    )
 
     all_data = {}
-    for cname in chaninds:
+    for cname, column in zip(cnames, columns):
         all_data[cname] = {
-            'data': [],
+            'data': column,
             'timestamps': pcap_tstamps
         }
 
-    for sample in pcap_tseries:
-        for cname, cind in chaninds.items():
-            all_data[cname]['data'].append(sample[cind])
-
     # Data's extracted, now calculate a sampling rate for each timeseries
     xdf_processor = XdfLoaderProcessor()
     xdf_transforms = xdf_processor.transform.all
@@ -218,7 +230,27 @@ def xdf_pupil_load_v2(name_list, pcap_data):
     return rm_all_data
 
 
-def xdf_pupil_load(dataset, xdf_file_and_name, data_num=0):
+# Names of the XDF streams that hold pupil data, every other stream
+# (except the markers) is skipped when loading.
+PUPIL_STREAM_NAMES = (
+    'pupil_capture',
+    'Gaze Primitive Data',
+    'Gaze Python Representation',
+    'Pupil Primitive Data - Eye 0',
+    'Pupil Primitive Data - Eye 1',
+    'Pupil Python Representation - Eye 0',
+    'Pupil Python Representation - Eye 1',
+    'Markers',
+)
+
+
+def is_pupil_stream(info):
+    # Used to select the streams that get decoded by load_xdf.
+    return info['name'][0] in PUPIL_STREAM_NAMES or \
+           info['type'][0] == 'Markers'
+
+
+def xdf_pupil_load(dataset, xdf_file_and_name, data_num=0, cache_index=True, decode_workers=1):
     logger = MultiProcessingLog.get_logger()
     if not MultiProcessingLog.quiet:
         logger.disable_redirect()
@@ -237,7 +269,12 @@ def xdf_pupil_load(dataset, xdf_file_and_name, data_num=0):
     dataset['dir'] = xdf_file
     dataset['dataset_name'] = name
 
-    xdf_data = load_xdf(xdf_file, dejitter_timestamps=False)
+    # The chunk index is kept next to the recording so that
+    # later loads can skip straight to the chunks that are needed.
+    xdf_data = load_xdf(xdf_file, dejitter_timestamps=False,
+                        select_streams=is_pupil_stream,
+                        cache_index=cache_index,
+                        max_workers=decode_workers)
 
     markers_stream = None
     eye0_stream = None
@@ -511,7 +548,10 @@ class PupilLibLoader(Thread):
         if '.xdf' in self.dataset['dir']:
             self.dataset['dataname_list'] = self.config['data_name_per_dataset'][self.dataset_path_and_name] if \
                 'data_name_per_dataset' in self.config else self.config['dataname_list']
-            self.dataset = xdf_pupil_load(self.dataset, self.dataset['dir'], data_num=self.index)
+            cache_index = self.config['cache_xdf_index'] if 'cache_xdf_index' in self.config else True
+            decode_workers = self.config['xdf_workers'] if 'xdf_workers' in self.config else 1
+            self.dataset = xdf_pupil_load(self.dataset, self.dataset['dir'], data_num=self.index,
+                                          cache_index=cache_index, decode_workers=decode_workers)
         else:
             self.dataset = pupil_old_load(self.dataset, self.dataset['dir'], data_num=self.index)
         return self.dataset
@@ -520,6 +560,15 @@ class PupilLibLoader(Thread):
         self.load()
 
 
+def load_dataset_in_process(config, num, tmp_dir):
+    # Used by the process loader to load a dataset in a worker process.
+    # The arrays of the dataset are written to memory-mapped files in
+    # tmp_dir so that they don't have to be pickled back.
+    ConfigStore.set_instance(config)
+    loader = PupilLibLoader(config, num)
+    return to_mapped_arrays(loader.load(), tmp_dir)
+
+
 class PupilLibRunner(object):
     def __init__(self, config=None, quiet=False):
         self.config = config
@@ -579,19 +628,13 @@ class PupilLibRunner(object):
     def load_datasets(self):
         self.logger.send('INFO', 'Loading datasets...')
 
-        if 'no_parallel' not in self.config and \
-            self.config['max_workers'] >= self.config['num_datasets']:
-            # Load and run datasets in parallel
-            loaders = [PupilLibLoader(self.config, i) for i in range(0, self.config['num_datasets'])]
+        if 'loader' in self.config and self.config['loader'] == 'process':
+            self.load_datasets_in_processes()
+        elif get_backend(self.config) == 'thread':
+            # Load the datasets as tasks of the scheduler.
             self.logger.send('INFO', 'hello from all ' + str(datetime.datetime.now().time()), os.getpid(), threading.get_ident())
-            for i in loaders:
-                i.start()
-            for i in loaders:
-                i.join()
-
+            self.run_task_graph(load=True, transform=False)
             self.logger.send('INFO', 'Loaded:' + str(datetime.datetime.now().time()), os.getpid(), threading.get_ident())
-            for i in loaders:
-                self.loaded_datasets.append(i.dataset)
         else:
             # Not loading datasets in parallel.
             loader = PupilLibLoader(self.config)
@@ -604,35 +647,133 @@ class PupilLibRunner(object):
                 self.loaded_datasets.append(loader.dataset)
             self.logger.send('INFO', 'Loaded:' + str(datetime.datetime.now().time()), os.getpid(), threading.get_ident())
 
+    '''
+        Load the datasets in a pool of processes, parsing the files is CPU bound
+        so threads don't help much. The pool is sized from 'max_workers' and the
+        datasets are kept in the order that they were given in.
+    '''
+    def load_datasets_in_processes(self):
+        num_datasets = self.config['num_datasets']
+        max_workers = self.config['max_workers']
+        if max_workers is None or max_workers < 1:
+            max_workers = num_datasets
+        max_workers = min(max_workers, num_datasets)
+
+        self.logger.send('INFO', 'Loading ' + str(num_datasets) + ' datasets in ' + str(max_workers) +
+                         ' processes ' + str(datetime.datetime.now().time()), os.getpid(), threading.get_ident())
+        tmp_dir = tempfile.mkdtemp(prefix='pupillib_')
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                futures = [
+                    pool.submit(load_dataset_in_process, self.config, i, tmp_dir)
+                    for i in range(0, num_datasets)
+                ]
+                for future in futures:
+                    self.loaded_datasets.append(from_mapped_arrays(future.result()))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.logger.send('INFO', 'Loaded:' + str(datetime.datetime.now().time()), os.getpid(), threading.get_ident())
+
     '''
         Run Pupil-Lib based on the configuration given through the CLI.
         This function also controls parallelism of the dataset workers.
+        With the 'thread' backend, all of the work is split into tasks that
+        are run by the scheduler. With the 'process' backend, the dataset
+        workers are threads that run their data streams in a shared pool
+        of processes.
     '''
     def run_datasets(self):
-        parallel = False
+        backend = get_backend(self.config)
+        if backend == 'thread':
+            self.run_task_graph()
+        elif backend == 'process':
+            process_backend = ProcessBackend(self.config['max_workers'])
+            try:
+                self.run_dataset_workers(process_backend)
+            finally:
+                process_backend.close()
+        else:
+            self.run_dataset_workers()
+
+    def get_dir_name(self, ind):
+        return ((self.loaded_datasets[ind]['dataset_name'] + '|') if
+                'dataset_name' in self.loaded_datasets[ind] and
+                self.loaded_datasets[ind]['dataset_name'] != '' else
+                '') + self.loaded_datasets[ind]['dir'].replace('\\\\', '\\')
+
+    def load_dataset(self, ind):
+        loader = PupilLibLoader(self.config, ind)
+        self.loaded_datasets[ind] = loader.load()
+
+    # Plans the workers from the estimated cost of the loaded datasets,
+    # and returns the indices of the datasets, the most costly first.
+    def plan_workers(self):
+        dataset_names = [self.get_dir_name(ind) for ind in range(0, len(self.loaded_datasets))]
+        self.config = plan_worker_count(self.config, self.loaded_datasets, dataset_names)
+        return sorted(
+            range(0, len(dataset_names)),
+            key=lambda ind: self.config['worker_plan'][dataset_names[ind]]['cost'],
+            reverse=True
+        )
+
+    def add_dataset_tasks(self, scheduler, dataset_workers):
+        for ind in self.plan_workers():
+            dataset_worker = PLibDatasetWorker(self.config, self.loaded_datasets[ind])
+            dataset_worker.setName(self.get_dir_name(ind))
+            dataset_workers[ind] = dataset_worker
+            dataset_worker.add_tasks(scheduler)
+
+    '''
+        Runs the datasets as a graph of tasks in the scheduler. When 'load' is
+        set, the datasets are loaded first, and when 'transform' is set they
+        are processed once the workers are planned from the loaded datasets.
+    '''
+    def run_task_graph(self, load=False, transform=True):
+        scheduler = TaskScheduler(get_num_workers(self.config))
         dataset_workers = {}
+        load_tasks = []
+        if load:
+            self.loaded_datasets = [None] * self.config['num_datasets']
+            load_tasks = [
+                scheduler.add_task('load' + str(ind), self.load_dataset, ind)
+                for ind in range(0, len(self.loaded_datasets))
+            ]
+        if transform:
+            scheduler.add_task('plan', self.add_dataset_tasks, scheduler, dataset_workers, dependencies=load_tasks)
+        scheduler.run()
+
+        if not transform:
+            return
+        for ind in range(0, len(self.loaded_datasets)):
+            dataset_name = self.loaded_datasets[ind]['dataset_name']
+            self.proc_datasets[dataset_name] = dataset_workers[ind].proc_dataset_data
+
+        self.proc_data = {
+            'config': self.config,
+            'datasets': self.proc_datasets
+        }
 
-        def get_dir_name(ind):
-            return ((self.loaded_datasets[ind]['dataset_name'] + '|') if
-                                'dataset_name' in self.loaded_datasets[ind] and
-                                self.loaded_datasets[ind]['dataset_name'] != '' else
-                                '') + self.loaded_datasets[ind]['dir'].replace('\\\\', '\\')
+    def run_dataset_workers(self, process_backend=None):
+        parallel = False
+        dataset_workers = {}
 
-        if self.config['max_workers'] > self.config['num_datasets']:
+        dataset_order = self.plan_workers()
+        if get_backend(self.config) == 'process':
             parallel = True
-            for i in range(0, len(self.loaded_datasets)):
-                dataset_worker = PLibDatasetWorker(self.config, self.loaded_datasets[i])
+            # The most costly datasets are started first.
+            for i in dataset_order:
+                dataset_worker = PLibDatasetWorker(self.config, self.loaded_datasets[i],
+                                                   process_backend=process_backend)
 
-                dir_name = get_dir_name(i)
+                dir_name = self.get_dir_name(i)
                 dataset_workers[dataset_worker.dataset['dataset_name']] = dataset_worker
                 dataset_workers[dataset_worker.dataset['dataset_name']].setName(dir_name)
                 dataset_workers[dataset_worker.dataset['dataset_name']].start()
-                self.proc_datasets[dataset_worker.dataset['dataset_name']] = {}
         else:
-            dataset_worker = PLibDatasetWorker(self.config)
+            dataset_worker = PLibDatasetWorker(self.config, process_backend=process_backend)
             for i in range(0, len(self.loaded_datasets)):
                 dataset_worker.dataset = self.loaded_datasets[i]
-                dir_name = get_dir_name(i)
+                dir_name = self.get_dir_name(i)
                 dataset_worker.setName(dir_name)
                 dataset_worker.run()
                 self.proc_datasets[dataset_worker.dataset['dataset_name']] = {}
@@ -642,7 +783,7 @@ class PupilLibRunner(object):
             for i in dataset_workers:
                 dataset_workers[i].join()
             for i in range(0, len(self.loaded_datasets)):
-                dir_name = get_dir_name(i)
+                dir_name = self.get_dir_name(i)
                 self.proc_datasets[self.loaded_datasets[i]['dataset_name']] = \
                     dataset_workers[self.loaded_datasets[i]['dataset_name']].proc_dataset_data
 
@@ -720,8 +861,14 @@ class PupilLibRunner(object):
                 self.data_store = self.get_save_data(cache)
                 return
 
-        self.load()             # Extract
-        self.run_datasets()     # Transform
+        if get_backend(self.config) == 'thread' and \
+                not ('loader' in self.config and self.config['loader'] == 'process'):
+            # Extract and transform, each dataset is processed as soon as it's loaded.
+            self.logger.send('INFO', 'Loading datasets...')
+            self.run_task_graph(load=True)
+        else:
+            self.load()             # Extract
+            self.run_datasets()     # Transform
         self.build_datastore()  # Load
 
         if cache:
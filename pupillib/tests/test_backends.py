@@ -0,0 +1,120 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import os
+import pickle
+
+import numpy as np
+import pytest
+import yaml
+
+# Backend tests - these tests make sure that the arrays passed between
+# processes come back as they were, and that every backend gives the
+# same results.
+from pupillib.core.utilities.shared_arrays import MappedArray, to_mapped_arrays, from_mapped_arrays
+from pupillib.pupil_lib import PupilLibRunner
+from test_xdf import write_recording
+
+
+def assert_same(a, b, path=''):
+    if isinstance(a, dict):
+        assert set(a) == set(b), path
+        for key in a:
+            if key != 'config':
+                assert_same(a[key], b[key], path + '/' + str(key))
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b), path
+        for num, (x, y) in enumerate(zip(a, b)):
+            assert_same(x, y, path + '/' + str(num))
+    elif isinstance(a, np.ndarray):
+        assert np.array_equal(a, b, equal_nan=a.dtype.kind in 'fc'), path
+    elif isinstance(a, float) and np.isnan(a):
+        assert np.isnan(b), path
+    else:
+        assert a == b, path
+
+
+def write_config(tmp_path, datasets, **config):
+    yaml_config = {
+        'config': dict({
+            'workers': 2,
+            'logger': 'stdout',
+            'output_dir': str(tmp_path),
+            'trial_time': 1,
+            'baseline_time': -0.5,
+            'baseline': [0, 0.5],
+            'triggers': ['S11', 'S12'],
+            'testing': False
+        }, **config)
+    }
+    for num, dataset in enumerate(datasets, 1):
+        yaml_config['dataset' + str(num)] = {
+            'dataset_path': dataset,
+            'data_names': ['eye0', 'gaze_x', 'gaze_y-pyrep']
+        }
+
+    path = str(tmp_path / ('config_' + '_'.join(str(val) for val in config.values()) + '.yml'))
+    with open(path, 'w') as f:
+        yaml.safe_dump(yaml_config, f)
+    return path
+
+
+def test_mapped_arrays_round_trip(tmp_path):
+    shared = np.arange(10, dtype=float)
+    shared.flags.writeable = False
+    obj = {
+        'a': shared,
+        'b': [shared, np.arange(3)],
+        'names': np.asarray(['S11', 'S12']),
+        'empty': np.array([])
+    }
+
+    mapped = pickle.loads(pickle.dumps(to_mapped_arrays(obj, str(tmp_path))))
+    assert isinstance(mapped['a'], MappedArray)
+    assert mapped['a'] is mapped['b'][0]
+    # The array that appears twice is only written once.
+    assert len(os.listdir(str(tmp_path))) == 2
+
+    result = from_mapped_arrays(mapped)
+    assert result['a'] is result['b'][0]
+    assert not result['a'].flags.writeable
+    assert np.array_equal(result['a'], shared)
+    assert result['b'][1].flags.writeable
+    assert np.array_equal(result['b'][1], np.arange(3))
+    assert np.array_equal(result['names'], obj['names'])
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_backends_give_same_results(tmp_path):
+    datasets = [write_recording(str(tmp_path / 'a.xdf'), 1),
+                write_recording(str(tmp_path / 'b.xdf'), 2, seconds=20)]
+
+    proc_data = {}
+    for backend in ('thread', 'serial', 'process'):
+        plibrunner = PupilLibRunner(quiet=True)
+        plibrunner.get_build_config(yaml_path=write_config(tmp_path, datasets, backend=backend))
+        plibrunner.run()
+        proc_data[backend] = plibrunner.proc_data['datasets']
+
+    assert set(proc_data['thread']) == {'dataset1', 'dataset2'}
+    trials = proc_data['thread']['dataset1']['data']['gaze_y-pyrep']['triggers']['S11']['trials']
+    assert len(trials) > 0
+    assert_same(proc_data['thread'], proc_data['serial'])
+    assert_same(proc_data['thread'], proc_data['process'])
@@ -0,0 +1,62 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import pytest
+
+# Config tests - these tests make sure that the overrides given
+# for a worker name are found without changing the config.
+from pupillib.core.utilities.config_store import ConfigResolver, ConfigView, with_values
+from pupillib.core.utilities.utilities import parse_yaml_for_config
+
+
+def test_parse_yaml_for_config():
+    config = {
+        'trial_time': 2,
+        'baseline_time': -1,
+        'max_workers': 4,
+        'parsed_yaml': {
+            'ds': {'trial_time': 3},
+            'ds:eye0': {'baseline_time': -2, 'max_workers': 100},
+            'ds:eye0:triggerS1:trial2': {'trial_time': 5},
+        }
+    }
+
+    dataset = parse_yaml_for_config(config, 'ds')
+    eye = parse_yaml_for_config(dataset, 'ds:eye0')
+    trigger = parse_yaml_for_config(eye, 'ds:eye0:triggerS1')
+    trial = parse_yaml_for_config(trigger, 'ds:eye0:triggerS1:trial2')
+
+    assert (dataset['trial_time'], dataset['baseline_time']) == (3, -1)
+    assert (eye['trial_time'], eye['baseline_time'], eye['max_workers']) == (3, -2, 4)
+    # Triggers and trials fall back to the overrides of their data stream.
+    assert (trigger['trial_time'], trigger['baseline_time']) == (3, -2)
+    assert (trial['trial_time'], trial['baseline_time']) == (5, -2)
+    assert parse_yaml_for_config(dataset, 'ds:eye1')['trial_time'] == 3
+
+    # The views are read-only, and the config is never changed.
+    assert isinstance(trial, ConfigView) and len(trial.layers) == 3
+    with pytest.raises(TypeError):
+        trial['trial_time'] = 1
+    assert config['trial_time'] == 2 and 'srate' not in config
+    assert with_values(trial, srate=256)['srate'] == 256 and 'srate' not in trial
+
+    resolver = ConfigResolver.get(config['parsed_yaml'])
+    assert trial.resolver is resolver
+    assert resolver.get_overrides('ds:eye0:triggerS1') is resolver.get_overrides('ds:eye0:triggerS1')
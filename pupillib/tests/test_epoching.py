@@ -0,0 +1,158 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import numpy as np
+import pytest
+
+from pupillib.core.utilities import epoching
+from pupillib.core.utilities.utilities import align_markers, get_grid_positions
+from pupillib.core.workers.trial_worker import PLibTrialWorker
+
+
+SRATE = 120
+
+
+def make_stream(seed):
+    rng = np.random.RandomState(seed)
+    steps = (1 + rng.uniform(-0.3, 0.3, 3000)) / SRATE
+    timestamps = 100 + np.cumsum(steps)
+    data = np.sin(timestamps) + rng.normal(0, 0.1, len(timestamps))
+    marker_times = np.sort(rng.uniform(timestamps[0], timestamps[-1], 40))
+    return timestamps, data, marker_times
+
+
+def per_trial(worker, chunk_data, baseline, trial):
+    # Same choices as PLibTrialWorker.run
+    if baseline <= 0:
+        start, _ = worker.get_baseline_start(chunk_data)
+        if trial >= 0:
+            end, _ = worker.get_trialtime_end(chunk_data)
+        else:
+            end, _ = worker.get_baseline_start(chunk_data, use_trial_time=True)
+    else:
+        start, _ = worker.get_trialtime_end(chunk_data, use_baseline_time=True)
+        end, _ = worker.get_trialtime_end(chunk_data)
+    return start, end
+
+
+@pytest.mark.parametrize('baseline,trial', [(-1, 2.5), (0, 2), (0.5, 3), (-2, -0.5)])
+def test_extract_epochs_matches_trial_worker(baseline, trial):
+    timestamps, data, marker_times = make_stream(int(abs(baseline * 10 + trial)))
+    inds, _, errors, _ = align_markers(timestamps, marker_times)
+    marker_times = marker_times[:len(inds)]
+    # Windows are the whole stream here.
+    epochs = epoching.extract_epochs(timestamps, data, inds, marker_times, errors,
+                                     baseline, trial, SRATE)
+    assert epochs['valid'].sum() > len(inds) / 2
+
+    worker = PLibTrialWorker({})
+    for num, ind in enumerate(inds):
+        if not epochs['valid'][num]:
+            continue
+        chunk_data = {
+            'data': data,
+            'timestamps': timestamps,
+            'srate': SRATE,
+            'marker_ind': ind,
+            'actual_marker_time': timestamps[ind],
+            'marker_time': marker_times[num],
+            'error': errors[num],
+            'baseline_time_sec': baseline,
+            'trial_time_sec': trial
+        }
+        start, end = per_trial(worker, chunk_data, baseline, trial)
+        proc_baseline_chunk, proc_trial_chunk = epoching.epoch_chunks(epochs, num, timestamps[ind])
+
+        worker.chunk_data = chunk_data
+        trial_chunk, _ = worker.cut_trial(start, end)
+        assert proc_baseline_chunk == start
+        assert proc_trial_chunk == end
+
+        length = epochs['lengths'][num]
+        assert np.array_equal(epochs['data'][num, :length], trial_chunk['data'])
+        assert np.array_equal(epochs['timestamps'][num, :length], trial_chunk['timestamps'])
+        assert np.all(np.isnan(epochs['data'][num, length:]))
+
+
+def test_resample_trials_matches_interp():
+    rng = np.random.RandomState(3)
+    timestamps = [100 + np.cumsum(rng.uniform(0.001, 0.02, size)) for size in (50, 120, 120, 1)]
+    datas = [rng.normal(size=len(times)) for times in timestamps]
+    datas[1][10] = np.nan
+
+    new_times, lengths, (new_data, new_proc) = epoching.resample_trials(
+        timestamps, [datas, [None, datas[1], None, None]], 256
+    )
+    assert new_times.shape == new_data.shape == (4, lengths.max())
+    for row, times in enumerate(timestamps):
+        stimes = times - times[0]
+        xrange = np.linspace(stimes[0], stimes[-1], num=int(256*(stimes[-1]-stimes[0])))
+        assert np.array_equal(new_times[row, :lengths[row]], xrange)
+        assert np.array_equal(new_data[row, :lengths[row]], np.interp(xrange, stimes, datas[row]),
+                              equal_nan=True)
+        assert np.all(np.isnan(new_data[row, lengths[row]:]))
+    assert np.array_equal(new_proc[1, :lengths[1]], new_data[1, :lengths[1]], equal_nan=True)
+    assert np.all(np.isnan(new_proc[0]))
+
+
+def test_remove_baseline():
+    timestamps = [np.arange(10) * 0.5 + 3, np.arange(6) * 0.5]
+    datas = [np.arange(10, dtype=float), np.array([4., 2., 6., 0., 1., 1.])]
+
+    means, rmbaseline, lengths = epoching.remove_baseline(timestamps, datas, [0.25, 1.0])
+
+    # Edges are approximated at 0.25s and the points up to 1.0s are included.
+    assert means[0] == (0.5 + 1 + 2) / 3
+    assert means[1] == (3 + 2 + 6) / 3
+    assert list(lengths) == [10, 6]
+    assert np.array_equal(rmbaseline[1, :6], datas[1] - means[1])
+
+    with pytest.raises(Exception):
+        epoching.remove_baseline(timestamps, datas, [0, 4])
+
+
+def test_resample_streams():
+    timestamps = [np.arange(10) * 0.5, np.arange(8) * 0.5 + 0.75]
+    datas = [np.arange(10, dtype=float), np.arange(8, dtype=float) * 2]
+
+    new_times, new_data = epoching.resample_streams(timestamps, datas, 0.75, 4.25, 4)
+
+    assert np.array_equal(new_times, np.linspace(0.75, 4.25, num=14))
+    assert new_data.shape == (2, 14)
+    # Both streams are linear, the approximated ends stay on the line.
+    assert np.allclose(new_data[0], new_times * 2, rtol=0, atol=1e-12)
+    assert np.allclose(new_data[1], (new_times - 0.75) * 4, rtol=0, atol=1e-12)
+
+
+def test_align_markers_with_grid_positions():
+    timestamps, _, marker_times = make_stream(7)
+    grid = np.linspace(timestamps[0], timestamps[-1], num=2000)
+    grid.flags.writeable = False
+    markers = {
+        'timestamps': marker_times,
+        'grid_timestamps': grid,
+        'grid_positions': np.searchsorted(grid, marker_times, side='left')
+    }
+
+    inds = list(range(0, len(marker_times), 3))
+    positions = get_grid_positions(markers, grid, inds)
+    assert get_grid_positions(markers, timestamps, inds) is None
+    assert align_markers(grid, marker_times[inds], positions=positions) == \
+        align_markers(grid, marker_times[inds])
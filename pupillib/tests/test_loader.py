@@ -0,0 +1,85 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import numpy as np
+import yaml
+
+# Loader tests - these tests make sure that loading the datasets in
+# processes gives the same datasets as loading them in threads.
+from pupillib.pupil_lib import PupilLibRunner
+from pupillib.dependencies.xdf.Python.xdf import load_xdf
+from test_xdf import write_recording
+
+DATA_NAMES = ['eye0', 'gaze_x', 'gaze_x-pyrep', 'gaze_y-pyrep']
+
+
+def load_datasets(tmp_path, datasets, loader):
+    yaml_config = {
+        'config': {
+            'workers': 2,
+            'logger': 'stdout',
+            'output_dir': str(tmp_path),
+            'trial_time': 1,
+            'baseline_time': -0.5,
+            'triggers': ['S11', 'S12'],
+            'loader': loader,
+            'testing': False
+        }
+    }
+    for num, dataset in enumerate(datasets, 1):
+        yaml_config['dataset' + str(num)] = {'dataset_path': dataset, 'data_names': DATA_NAMES}
+
+    yaml_path = str(tmp_path / (loader + '.yml'))
+    with open(yaml_path, 'w') as f:
+        yaml.safe_dump(yaml_config, f)
+
+    plibrunner = PupilLibRunner(quiet=True)
+    plibrunner.get_build_config(yaml_path=yaml_path)
+    plibrunner.load()
+    return plibrunner.get_datasets()
+
+
+def test_load_datasets_in_processes(tmp_path):
+    # The first dataset is the longest one, so it finishes loading last.
+    datasets = [write_recording(str(tmp_path / 'a.xdf'), 1, seconds=60),
+                write_recording(str(tmp_path / 'b.xdf'), 2, seconds=10),
+                write_recording(str(tmp_path / 'c.xdf'), 3, seconds=20)]
+
+    expected = load_datasets(tmp_path, datasets, 'thread')
+    loaded = load_datasets(tmp_path, datasets, 'process')
+
+    assert [dataset['dataset_name'] for dataset in loaded] == ['dataset1', 'dataset2', 'dataset3']
+    assert [dataset['dir'] for dataset in loaded] == datasets
+    for dataset, exp in zip(loaded, expected):
+        assert set(dataset) == set(exp)
+        for name in DATA_NAMES:
+            for field in ('data', 'timestamps'):
+                assert isinstance(dataset[name][field], np.ndarray)
+                assert np.array_equal(dataset[name][field], exp[name][field])
+            assert dataset[name]['srate'] == exp[name]['srate']
+        assert np.array_equal(dataset['markers']['timestamps'], exp['markers']['timestamps'])
+        assert list(dataset['markers']['eventnames']) == list(exp['markers']['eventnames'])
+
+    # The python representation is parsed into the same values as the primitives.
+    streams, _ = load_xdf(datasets[0], verbose=False, dejitter_timestamps=False)
+    gaze = streams[1]['time_series']
+    assert np.array_equal(loaded[0]['gaze_x-pyrep']['data'], gaze[:, 3])
+    assert np.array_equal(loaded[0]['gaze_y-pyrep']['data'], gaze[:, 4])
+    assert np.array_equal(loaded[0]['gaze_x']['data'], gaze[:, 3])
@@ -0,0 +1,78 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import numpy as np
+
+from pupillib.core.workers.processors.trial_processor import (
+    filter_fft_data,
+    filter_fft_trials,
+    get_fft_mask,
+    get_trial_rejections,
+    moving_average_trials
+)
+
+
+def test_filter_fft_trials():
+    rng = np.random.RandomState(0)
+    datas = [rng.normal(size=size) + 3 for size in (256, 256, 101, 1)]
+    srate, low_freq, high_freq = 128, 0.5, 4
+
+    filtered = filter_fft_trials(datas, low_freq, high_freq, srate)
+
+    for data, filt in zip(datas, filtered):
+        # Same filter with a full complex FFT on the mirrored signal.
+        start = int(len(data) / 2)
+        pad_data = np.concatenate([data[:start][::-1], data, data[start:][::-1]])
+        freq_bins = np.fft.fftfreq(pad_data.size, d=1 / srate)
+        freq_signal = np.fft.fft(pad_data)
+        freq_signal[((abs(freq_bins) < low_freq) | (abs(freq_bins) > high_freq)) & (freq_bins != 0)] = 0
+        expected = np.fft.ifft(freq_signal).real[start:start + len(data)]
+
+        assert np.allclose(filt, expected, rtol=0, atol=1e-12)
+        assert np.array_equal(filter_fft_data(data, low_freq, high_freq, srate), filt)
+
+    assert get_fft_mask(512, srate, low_freq, high_freq) is get_fft_mask(512, srate, low_freq, high_freq)
+
+
+def test_moving_average_trials():
+    rng = np.random.RandomState(1)
+    datas = [rng.normal(size=size) + 4 for size in (200, 200, 7)]
+    datas[1][50] = np.nan
+
+    averaged = moving_average_trials(datas, 8)
+
+    for data, avg in zip(datas, averaged):
+        pad_data = np.concatenate([data[:9][::-1], data, data[-9:][::-1]])
+        expected = [np.mean(pad_data[count - 4:count + 5]) for count in range(9, len(pad_data) - 9)]
+        assert np.allclose(avg, expected, rtol=0, atol=1e-12, equal_nan=True)
+    assert np.sum(np.isnan(averaged[1])) == 9
+
+
+def test_get_trial_rejections():
+    datas = [np.array([0.001, 0.2, 0.004, 3]), np.array([1., 2., 0.]), np.array([1., 5., 2., 2., 2.])]
+
+    rejections = get_trial_rejections(datas, zeros_to_count=1, digit_tolerance=2)
+    assert list(rejections) == [True, False, False]
+
+    rejections = get_trial_rejections(datas, gtval=5, ltval=-1)
+    assert list(rejections) == [False, False, True]
+
+    rejections = get_trial_rejections(datas, zeros_to_count=1, digit_tolerance=2, ltval=0)
+    assert list(rejections) == [True, True, False]
@@ -0,0 +1,102 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+import os
+import threading
+
+import numpy as np
+import pytest
+
+# Scheduler tests - these tests make sure that the tasks run after
+# their dependencies, including the ones added while running.
+from pupillib.core.plib_parser import plan_worker_count, update_worker_count_with_trials
+from pupillib.core.workers.scheduler import Task, TaskScheduler, get_num_workers
+
+
+def test_task_dependencies():
+    scheduler = TaskScheduler(4)
+    order = []
+    lock = threading.Lock()
+
+    def record(name):
+        with lock:
+            order.append(name)
+        return name
+
+    def add_children(parent):
+        record(parent)
+        children = [scheduler.add_task(parent + str(i), record, parent + str(i)) for i in range(20)]
+        scheduler.add_dependencies(post, children)
+
+    pre = Task('pre', add_children, 'pre', dependencies=[scheduler.add_task('load', record, 'load')])
+    post = Task('post', record, 'post', dependencies=[pre])
+    scheduler.submit(pre, post)
+    scheduler.run()
+
+    assert order[:2] == ['load', 'pre']
+    assert order[-1] == 'post'
+    assert sorted(order[2:-1]) == sorted('pre' + str(i) for i in range(20))
+    assert post.result == 'post'
+
+
+def test_task_errors():
+    scheduler = TaskScheduler(2)
+
+    def fail():
+        raise ValueError('failed')
+
+    after = scheduler.add_task('after', lambda: 'done', dependencies=[scheduler.add_task('fail', fail)])
+    with pytest.raises(ValueError):
+        scheduler.run()
+    assert not after.done
+
+
+def test_get_num_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 4)
+    assert get_num_workers({'max_workers': 100}) == 4
+    assert get_num_workers({'max_workers': 2}) == 2
+    assert get_num_workers({'max_workers': None}) == 4
+    assert get_num_workers({'max_workers': 100, 'no_parallel': True}) == 1
+
+
+def test_plan_worker_count(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    def make_dataset(seconds, num_markers):
+        stream = {'data': np.ones(seconds * 100), 'timestamps': np.arange(seconds * 100) / 100}
+        return {
+            'custom_data': True,
+            'dataname_list': ['gaze_x'],
+            'gaze_x': stream,
+            'markers': {'eventnames': ['S1'] * num_markers + ['S2']}
+        }
+
+    config = {'max_workers': 8, 'triggers': ['S1', 'S2'], 'trial_range': [-1, 2],
+              'parsed_yaml': {'short:gaze_x:triggerS1': {'trial_range': [-1, 1]}}}
+    config = plan_worker_count(config, [make_dataset(7200, 800), make_dataset(300, 10)], ['long', 'short'])
+    plan = config['worker_plan']
+
+    # Trial windows of 3s and 2s at ~100Hz.
+    assert plan['long:gaze_x:triggerS1']['cost'] == pytest.approx(800 * 300, rel=1e-4)
+    assert plan['short:gaze_x:triggerS1']['cost'] == pytest.approx(10 * 200, rel=1e-4)
+    assert plan['long']['cost'] == pytest.approx(720000 + 800 * 300 + 300, rel=1e-4)
+    assert plan['long']['workers'] == 8 and plan['short']['workers'] == 1
+
+    config = update_worker_count_with_trials(config, 800, 'long:gaze_x:triggerS1')
+    assert config['trial_workers'] == 2 and config['trials_per_worker'] == 400
@@ -0,0 +1,234 @@
+'''
+(*)~---------------------------------------------------------------------------
+This file is part of Pupil-lib.
+
+Pupil-lib is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Pupil-lib is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Pupil-lib.  If not, see <https://www.gnu.org/licenses/>.
+
+Copyright (C) 2018  Gregory W. Mierzwinski
+---------------------------------------------------------------------------~(*)
+'''
+
+import json
+import os
+import struct
+import numpy as np
+import pytest
+
+# XDF loading tests - these tests write small XDF files and make sure
+# that they are decoded correctly.
+from pupillib.dependencies.xdf.Python.xdf import iter_xdf, load_xdf
+
+FMT2CHAR = {'int16': 'h', 'float32': 'f', 'double64': 'd', 'string': None}
+
+
+def varlen(num):
+    if num < 256:
+        return b'\x01' + struct.pack('B', num)
+    return b'\x04' + struct.pack('<I', num)
+
+
+def chunk(tag, content):
+    body = struct.pack('<H', tag) + content
+    return varlen(len(body)) + body
+
+
+def stream_header(sid, name, nchns, srate, fmt):
+    xml = ('<?xml version="1.0"?><info><name>%s</name><type>Test</type>'
+           '<channel_count>%d</channel_count><nominal_srate>%d</nominal_srate>'
+           '<channel_format>%s</channel_format></info>' % (name, nchns, srate, fmt))
+    return chunk(2, struct.pack('<I', sid) + xml.encode())
+
+
+def samples_chunk(sid, fmt, rows, stamps):
+    content = struct.pack('<I', sid) + varlen(len(rows))
+    for row, stamp in zip(rows, stamps):
+        if stamp is None:
+            content += b'\x00'
+        else:
+            content += b'\x01' + struct.pack('<d', stamp)
+        if fmt == 'string':
+            for val in row:
+                content += varlen(len(val.encode())) + val.encode()
+        else:
+            content += struct.pack('<%d%s' % (len(row), FMT2CHAR[fmt]), *row)
+    return chunk(3, content)
+
+
+def write_xdf(path, streams, clock_offsets=()):
+    # streams: list of (name, fmt, srate, [(rows, stamps), ...])
+    # clock_offsets: list of (time, offset), written for every stream
+    data = b'XDF:' + chunk(1, b'<?xml version="1.0"?><info><version>1.0</version></info>')
+    for sid, (name, fmt, srate, chunks) in enumerate(streams, 1):
+        nchns = len(chunks[0][0][0])
+        data += stream_header(sid, name, nchns, srate, fmt)
+    for sid, (name, fmt, srate, chunks) in enumerate(streams, 1):
+        for rows, stamps in chunks:
+            data += samples_chunk(sid, fmt, rows, stamps)
+        for time, offset in clock_offsets:
+            data += chunk(4, struct.pack('<Idd', sid, time, offset))
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def write_recording(path, seed, seconds=30, srate=120):
+    # Writes a small recording like the ones made with the Pupil LSL relay:
+    # eye0 and gaze primitives, the gaze python representation, and markers.
+    rng = np.random.RandomState(seed)
+    stamps = 100 + np.cumsum((1 + rng.uniform(-0.2, 0.2, seconds * srate)) / srate)
+    eye0 = np.column_stack([3 + np.sin(stamps) + rng.normal(0, 0.05, len(stamps)),
+                            rng.rand(len(stamps)), stamps, rng.rand(len(stamps)), rng.rand(len(stamps))])
+    gaze = np.column_stack([rng.rand(len(stamps)), rng.rand(len(stamps)), stamps,
+                            rng.rand(len(stamps)), rng.rand(len(stamps))])
+    pyrep = [[repr({'norm_pos': [x, y], 'timestamp': t})] for x, y, t in gaze[:, [3, 4, 2]].tolist()]
+    marker_times = np.sort(rng.uniform(stamps[0] + 2, stamps[-1] - 2, 12))
+    markers = [['S11' if num % 2 else 'S12'] for num in range(len(marker_times))]
+
+    def chunks(rows):
+        return [(rows[i:i + 500], stamps[i:i + 500].tolist()) for i in range(0, len(rows), 500)]
+
+    write_xdf(path, [
+        ('Pupil Primitive Data - Eye 0', 'double64', srate, chunks(eye0.tolist())),
+        ('Gaze Primitive Data', 'double64', srate, chunks(gaze.tolist())),
+        ('Gaze Python Representation', 'string', srate, chunks(pyrep)),
+        ('Markers', 'string', 0, [(markers, marker_times.tolist())]),
+    ], clock_offsets=[(time, 0.001) for time in np.linspace(stamps[0], stamps[-1], 6)])
+    return path
+
+
+@pytest.fixture
+def xdf_file(tmp_path):
+    numeric = [
+        # Every sample has a time stamp.
+        ([[1.5, 2.0], [3.0, 4.25], [5.0, 6.0]], [10.0, 10.01, 10.02]),
+        # No sample has a time stamp.
+        ([[7.0, 8.0], [9.0, 10.0]], [None, None]),
+        # Mixed time stamps.
+        ([[11.0, 12.0], [13.0, 14.0], [15.0, 16.0]], [10.5, None, 10.6]),
+    ]
+    ints = [([[1], [-2], [300]], [None, None, None])]
+    strings = [([['S11'], ['S12']], [11.0, None]), ([['{\'a\': 1}']], [12.0])]
+
+    path = str(tmp_path / 'test.xdf')
+    write_xdf(path, [
+        ('Pupil Primitive Data - Eye 0', 'double64', 100, numeric),
+        ('Ints', 'int16', 10, ints),
+        ('Markers', 'string', 0, strings),
+    ])
+    return path
+
+
+def test_numeric_chunks(xdf_file):
+    streams, fileheader = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                                   dejitter_timestamps=False)
+    assert fileheader['info']['version'] == ['1.0']
+
+    pupil = streams[0]
+    assert pupil['time_series'].dtype == np.float64
+    assert pupil['time_series'].tolist() == [
+        [1.5, 2.0], [3.0, 4.25], [5.0, 6.0], [7.0, 8.0], [9.0, 10.0],
+        [11.0, 12.0], [13.0, 14.0], [15.0, 16.0]
+    ]
+    # Missing time stamps are deduced from the nominal sampling rate.
+    assert np.allclose(pupil['time_stamps'],
+                       [10.0, 10.01, 10.02, 10.03, 10.04, 10.5, 10.51, 10.6])
+
+    ints = streams[1]
+    assert ints['time_series'].tolist() == [[1.0], [-2.0], [300.0]]
+    assert np.allclose(ints['time_stamps'], [0.1, 0.2, 0.3])
+
+
+def test_string_chunks(xdf_file):
+    streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                          dejitter_timestamps=False)
+
+    markers = streams[2]
+    assert markers['time_series'] == [['S11'], ['S12'], ['{\'a\': 1}']]
+    assert markers['time_stamps'].tolist() == [11.0, 11.0, 12.0]
+
+
+def test_select_streams(xdf_file):
+    streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                          dejitter_timestamps=False,
+                          select_streams=['Markers', 'Ints'])
+    assert [s['info']['name'][0] for s in streams] == ['Ints', 'Markers']
+    assert streams[0]['time_series'].tolist() == [[1.0], [-2.0], [300.0]]
+
+    streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                          dejitter_timestamps=False,
+                          select_streams=lambda info: info['type'][0] == 'Test')
+    assert len(streams) == 3
+
+    # The memory-mapped reader gives the same results as the plain one.
+    full, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                       dejitter_timestamps=False)
+    mapped, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                         dejitter_timestamps=False, use_mmap=True)
+    assert np.array_equal(full[0]['time_stamps'], mapped[0]['time_stamps'])
+    assert np.array_equal(full[0]['time_series'], mapped[0]['time_series'])
+
+
+def test_index_file(xdf_file):
+    expected, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                           dejitter_timestamps=False)
+
+    # The first load stores the chunk index, the second one uses it.
+    for _ in range(2):
+        streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                              dejitter_timestamps=False, cache_index=True)
+        assert os.path.exists(xdf_file + '.index.json')
+        assert streams[0]['time_series'].tolist() == expected[0]['time_series'].tolist()
+        assert streams[2]['time_series'] == expected[2]['time_series']
+
+    # An index that doesn't match the file anymore is rebuilt.
+    with open(xdf_file + '.index.json') as f:
+        stored = json.load(f)
+    stored['streams']['1']['samples'] = []
+    stored['file']['mtime'] -= 10
+    with open(xdf_file + '.index.json', 'w') as f:
+        json.dump(stored, f)
+
+    streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                          dejitter_timestamps=False, cache_index=True)
+    assert streams[0]['time_series'].tolist() == expected[0]['time_series'].tolist()
+
+
+def test_iter_xdf(xdf_file):
+    blocks = list(iter_xdf(xdf_file, select_streams=['Pupil Primitive Data - Eye 0', 'Markers']))
+    assert [stream['info']['name'][0] for stream, _, _ in blocks] == \
+        ['Pupil Primitive Data - Eye 0'] * 3 + ['Markers'] * 2
+
+    # Blocks are yielded chunk by chunk, and concatenate to the full stream.
+    expected, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                           dejitter_timestamps=False)
+    assert [len(stamps) for _, _, stamps in blocks] == [3, 2, 3, 2, 1]
+    assert np.concatenate([values for _, values, _ in blocks[:3]]).tolist() == \
+        expected[0]['time_series'].tolist()
+    assert np.array_equal(np.concatenate([stamps for _, _, stamps in blocks[:3]]),
+                          expected[0]['time_stamps'])
+    assert blocks[3][1] == [['S11'], ['S12']]
+
+
+def test_decode_in_processes(xdf_file):
+    expected, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                           dejitter_timestamps=False)
+    streams, _ = load_xdf(xdf_file, verbose=False, synchronize_clocks=False,
+                          dejitter_timestamps=False, max_workers=2)
+
+    # Streams come back in their original order.
+    assert [s['info']['name'][0] for s in streams] == \
+        [s['info']['name'][0] for s in expected]
+    for stream, exp in zip(streams[:2], expected[:2]):
+        assert np.array_equal(stream['time_series'], exp['time_series'])
+        assert np.array_equal(stream['time_stamps'], exp['time_stamps'])
+    assert streams[2]['time_series'] == expected[2]['time_series']